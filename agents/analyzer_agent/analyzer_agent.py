@@ -8,6 +8,7 @@ import sys
 sys.path.append('..')
 from chat_protocol import chat_proto
 from query_protocol import query_protocol, RequestResponse
+from stream_protocol import stream_protocol, StreamedAnswer, AnswerVerdict, VERDICT_RETRACT
 from uagents_core.contrib.protocols.chat import ChatMessage, TextContent, ChatAcknowledgement, chat_protocol_spec
 
 load_dotenv()
@@ -36,6 +37,25 @@ async def analyze_query(ctx: Context, sender: str, msg: RequestResponse):
         ctx.logger.info("Response needs improvement, sending to respondent agent with improvement flag")
         await ctx.send(RESPONDENT_AGENT_ADDRESS, RequestResponse(request=msg.request + "\n\nPlease improve this response.", response=msg.response ))
 
+@stream_protocol.on_message(model=StreamedAnswer)
+async def analyze_streamed_answer(ctx: Context, sender: str, msg: StreamedAnswer):
+    """Verify an answer the user is already reading, retracting it if it does not hold up."""
+    ctx.logger.info(f"Received streamed answer {msg.stream_id} from {sender}")
+
+    is_correct = await check_response(msg.request, msg.response)
+
+    if is_correct:
+        ctx.logger.info("Streamed answer is correct. Forwarding to respondent agent for tool analysis.")
+        await ctx.send(RESPONDENT_AGENT_ADDRESS, msg)
+    else:
+        ctx.logger.info("Streamed answer failed verification, retracting it")
+        await ctx.send(CANVAS_AGENT_ADDRESS, AnswerVerdict(
+            request=msg.request,
+            stream_id=msg.stream_id,
+            verdict=VERDICT_RETRACT,
+            note="This answer didn't pass verification against your question, so please don't rely on it. Try rephrasing your question."
+        ))
+
 @chat_proto.on_message(ChatMessage)
 async def handle_chat_message(ctx: Context, sender: str, msg: ChatMessage):
     try:
@@ -137,6 +157,7 @@ analyzer_agent = Agent(
 )
 
 analyzer_agent.include(query_protocol)
+analyzer_agent.include(stream_protocol)
 analyzer_agent.include(chat_proto)
 
 if __name__ == "__main__":
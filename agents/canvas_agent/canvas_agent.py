@@ -6,8 +6,9 @@ import sys
 sys.path.append('..')
 from chat_protocol import chat_proto, create_text_chat
 from problem_protocol import problem_protocol
-from query_protocol import query_protocol, QueryRequest, RequestResponse
+from query_protocol import query_protocol, QueryRequest, RequestResponse, INIT_PROGRESS_PREFIX
 from visualization_protocol import visualization_protocol, ImageResponse
+from stream_protocol import stream_protocol, AnswerChunk, AnswerVerdict, VERDICT_ANNOTATE, VERDICT_RETRACT
 from uagents_core.contrib.protocols.chat import ChatMessage, TextContent, ChatAcknowledgement
 from datetime import datetime
 load_dotenv()
@@ -32,6 +33,11 @@ client = OpenAI(api_key=OPENAI_API_KEY)
 class RequestResponse(Model):
     request: str
     response: str
+    user: str = ""
+
+# Answers being streamed to the user, by stream id; the oldest are dropped past MAX_OPEN_STREAMS
+MAX_OPEN_STREAMS = 64
+answer_streams = {}
 
 
 def clear_storage(ctx: Context):
@@ -170,7 +176,8 @@ async def handle_chat_message(ctx: Context, sender: str, msg: ChatMessage):
                         QUERY_AGENT_ADDRESS,
                         RequestResponse(
                             request=f"init_rag,{canvas_token},{school_domain}",
-                            response=""
+                            response="",
+                            user=sender
                         )
                     )
                     return
@@ -188,15 +195,21 @@ async def handle_chat_message(ctx: Context, sender: str, msg: ChatMessage):
                 # Forward to appropriate agent based on classification
                 if query_type == "general":
                     ctx.logger.info(f"Forwarding general query to Query Agent: {query}")
-                    await ctx.send(QUERY_AGENT_ADDRESS, RequestResponse(request=query, response=""))
+                    await ctx.send(QUERY_AGENT_ADDRESS, RequestResponse(request=query, response="", user=sender))
                 else:
                     ctx.logger.info(f"Forwarding problem-solving query to Problem Solver Agent: {query}")
-                    await ctx.send(PROBLEM_SOLVER_AGENT_ADDRESS, QueryRequest(query=query))
+                    await ctx.send(PROBLEM_SOLVER_AGENT_ADDRESS, QueryRequest(query=query, user=sender))
 
 @query_protocol.on_message(RequestResponse)
 async def handle_response(ctx: Context, sender: str, msg: RequestResponse):
     ctx.logger.info(f"Received response from {sender}: {msg.response}")
     
+    # Initialization runs in the background on the query agent; relay its progress and keep waiting
+    if sender == QUERY_AGENT_ADDRESS and msg.response.startswith(INIT_PROGRESS_PREFIX):
+        progress = msg.response[len(INIT_PROGRESS_PREFIX):].strip()
+        await send_response_to_user(ctx, f"⏳ {progress}", end_session=False)
+        return
+
     # Check if we're waiting for initialization response
     if ctx.storage.get("waiting_for_init") == "true" and sender == QUERY_AGENT_ADDRESS:
         ctx.storage.set("waiting_for_init", "")
@@ -215,25 +228,27 @@ async def handle_response(ctx: Context, sender: str, msg: RequestResponse):
     if sender == ANALYZER_AGENT_ADDRESS:
         # Response from analyzer needs to be re-routed based on query type
         classification = classify_query_with_llm(msg.request)
+        # The query agent routes by the student, never by this agent's address
+        user = msg.user or ctx.storage.get("current_sender") or ""
         if classification == "general":
             ctx.logger.info(f"Re-routing to Query Agent: {msg.request}")
-            await ctx.send(QUERY_AGENT_ADDRESS, msg)
+            await ctx.send(QUERY_AGENT_ADDRESS, RequestResponse(request=msg.request, response=msg.response, user=user))
         else:
             ctx.logger.info(f"Re-routing to Problem Solver Agent: {msg.request}")
-            await ctx.send(PROBLEM_SOLVER_AGENT_ADDRESS, QueryRequest(query=msg.request))
+            await ctx.send(PROBLEM_SOLVER_AGENT_ADDRESS, QueryRequest(query=msg.request, user=user))
     else:
         # This is a response from other agents (query/problem/respondent), send to user
         await send_response_to_user(ctx, msg.response)
 
-async def send_response_to_user(ctx: Context, response_text: str):
-    """Helper function to send final response to user"""
+async def send_response_to_user(ctx: Context, response_text: str, end_session: bool = True):
+    """Helper function to send a response to the user (final unless end_session is False)"""
     original_sender = ctx.storage.get("current_sender")
     if original_sender:
         ctx.logger.info(f"Sending final response to {original_sender}")
         try:
             await ctx.send(
                 original_sender,
-                create_text_chat(response_text, end_session=True)
+                create_text_chat(response_text, end_session=end_session)
             )
         except Exception as e:
             ctx.logger.error(f"Failed to send response to {original_sender}: {e}")
@@ -241,6 +256,54 @@ async def send_response_to_user(ctx: Context, response_text: str):
     else:
         ctx.logger.warning("No original sender found for response")
 
+def get_answer_stream(stream_id: str) -> dict:
+    if stream_id not in answer_streams:
+        while len(answer_streams) >= MAX_OPEN_STREAMS:
+            answer_streams.pop(next(iter(answer_streams)))
+        answer_streams[stream_id] = {"next_seq": 0, "pending": {}, "done": False, "verdicts": []}
+    return answer_streams[stream_id]
+
+@stream_protocol.on_message(model=AnswerChunk)
+async def handle_answer_chunk(ctx: Context, sender: str, msg: AnswerChunk):
+    """Relay part of an answer to the user as soon as it is generated"""
+    stream = get_answer_stream(msg.stream_id)
+    stream["pending"][msg.seq] = msg
+
+    # Chunks can overtake each other on the way, so they are relayed in sequence order
+    while stream["next_seq"] in stream["pending"]:
+        chunk = stream["pending"].pop(stream["next_seq"])
+        stream["next_seq"] += 1
+        if chunk.text:
+            await send_response_to_user(ctx, chunk.text, end_session=False)
+        stream["done"] = stream["done"] or chunk.done
+
+    # Verdicts that arrived before the end of the answer apply once it is complete
+    if stream["done"]:
+        verdicts, stream["verdicts"] = stream["verdicts"], []
+        for verdict in verdicts:
+            await apply_answer_verdict(ctx, verdict)
+
+@stream_protocol.on_message(model=AnswerVerdict)
+async def handle_answer_verdict(ctx: Context, sender: str, msg: AnswerVerdict):
+    """Annotate, retract or conclude an answer the user has already been shown"""
+    ctx.logger.info(f"Received {msg.verdict} verdict for answer {msg.stream_id} from {sender}")
+    stream = get_answer_stream(msg.stream_id)
+    if not stream["done"]:
+        stream["verdicts"].append(msg)
+        return
+    await apply_answer_verdict(ctx, msg)
+
+async def apply_answer_verdict(ctx: Context, msg: AnswerVerdict):
+    if msg.verdict == VERDICT_ANNOTATE:
+        await send_response_to_user(ctx, msg.note, end_session=False)
+        return
+    answer_streams.pop(msg.stream_id, None)
+    if msg.verdict == VERDICT_RETRACT:
+        await send_response_to_user(ctx, f"⚠️ {msg.note}")
+    else:
+        # Verified: the answer stands as streamed, so the last message only ends the session
+        await send_response_to_user(ctx, msg.note)
+
 @visualization_protocol.on_message(model=ImageResponse)
 async def handle_image_response(ctx: Context, sender: str, msg: ImageResponse):
     """Handle image responses from visualization agent"""
@@ -267,6 +330,7 @@ canvas_agent.include(chat_proto, publish_manifest=True)
 canvas_agent.include(problem_protocol)
 canvas_agent.include(query_protocol)
 canvas_agent.include(visualization_protocol)
+canvas_agent.include(stream_protocol)
 
 if __name__ == "__main__":
     canvas_agent.run()
@@ -12,7 +12,8 @@ from uagents_core.contrib.protocols.chat import (
 )
 
 def create_text_chat(text: str, end_session: bool = True) -> ChatMessage:
-    content = [TextContent(type="text", text=text)]
+    # An empty text with end_session only closes the session, e.g. after a streamed answer
+    content = [TextContent(type="text", text=text)] if text else []
     if end_session:
         content.append(EndSessionContent(type="end-session"))
     return ChatMessage(
@@ -21,6 +22,12 @@ def create_text_chat(text: str, end_session: bool = True) -> ChatMessage:
         content=content,
     )
 
+def chat_stream_sender(ctx: Context, destination: str):
+    """Send the batches of an AnswerStreamer as chat messages; the last one ends the session"""
+    async def send(text: str, seq: int, done: bool):
+        await ctx.send(destination, create_text_chat(text, end_session=done))
+    return send
+
 chat_proto = Protocol(spec=chat_protocol_spec)
 
 @chat_proto.on_message(ChatMessage)
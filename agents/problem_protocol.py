@@ -2,6 +2,8 @@ from uagents import Protocol, Model
 
 class QueryRequest(Model):
     query: str
+    # Address the student's query originally came from, when an agent relays it; their shard is routed by it
+    user: str = ""
 
 problem_protocol = Protocol("Problem Solving")
 
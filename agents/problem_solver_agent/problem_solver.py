@@ -3,12 +3,13 @@ from uuid import uuid4
 from uagents import Agent, Context
 from dotenv import load_dotenv
 import os
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import sys
 sys.path.append('..')
 from query_protocol import query_protocol, RequestResponse
 from problem_protocol import problem_protocol, QueryRequest
-from chat_protocol import chat_proto
+from chat_protocol import chat_proto, chat_stream_sender
+from stream_protocol import STREAM_ANSWERS, AnswerStreamer, StreamedAnswer, chunk_sender, new_stream_id
 from uagents_core.contrib.protocols.chat import ChatMessage, TextContent, ChatAcknowledgement
 
 load_dotenv()
@@ -21,6 +22,8 @@ CANVAS_AGENT_ADDRESS = "agent1q053mc5vkw5pxx0xhx54v4y2l34chwyn4jsw9eahvlrfrt8pfc
 ANALYZER_AGENT_ADDRESS = "agent1qfpkhksvee55f2seqvejtsrr6wr9s4gcfz8as53htmqyr6uuvhewjxnvu07"
 
 client = OpenAI(api_key=OPENAI_API_KEY)
+# Streamed completions are read without blocking the agent
+async_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 problem_solver_agent = Agent(
     name="problem_solver_agent",
@@ -32,6 +35,14 @@ problem_solver_agent = Agent(
 
 problem = {}
 
+async def stream_completion(messages: list, streamer: AnswerStreamer) -> str:
+    """Generate with GPT-4, forwarding tokens through the streamer as they arrive, and return the full text"""
+    stream = await async_client.chat.completions.create(model="gpt-4", messages=messages, stream=True)
+    async for event in stream:
+        if event.choices and event.choices[0].delta.content:
+            await streamer.add(event.choices[0].delta.content)
+    return await streamer.close()
+
 @problem_protocol.on_message(model=QueryRequest)
 async def solve_problem(ctx: Context, sender: str, message: QueryRequest):
     ctx.logger.info(f"Received problem-solving request: {message.query}")
@@ -39,20 +50,27 @@ async def solve_problem(ctx: Context, sender: str, message: QueryRequest):
     problem[sender] = message.query
     
     query_text = f"Provide relevant materials for solving: {message.query} DO NOT ATTEMPT TO SOLVE THE PROBLEM AND ONLY PROVIDE THE NECESSARY CONTEXT FROM THE KNOWLEDGE BASE THAT HELP SOLVING THE PROBLEM"
-    await ctx.send(QUERY_AGENT_ADDRESS, QueryRequest(query=query_text))
+    await ctx.send(QUERY_AGENT_ADDRESS, QueryRequest(query=query_text, user=message.user or sender))
 
 @query_protocol.on_message(model=RequestResponse)
 async def receive_query_response(ctx: Context, sender: str, requestresponse: RequestResponse):
     ctx.logger.info(f"Received context from Query Agent: {requestresponse.response}")
 
-    
-    problem_solution = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "Solve the given problem using relevant course materials."},
-            {"role": "user", "content": f"Original Problem: {problem[CANVAS_AGENT_ADDRESS]}\nContext: {requestresponse.response}"}
-        ]
-    )
+    messages = [
+        {"role": "system", "content": "Solve the given problem using relevant course materials."},
+        {"role": "user", "content": f"Original Problem: {problem[CANVAS_AGENT_ADDRESS]}\nContext: {requestresponse.response}"}
+    ]
+
+    if STREAM_ANSWERS:
+        # The student sees the solution while it is written; the analyzer can still annotate or retract it
+        stream_id = new_stream_id()
+        streamer = AnswerStreamer(chunk_sender(ctx, CANVAS_AGENT_ADDRESS, requestresponse.request, stream_id))
+        solution = await stream_completion(messages, streamer)
+        ctx.logger.info(f"Streamed problem solution: {solution}")
+        await ctx.send(ANALYZER_AGENT_ADDRESS, StreamedAnswer(request=requestresponse.request, response=solution, stream_id=stream_id))
+        return
+
+    problem_solution = client.chat.completions.create(model="gpt-4", messages=messages)
     solution = problem_solution.choices[0].message.content
     
     ctx.logger.info(f"Sending problem solution: {solution}")
@@ -81,17 +99,21 @@ async def handle_chat_message(ctx: Context, sender: str, msg: ChatMessage):
 
         ctx.logger.info(f"Received direct chat message from {sender}: {text_content}")
 
+        messages = [
+            {
+                "role": "system",
+                "content": "You are an expert problem solver. Analyze the given problem and provide a detailed solution with clear steps and explanations."
+            },
+            {"role": "user", "content": text_content}
+        ]
+
+        if STREAM_ANSWERS:
+            # Stream the solution as it is written; the last chunk ends the session
+            await stream_completion(messages, AnswerStreamer(chat_stream_sender(ctx, sender)))
+            return
+
         # Use GPT-4 to solve the problem directly
-        completion = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert problem solver. Analyze the given problem and provide a detailed solution with clear steps and explanations."
-                },
-                {"role": "user", "content": text_content}
-            ]
-        )
+        completion = client.chat.completions.create(model="gpt-4", messages=messages)
         solution = completion.choices[0].message.content
 
         # Send the solution back
@@ -3,11 +3,18 @@ from uagents import Protocol, Model
 class RequestResponse(Model):
     request: str
     response: str
+    # Address of the student a relayed request or query is for; the query agent routes their shard by it
+    user: str = ""
 
 class QueryRequest(Model):
     query: str
+    # Address the student's query originally came from, when an agent relays it; their shard is routed by it
+    user: str = ""
+
+# Responses starting with this are interim progress of a background init_rag; the final one is unprefixed
+INIT_PROGRESS_PREFIX = "init_progress:"
 
 query_protocol = Protocol("Query Handling")
 
 # Export the protocol and models
-__all__ = ["query_protocol", "RequestResponse", "QueryRequest"]
+__all__ = ["query_protocol", "RequestResponse", "QueryRequest", "INIT_PROGRESS_PREFIX"]
@@ -12,6 +12,7 @@ import sys
 sys.path.append('..')
 from query_protocol import query_protocol, QueryRequest, RequestResponse
 from visualization_protocol import visualization_protocol, ImageResponse
+from stream_protocol import stream_protocol, StreamedAnswer, AnswerVerdict, VERDICT_ANNOTATE, VERDICT_VERIFIED
 
 load_dotenv()
 
@@ -126,6 +127,37 @@ async def handle_response(ctx: Context, sender: str, msg: RequestResponse):
     except Exception as e:
         ctx.logger.error(f"Error processing response: {e}")
 
+@stream_protocol.on_message(model=StreamedAnswer)
+async def handle_streamed_answer(ctx: Context, sender: str, msg: StreamedAnswer):
+    """Conclude a verified answer the user already has: add a visualization, or just confirm it."""
+    ctx.logger.info(f"Received verified streamed answer {msg.stream_id} from {sender}")
+    ctx.storage.set("last_response", msg.response)
+    ctx.storage.set("last_request", msg.request)
+
+    try:
+        decision = await determine_tool_need(msg.request, msg.response)
+        decision = decision.strip().strip("'").strip('"')
+        ctx.logger.info(f"Tool decision: {decision}")
+
+        if decision.startswith("TOOL") and msg.response:
+            # The visualization (or its failure) ends the session when it reaches the canvas agent
+            await ctx.send(CANVAS_AGENT_ADDRESS, AnswerVerdict(
+                request=msg.request, stream_id=msg.stream_id, verdict=VERDICT_ANNOTATE,
+                note="📊 Generating a visualization..."
+            ))
+            await ctx.send(VISUALIZATION_AGENT_ADDRESS, ToolRequest(
+                params={'data': msg.response, 'title': 'Generated Visualization'}
+            ))
+        else:
+            await ctx.send(CANVAS_AGENT_ADDRESS, AnswerVerdict(
+                request=msg.request, stream_id=msg.stream_id, verdict=VERDICT_VERIFIED
+            ))
+    except Exception as e:
+        ctx.logger.error(f"Error processing streamed answer: {e}")
+        await ctx.send(CANVAS_AGENT_ADDRESS, AnswerVerdict(
+            request=msg.request, stream_id=msg.stream_id, verdict=VERDICT_VERIFIED
+        ))
+
 @respondent_agent.on_message(model=ToolResponse)
 async def handle_visualization_response(ctx: Context, sender: str, response: ToolResponse):
     """Handle visualization responses from tool agents."""
@@ -148,6 +180,7 @@ async def handle_visualization_response(ctx: Context, sender: str, response: Too
 
 respondent_agent.include(query_protocol)
 respondent_agent.include(visualization_protocol)
+respondent_agent.include(stream_protocol)
 
 if __name__ == "__main__":
     respondent_agent.run()
@@ -0,0 +1,95 @@
+import os
+import time
+from uuid import uuid4
+
+from uagents import Protocol, Model
+
+# Stream answers to the user as they are generated instead of after verification
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "true").lower() in ("1", "true", "yes")
+# Tokens are batched into one message per STREAM_FLUSH_CHARS characters or STREAM_FLUSH_SECONDS
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "80"))
+STREAM_FLUSH_SECONDS = float(os.getenv("STREAM_FLUSH_SECONDS", "0.3"))
+
+# Verdicts the verification stages send about an answer already streamed to the user
+VERDICT_VERIFIED = "verified"  # the answer stands: end the session
+VERDICT_ANNOTATE = "annotate"  # add a note under the answer, more may follow
+VERDICT_RETRACT = "retract"  # tell the user not to rely on the answer and end the session
+
+class AnswerChunk(Model):
+    """Part of an answer being generated; chunks are numbered from 0 and the last has done set"""
+    request: str
+    stream_id: str
+    seq: int
+    text: str
+    done: bool = False
+
+class StreamedAnswer(Model):
+    """A complete answer, already streamed to the user, sent on for verification"""
+    request: str
+    response: str
+    stream_id: str
+
+class AnswerVerdict(Model):
+    request: str
+    stream_id: str
+    verdict: str
+    note: str = ""
+
+stream_protocol = Protocol("Answer Streaming")
+
+
+def new_stream_id() -> str:
+    return str(uuid4())
+
+
+class AnswerStreamer:
+    """Forward generated text as it arrives, in batches.
+
+    ``send(text, seq, done)`` is awaited for each batch: once STREAM_FLUSH_CHARS have accumulated
+    or STREAM_FLUSH_SECONDS have passed since the last one, so a token-by-token LLM stream costs a
+    handful of agent messages. ``close`` sends what is left with done set.
+    """
+
+    def __init__(self, send, flush_chars: int = STREAM_FLUSH_CHARS, flush_seconds: float = STREAM_FLUSH_SECONDS):
+        self.send = send
+        self.flush_chars = flush_chars
+        self.flush_seconds = flush_seconds
+        self.parts = []
+        self.buffer = ""
+        self.seq = 0
+        self.last_flush = time.monotonic()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    async def add(self, text: str):
+        self.parts.append(text)
+        self.buffer += text
+        if len(self.buffer) >= self.flush_chars or time.monotonic() - self.last_flush >= self.flush_seconds:
+            await self.flush(done=False)
+
+    async def flush(self, done: bool):
+        if not self.buffer and not done:
+            return
+        await self.send(self.buffer, self.seq, done)
+        self.buffer = ""
+        self.seq += 1
+        self.last_flush = time.monotonic()
+
+    async def close(self) -> str:
+        await self.flush(done=True)
+        return self.text
+
+
+def chunk_sender(ctx, destination: str, request: str, stream_id: str):
+    """Send batches as AnswerChunk messages to another agent"""
+    async def send(text: str, seq: int, done: bool):
+        await ctx.send(destination, AnswerChunk(request=request, stream_id=stream_id, seq=seq, text=text, done=done))
+    return send
+
+# Export the protocol and models
+__all__ = [
+    "stream_protocol", "AnswerChunk", "StreamedAnswer", "AnswerVerdict", "AnswerStreamer", "chunk_sender",
+    "new_stream_id", "STREAM_ANSWERS", "VERDICT_VERIFIED", "VERDICT_ANNOTATE", "VERDICT_RETRACT",
+]
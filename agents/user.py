@@ -11,10 +11,12 @@ CANVAS_AGENT_ADDRESS = "agent1q0uvz4t5tv8dcahzwgks4pymps98ua9m2rnpfguxrzk55zv0xg
 
 class QueryRequest(Model):
     query: str
+    user: str = ""
 
 class RequestResponse(Model):
     request: str
     response: str
+    user: str = ""
 
 
 user_agent = Agent(
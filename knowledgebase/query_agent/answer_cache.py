@@ -0,0 +1,150 @@
+import os
+import re
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Cosine similarity from which two questions count as the same question
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# Tokens that carry digits ("HW3", "CS61A", "2024") must match exactly: embeddings barely tell them apart
+EXACT_TOKEN_PATTERN = re.compile(r"[a-z]*\d[a-z0-9]*")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase words without punctuation, so "When is HW3 due?" and "when is hw3 due" are the same question"""
+    return " ".join(WORD_PATTERN.findall(question.lower()))
+
+
+def get_exact_tokens(question: str) -> frozenset:
+    return frozenset(EXACT_TOKEN_PATTERN.findall(question.lower()))
+
+
+class CacheEntry:
+    def __init__(self, scope: tuple, question: str, vector, answer, seconds: float):
+        self.scope = scope
+        self.question = question
+        self.exact_tokens = get_exact_tokens(question)
+        self.vector = vector
+        self.answer = answer
+        self.seconds = seconds
+        self.created = time.monotonic()
+
+
+class AnswerCache:
+    """Answers keyed by question embedding, so a rephrased question reuses an earlier answer.
+
+    Entries are scoped, normally by (user key, index version, kind of answer): a new index version
+    starts with an empty scope, and ``invalidate`` drops a user's old entries as soon as it is
+    swapped in. Entries expire after ``ttl`` seconds and the least recently used are evicted past
+    ``max_entries``.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (scope, normalized question) -> CacheEntry, in LRU order
+        self.scopes = {}  # scope -> {normalized question: CacheEntry}
+        self.lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    def is_expired(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.created > self.ttl
+
+    def drop(self, entry: CacheEntry):
+        question = normalize_question(entry.question)
+        self.entries.pop((entry.scope, question), None)
+        scope_entries = self.scopes.get(entry.scope)
+        if scope_entries is not None:
+            scope_entries.pop(question, None)
+            if not scope_entries:
+                del self.scopes[entry.scope]
+
+    def hit(self, entry: CacheEntry, semantic: bool):
+        self.entries.move_to_end((entry.scope, normalize_question(entry.question)))
+        if semantic:
+            self.semantic_hits += 1
+        else:
+            self.exact_hits += 1
+        self.seconds_saved += entry.seconds
+        return entry.answer
+
+    def get_exact(self, scope: tuple, question: str):
+        """Get the answer to the same question asked word for word, without embedding it"""
+        with self.lock:
+            entry = self.scopes.get(scope, {}).get(normalize_question(question))
+            if entry is None:
+                return None
+            if self.is_expired(entry):
+                self.drop(entry)
+                return None
+            return self.hit(entry, semantic=False)
+
+    def get_similar(self, scope: tuple, question: str, vector):
+        """Get the answer to the most similar earlier question above the threshold, if any"""
+        exact_tokens = get_exact_tokens(question)
+        with self.lock:
+            candidates = [entry for entry in self.scopes.get(scope, {}).values()
+                          if entry.exact_tokens == exact_tokens and not self.is_expired(entry)]
+            if candidates:
+                similarities = np.stack([entry.vector for entry in candidates]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    return self.hit(candidates[best], semantic=True)
+            self.misses += 1
+            return None
+
+    def put(self, scope: tuple, question: str, vector, answer, seconds: float):
+        entry = CacheEntry(scope, question, vector, answer, seconds)
+        key = (scope, normalize_question(question))
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self.scopes.setdefault(scope, {})[key[1]] = entry
+            while len(self.entries) > self.max_entries:
+                self.drop(next(iter(self.entries.values())))
+
+    def invalidate(self, user_key: str, current_version: str = None) -> int:
+        """Drop a user's entries cached for any index version but current_version, returning how many"""
+        with self.lock:
+            stale = [entry for entry in self.entries.values()
+                     if entry.scope[0] == user_key and entry.scope[1] != current_version]
+            for entry in stale:
+                self.drop(entry)
+        return len(stale)
+
+    async def get_or_compute(self, scope: tuple, question: str, embed_query, compute):
+        """Get a cached answer or await ``compute()`` and cache what it returns.
+
+        ``embed_query`` is only called (off the event loop) when the exact question is not cached.
+        """
+        answer = self.get_exact(scope, question)
+        if answer is not None:
+            return answer
+        vector = np.asarray(await asyncio.to_thread(embed_query, question), dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        answer = self.get_similar(scope, question, vector)
+        if answer is not None:
+            return answer
+
+        start = time.perf_counter()
+        answer = await compute()
+        self.put(scope, question, vector, answer, time.perf_counter() - start)
+        return answer
+
+    def report(self) -> str:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        hit_rate = (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+        return (f"💡 Answer cache: {hit_rate:.0%} hit rate ({self.exact_hits} exact, {self.semantic_hits} similar, "
+                f"{self.misses} misses), {len(self.entries)} entries, {self.seconds_saved:.1f}s of generation saved")
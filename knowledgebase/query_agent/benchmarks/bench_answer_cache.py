@@ -0,0 +1,84 @@
+"""Replay a stream of repeated student questions with and without the semantic answer cache.
+
+Students ask a small set of questions many times over, worded a little differently each time
+("When is HW3 due?", "when is hw3 due", "When is HW3 due please?"). Each uncached answer waits
+--llm-latency seconds, like the GPT-4 call; a cached one only costs a query embedding. Answers
+handed out for the wrong question (e.g. HW4's due date for HW3) are counted as false hits.
+
+Usage: python benchmarks/bench_answer_cache.py [--queries 500] [--questions 40] [--llm-latency 0.05] [--threshold 0.95]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from answer_cache import AnswerCache
+from embedding_pipeline import LocalHashEmbeddings
+
+TEMPLATES = [
+    "When is HW{n} due?",
+    "What topics does lecture {n} cover?",
+    "How many points is quiz {n} worth?",
+    "Where can I find the slides for week {n}?",
+]
+VARIANTS = [
+    lambda q: q,
+    lambda q: q.lower().rstrip("?"),
+    lambda q: "  " + q.upper(),
+    lambda q: q.rstrip("?") + " please?",
+    lambda q: "Hey, " + q[0].lower() + q[1:],
+]
+
+
+def make_workload(queries: int, questions: int, seed: int = 7) -> list:
+    """(base question, asked text) pairs; popular questions come up far more often (Zipf-like)"""
+    bases = [TEMPLATES[i % len(TEMPLATES)].format(n=i // len(TEMPLATES) + 1) for i in range(questions)]
+    weights = [1 / (rank + 1) for rank in range(questions)]
+    rng = random.Random(seed)
+    picks = rng.choices(bases, weights=weights, k=queries)
+    return [(base, rng.choice(VARIANTS)(base)) for base in picks]
+
+
+async def replay(workload: list, cache, embeddings, llm_latency: float):
+    false_hits = 0
+    start = time.perf_counter()
+    for base, asked in workload:
+        async def compute():
+            await asyncio.sleep(llm_latency)
+            return base
+
+        if cache is None:
+            answer = await compute()
+        else:
+            answer = await cache.get_or_compute(("student", "v1", "chat"), asked, embeddings.embed_query, compute)
+        false_hits += answer != base
+    return time.perf_counter() - start, false_hits
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--threshold", type=float, default=0.95)
+    args = parser.parse_args()
+
+    embeddings = LocalHashEmbeddings(dimensions=1536)
+    workload = make_workload(args.queries, args.questions)
+    print(f"{args.queries} queries over {args.questions} questions, LLM latency {args.llm_latency}s\n")
+
+    uncached, _ = asyncio.run(replay(workload, None, embeddings, args.llm_latency))
+    print(f"no cache:     {uncached:6.2f}s, {args.queries} LLM calls")
+
+    cache = AnswerCache(threshold=args.threshold)
+    cached, false_hits = asyncio.run(replay(workload, cache, embeddings, args.llm_latency))
+    print(f"answer cache: {cached:6.2f}s, {cache.misses} LLM calls, {false_hits} false hits")
+    print(cache.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark chunking throughput and chunk sizes: structure-aware token chunker versus the old character splitter.
+
+The synthetic corpus mimics a semester of course material: lecture pages with headings, paragraphs
+and bullet lists, plus assignments. Pass --directory to chunk real extracted course files instead.
+
+Usage: python benchmarks/bench_chunking.py [--courses 6] [--pages 600] [--directory course_files]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from chunking import Chunker, iter_chunks
+from embedding_pipeline import count_tokens, get_encoding
+
+WORDS = ("graph vertex edge path cycle tree heap queue stack recursion proof induction invariant "
+         "algorithm runtime bound memory cache pointer array hash table sort merge partition "
+         "probability variance matrix vector eigenvalue gradient derivative integral limit").split()
+
+
+def make_sentence(rng) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 22))).capitalize() + "."
+
+
+def make_page(rng, course: int, page: int) -> str:
+    parts = [f"LECTURE {page}: {rng.choice(WORDS).upper()} {rng.choice(WORDS).upper()}"]
+    for section in range(rng.randint(2, 4)):
+        parts.append(f"{section + 1}. {rng.choice(WORDS).capitalize()} and {rng.choice(WORDS)}")
+        for _ in range(rng.randint(1, 3)):
+            parts.append(" ".join(make_sentence(rng) for _ in range(rng.randint(2, 6))))
+        if rng.random() < 0.4:
+            parts.append("\n".join(f"- {make_sentence(rng)}" for _ in range(rng.randint(3, 6))))
+    return "\n\n".join(parts)
+
+
+def make_corpus(courses: int, pages: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    documents = []
+    for course in range(courses):
+        for page in range(pages // courses):
+            documents.append({"page_content": make_page(rng, course, page),
+                              "metadata": {"source": f"course_{course}/lecture.pdf", "page": page + 1,
+                                           "course": f"Course {course}", "type": "document"}})
+        for assignment in range(20):
+            documents.append({"page_content": f"Course: Course {course}, Assignment: HW{assignment}, Due: 2024-04-01, "
+                                              f"Description: {' '.join(make_sentence(rng) for _ in range(4))}",
+                              "metadata": {"source": f"canvas:assignment:{course}-{assignment}", "type": "assignment"}})
+    return documents
+
+
+def load_directory(directory: str) -> list:
+    from parse_files import iter_file_records
+    return list(iter_file_records(directory))
+
+
+def character_chunks(documents):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50, add_start_index=True)
+    for doc in documents:
+        for chunk in splitter.create_documents([doc["page_content"]], [doc["metadata"]]):
+            yield {"page_content": chunk.page_content}
+
+
+def measure(name: str, chunk_fn, documents, characters: int):
+    start = time.perf_counter()
+    chunks = list(chunk_fn(documents))
+    seconds = time.perf_counter() - start
+    tokens = [chunk.get("tokens") or count_tokens(chunk["page_content"]) for chunk in chunks]
+    print(f"{name:<22} {seconds:7.2f}s {characters / seconds / 1e6:7.2f} MB/s {len(chunks):8d} chunks "
+          f"{statistics.mean(tokens):7.1f} mean tokens {max(tokens):5d} max {sum(tokens):9d} tokens embedded")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--courses", type=int, default=6)
+    parser.add_argument("--pages", type=int, default=600)
+    parser.add_argument("--directory")
+    args = parser.parse_args()
+
+    documents = load_directory(args.directory) if args.directory else make_corpus(args.courses, args.pages)
+    characters = sum(len(doc["page_content"]) for doc in documents)
+    tokenizer = "tiktoken cl100k_base" if get_encoding() else "estimated (tiktoken unavailable)"
+    print(f"{len(documents)} records, {characters / 1e6:.1f} MB of text, token counts {tokenizer}\n")
+    measure("character splitter", character_chunks, documents, characters)
+    measure("structure-aware", lambda docs: iter_chunks(docs, Chunker()), documents, characters)
+
+
+if __name__ == "__main__":
+    main()
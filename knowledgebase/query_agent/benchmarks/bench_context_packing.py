@@ -0,0 +1,93 @@
+"""Compare the prompt context sent to the LLM with and without the context packer.
+
+The corpus is the synthetic course material of bench_chunking.py, chunked with overlap, plus a
+re-uploaded copy of one course's lectures (a common sight on Canvas) so duplicates turn up in
+search results. For each query, the context is measured as the stuff-documents chain formats it:
+prompt tokens, chunks, chunks repeating text already in the context, and distinct pages covered.
+
+Usage: python benchmarks/bench_context_packing.py [--courses 6] [--pages 300] [--queries 100] [--budget 1024]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_chunking import WORDS, make_corpus
+from chunking import iter_chunks
+from context_packer import CONTEXT_MAX_TOKENS, ContextPacker, get_location
+from embedding_pipeline import LocalHashEmbeddings, count_tokens
+from hybrid_retriever import HybridRetriever
+from index_store import create_vector_store, load_vector_store, save_vector_store
+
+
+def measure_context(docs: list) -> tuple:
+    """(prompt tokens, chunks, redundant chunks, distinct pages) of a context"""
+    redundant, spans = 0, []
+    for doc in docs:
+        start = doc.metadata.get("start_index", 0)
+        end = start + len(doc.page_content)
+        text = " ".join(doc.page_content.split())
+        if any((location == get_location(doc) and start < other_end and other_start < end) or other_text == text
+               for location, other_start, other_end, other_text in spans):
+            redundant += 1
+        spans.append((get_location(doc), start, end, text))
+    pages = len({(doc.metadata.get("course"), doc.metadata.get("page")) for doc in docs})
+    return count_tokens("\n\n".join(doc.page_content for doc in docs)), len(docs), redundant, pages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--courses", type=int, default=6)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--budget", type=int, default=CONTEXT_MAX_TOKENS)
+    args = parser.parse_args()
+
+    documents = make_corpus(args.courses, args.pages)
+    # The same lectures uploaded twice under another name
+    documents += [{"page_content": doc["page_content"], "metadata": {**doc["metadata"], "source": "course_0/lecture_copy.pdf"}}
+                  for doc in documents if doc["metadata"]["source"] == "course_0/lecture.pdf"]
+    chunks = list(iter_chunks(documents))
+    rng = random.Random(1)
+    queries = [f"explain {rng.choice(WORDS)} {rng.choice(WORDS)} and {rng.choice(WORDS)} {rng.choice(WORDS)} with examples"
+               for _ in range(args.queries)]
+
+    embeddings = LocalHashEmbeddings(dimensions=384)
+    with tempfile.TemporaryDirectory() as path:
+        store = create_vector_store(path, embeddings, 384)
+        store.add_texts([chunk["page_content"] for chunk in chunks], metadatas=[chunk["metadata"] for chunk in chunks],
+                        ids=[chunk["id"] for chunk in chunks])
+        save_vector_store(store, path)
+        store.docstore.close()
+        store = load_vector_store(path, embeddings)
+        print(f"{len(chunks)} chunks, {args.queries} queries, budget {args.budget} tokens\n")
+        print(f"{'context':<28} {'tokens':>7} {'chunks':>7} {'redundant':>10} {'pages':>6} {'ms':>6}")
+
+        packer = ContextPacker(max_tokens=args.budget)
+        setups = [
+            ("stuffed, k=4 (before)", HybridRetriever(vector_store=store, k=4), None),
+            ("stuffed, k=12", HybridRetriever(vector_store=store, k=12), None),
+            ("packed from k=12 (after)", HybridRetriever(vector_store=store, k=12), packer),
+        ]
+        for name, retriever, context_packer in setups:
+            rows, seconds = [], 0.0
+            for query in queries:
+                docs = retriever.invoke(query)
+                start = time.perf_counter()
+                if context_packer is not None:
+                    docs = context_packer.pack(store, docs)
+                seconds += time.perf_counter() - start
+                rows.append(measure_context(docs))
+            tokens, count, redundant, pages = (statistics.mean(column) for column in zip(*rows))
+            print(f"{name:<28} {tokens:7.0f} {count:7.1f} {redundant:10.2f} {pages:6.1f} {seconds * 1000 / len(queries):6.2f}")
+        print(f"\n{packer.report()}")
+        store.docstore.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark ingest embedding: one blocking add_texts per batch versus the concurrent pipeline.
+
+Runs fully offline with the local hash embedder; --latency simulates the round trip of a
+remote embedding API per request.
+
+Usage: python benchmarks/bench_embedding.py [--chunks 5000] [--latency 0.5] [--concurrency 4]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from embedding_pipeline import EMBED_BATCH_SIZE, EmbeddingPipeline, LocalHashEmbeddings, iter_token_batches
+from index_store import IndexUpsert
+
+WORDS = ("gradient descent learning rate convergence matrix eigenvalue recursion pointer "
+         "derivative integral entropy protocol thread mutex schedule lecture exam").split()
+
+
+def make_chunks(count: int):
+    for i in range(count):
+        text = " ".join(WORDS[(i * 7 + j * 3) % len(WORDS)] for j in range(60 + i % 40))
+        yield {"id": f"chunk-{i}", "page_content": f"Chunk {i}: {text}", "metadata": {"source": f"doc-{i // 20}"}}
+
+
+def new_store(embeddings) -> FAISS:
+    return FAISS(embedding_function=embeddings, index=faiss.IndexFlatL2(embeddings.dimensions),
+                 docstore=InMemoryDocstore({}), index_to_docstore_id={})
+
+
+def run_serial(embeddings, count: int) -> FAISS:
+    """The previous ingest loop: fixed-size batches, each embedded and added in one blocking call"""
+    store = new_store(embeddings)
+    batch = []
+    for chunk in make_chunks(count):
+        batch.append(chunk)
+        if len(batch) == EMBED_BATCH_SIZE:
+            store.add_texts([c["page_content"] for c in batch], metadatas=[c["metadata"] for c in batch])
+            batch = []
+    if batch:
+        store.add_texts([c["page_content"] for c in batch], metadatas=[c["metadata"] for c in batch])
+    return store
+
+
+def run_pipeline(embeddings, count: int, concurrency: int, max_tokens: int) -> FAISS:
+    store = new_store(embeddings)
+    upsert = IndexUpsert(store)
+    pipeline = EmbeddingPipeline(embeddings, concurrency=concurrency)
+    for batch, vectors in pipeline.run(iter_token_batches(upsert.plan(list(make_chunks(count))), max_tokens)):
+        upsert.add(batch, vectors)
+    print(pipeline.report())
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.5, help="simulated seconds per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-tokens", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    args = parser.parse_args()
+
+    embeddings = LocalHashEmbeddings(dimensions=args.dimensions, latency=args.latency)
+
+    start = time.perf_counter()
+    serial = run_serial(embeddings, args.chunks)
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pipelined = run_pipeline(embeddings, args.chunks, args.concurrency, args.max_tokens)
+    pipeline_time = time.perf_counter() - start
+
+    assert serial.index.ntotal == pipelined.index.ntotal == args.chunks
+    print(f"serial add_texts: {serial_time:6.2f}s  {args.chunks / serial_time:7.0f} chunks/s")
+    print(f"pipeline:         {pipeline_time:6.2f}s  {args.chunks / pipeline_time:7.0f} chunks/s")
+    print(f"speedup:          {serial_time / pipeline_time:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
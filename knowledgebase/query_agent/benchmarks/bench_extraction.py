@@ -0,0 +1,82 @@
+"""Benchmark document extraction: one worker versus the full process pool.
+
+Usage: python benchmarks/bench_extraction.py [--files 40] [--workers N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import docx
+import fitz
+import pandas as pd
+from pptx import Presentation
+
+from parse_files import EXTRACTION_WORKERS, ExtractionMetrics, iter_extractions, list_course_files
+
+PARAGRAPH = ("Gradient descent updates parameters in the direction of the negative gradient. "
+             "The learning rate controls the step size and convergence behaviour. ") * 4
+
+
+def make_corpus(directory: str, files: int, pages: int = 20):
+    """Write a mixed corpus of PDF, DOCX, PPTX, XLSX and TXT files"""
+    for i in range(files):
+        kind = ("pdf", "docx", "pptx", "xlsx", "txt")[i % 5]
+        path = os.path.join(directory, f"doc_{i}.{kind}")
+        if kind == "pdf":
+            pdf = fitz.open()
+            for p in range(pages):
+                pdf.new_page().insert_textbox(fitz.Rect(50, 50, 550, 800), f"Page {p}. {PARAGRAPH}")
+            pdf.save(path)
+        elif kind == "docx":
+            document = docx.Document()
+            for p in range(pages * 5):
+                document.add_paragraph(f"Paragraph {p}. {PARAGRAPH}")
+            document.save(path)
+        elif kind == "pptx":
+            presentation = Presentation()
+            for p in range(pages):
+                slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+                slide.shapes.title.text = f"Slide {p}"
+                slide.placeholders[1].text = PARAGRAPH
+            presentation.save(path)
+        elif kind == "xlsx":
+            pd.DataFrame({
+                "student": [f"s{r}" for r in range(pages * 100)],
+                "score": [r % 100 for r in range(pages * 100)],
+            }).to_excel(path, index=False)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(PARAGRAPH * pages * 5)
+
+
+def run(file_paths, workers: int) -> ExtractionMetrics:
+    metrics = ExtractionMetrics()
+    for result in iter_extractions(file_paths, workers=workers):
+        metrics.record(result)
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=EXTRACTION_WORKERS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_corpus(directory, args.files)
+        file_paths = list(list_course_files(directory))
+
+        for workers in sorted({1, args.workers}):
+            start = time.perf_counter()
+            metrics = run(file_paths, workers)
+            elapsed = time.perf_counter() - start
+            print(f"\n=== workers={workers}: {elapsed:.2f}s ===")
+            print(metrics.report())
+
+
+if __name__ == "__main__":
+    main()
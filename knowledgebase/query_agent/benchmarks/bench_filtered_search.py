@@ -0,0 +1,80 @@
+"""Benchmark metadata-filtered search: LangChain's post-hoc filter versus precomputed ID selectors.
+
+Chunks are spread over courses and types like a student's corpus; filters select one course
+(a few percent of the chunks) or one type (about a third).
+
+Usage: python benchmarks/bench_filtered_search.py [--chunks 50000] [--dimensions 384] [--queries 100]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from embedding_pipeline import LocalHashEmbeddings
+from hybrid_retriever import HybridRetriever
+from index_factory import fit_index
+from index_store import create_vector_store, load_vector_store, save_vector_store
+
+TYPES = ("document", "document", "assignment")
+
+
+def timed(search, queries) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        search(query)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--courses", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = LocalHashEmbeddings(dimensions=args.dimensions)
+    words = [f"term{i}" for i in range(2000)]
+    texts = [" ".join(rng.choice(words, size=30)) for _ in range(args.chunks)]
+    metadatas = [{"source": f"doc_{i}", "course": f"Course {i % args.courses}", "type": TYPES[i % len(TYPES)]}
+                 for i in range(args.chunks)]
+    queries = [" ".join(rng.choice(words, size=8)) for _ in range(args.queries)]
+    filters = {
+        f"one course ({100 / args.courses:.1f}%)": {"course": "Course 7"},
+        "assignments (33%)": {"type": "assignment"},
+    }
+
+    with tempfile.TemporaryDirectory() as path:
+        store = create_vector_store(path, embeddings, args.dimensions)
+        vectors = embeddings.embed_documents(texts)
+        store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=[f"c{i}" for i in range(args.chunks)])
+        store.index = fit_index(store.index)
+        save_vector_store(store, path)
+        store.docstore.close()
+        store = load_vector_store(path, embeddings)
+        retriever = HybridRetriever(vector_store=store, k=args.k, fetch_k=args.k)
+        query_vectors = {query: embeddings.embed_query(query) for query in queries}
+
+        print(f"{args.chunks} chunks x {args.dimensions} dims, k={args.k}\n")
+        unfiltered = timed(lambda q: store.similarity_search_by_vector(query_vectors[q], k=args.k), queries)
+        print(f"{'unfiltered vector search':<40} {unfiltered:8.2f} ms/query")
+        for name, filter in filters.items():
+            post_hoc = timed(lambda q: store.similarity_search_by_vector(
+                query_vectors[q], k=args.k, filter=filter, fetch_k=args.k * 50), queries)
+            store.docstore.metadata_index.clear_cache()
+            first = timed(lambda q: retriever.dense_search(query_vectors[q], store.docstore.metadata_index.select(filter)), queries[:1])
+            selected = timed(lambda q: retriever.dense_search(query_vectors[q], store.docstore.metadata_index.select(filter)), queries)
+            print(f"{name:<24} post-hoc filter  {post_hoc:8.2f} ms/query")
+            print(f"{name:<24} ID selector      {selected:8.2f} ms/query (first query, building the selection: {first:.1f} ms)")
+        store.docstore.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark recall versus latency of the FAISS index families against the exact Flat baseline.
+
+Vectors are drawn around random cluster centres (as embeddings of course material are), so
+approximate indexes behave as they would on real data.
+
+Usage: python benchmarks/bench_index.py [--vectors 100000] [--dimensions 384] [--queries 500]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import faiss
+import numpy as np
+
+import index_factory
+from index_factory import build_index, get_nlist, rebuild_index
+
+
+def make_vectors(count: int, dimensions: int, clusters: int, rng):
+    centres = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    vectors = centres[labels] + 0.35 * rng.standard_normal((count, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def measure(index, queries, truth, k: int):
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    latency = (time.perf_counter() - start) / len(queries) * 1000
+    recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))])
+    return recall, latency
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dimensions", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    vectors = make_vectors(args.vectors, args.dimensions, clusters=max(10, args.vectors // 500), rng=rng)
+    queries = vectors[rng.choice(args.vectors, size=args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    # Searches run one query at a time, as the agent does
+    faiss.omp_set_num_threads(1)
+
+    flat = build_index("flat", args.dimensions)
+    flat.add(vectors)
+    start = time.perf_counter()
+    _, truth = flat.search(queries, args.k)
+    flat_latency = (time.perf_counter() - start) / args.queries * 1000
+
+    print(f"{args.vectors} vectors x {args.dimensions} dims, {args.queries} queries, recall@{args.k}\n")
+    print(f"{'index':<8} {'param':<14} {'build s':>8} {'MB':>8} {'recall':>7} {'ms/query':>9} {'speedup':>8}")
+    print(f"{'flat':<8} {'-':<14} {0.0:8.1f} {flat.ntotal * flat.d * 4 / 1e6:8.1f} {1.0:7.3f} "
+          f"{flat_latency:9.3f} {1.0:7.1f}x")
+
+    sweeps = {
+        "hnsw": ("efSearch", (16, 32, 64, 128, 256)),
+        "ivf": ("nprobe", (1, 4, 16, 64)),
+        "ivfpq": ("nprobe", (1, 4, 16, 64)),
+    }
+    for index_type, (param, values) in sweeps.items():
+        start = time.perf_counter()
+        index = rebuild_index(flat, index_type)
+        build_time = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        for value in values:
+            if param == "nprobe":
+                if value > get_nlist(args.vectors):
+                    continue
+                index_factory.INDEX_NPROBE = value
+            else:
+                index_factory.INDEX_EF_SEARCH = value
+            index_factory.tune_index(index)
+            recall, latency = measure(index, queries, truth, args.k)
+            print(f"{index_type:<8} {f'{param}={value}':<14} {build_time:8.1f} {size_mb:8.1f} {recall:7.3f} "
+                  f"{latency:9.3f} {flat_latency / latency:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
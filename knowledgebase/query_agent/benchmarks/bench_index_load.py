@@ -0,0 +1,95 @@
+"""Benchmark cold start of a saved vector store: pickled InMemoryDocstore versus mmap + SQLite.
+
+Each load runs in a fresh interpreter so load time and resident memory are measured cold.
+
+Usage: python benchmarks/bench_index_load.py [--chunks 50000] [--dimensions 1536]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+QUERY_AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(QUERY_AGENT_DIR)
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from embedding_pipeline import LocalHashEmbeddings
+from index_factory import build_index
+from index_store import create_vector_store, save_vector_store
+
+LOAD_SCRIPT = """
+import json, os, sys, time
+sys.path.append({query_agent_dir!r})
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+from langchain_community.vectorstores import FAISS
+from embedding_pipeline import LocalHashEmbeddings
+from index_store import load_vector_store
+embeddings = LocalHashEmbeddings(dimensions={dimensions})
+before = rss_mb()
+start = time.perf_counter()
+if {layout!r} == "pickle":
+    store = FAISS.load_local({path!r}, embeddings, allow_dangerous_deserialization=True)
+else:
+    store = load_vector_store({path!r}, embeddings)
+load_time = time.perf_counter() - start
+loaded = rss_mb()
+start = time.perf_counter()
+store.similarity_search("lecture notes on recursion", k=4)
+query_time = time.perf_counter() - start
+print(json.dumps({{"load": load_time, "query": query_time, "rss_load": loaded - before, "rss_query": rss_mb() - before}}))
+"""
+
+
+def measure(layout: str, path: str, dimensions: int) -> dict:
+    script = LOAD_SCRIPT.format(query_agent_dir=QUERY_AGENT_DIR, dimensions=dimensions, layout=layout, path=path)
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    args = parser.parse_args()
+
+    embeddings = LocalHashEmbeddings(dimensions=args.dimensions)
+    rng = np.random.default_rng(0)
+    texts = [f"Chunk {i} of the course notes. " + "lorem ipsum dolor sit amet " * 15 for i in range(args.chunks)]
+    metadatas = [{"source": f"course_files/doc_{i // 50}.pdf", "page": i % 50 + 1} for i in range(args.chunks)]
+    ids = [f"chunk-{i}" for i in range(args.chunks)]
+    vectors = rng.standard_normal((args.chunks, args.dimensions)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, "pickle")
+        legacy = FAISS(embeddings, build_index("flat", args.dimensions), InMemoryDocstore({}), {})
+        legacy.add_embeddings(list(zip(texts, vectors.tolist())), metadatas=metadatas, ids=ids)
+        legacy.save_local(pickle_path)
+
+        sqlite_path = os.path.join(directory, "sqlite")
+        store = create_vector_store(sqlite_path, embeddings, args.dimensions)
+        store.add_embeddings(list(zip(texts, vectors.tolist())), metadatas=metadatas, ids=ids)
+        save_vector_store(store, sqlite_path)
+        store.docstore.close()
+
+        print(f"{args.chunks} chunks x {args.dimensions} dims\n")
+        print(f"{'layout':<14} {'load s':>8} {'RSS after load MB':>18} {'first query s':>14} {'RSS after query MB':>19}")
+        for layout, path in (("pickle", pickle_path), ("mmap+sqlite", sqlite_path)):
+            result = measure(layout, path, args.dimensions)
+            print(f"{layout:<14} {result['load']:8.3f} {result['rss_load']:18.1f} "
+                  f"{result['query']:14.3f} {result['rss_query']:19.1f}")
+
+
+if __name__ == "__main__":
+    main()
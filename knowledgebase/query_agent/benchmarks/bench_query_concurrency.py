@@ -0,0 +1,105 @@
+"""Load test the query path: throughput and latency as QUERY_MAX_IN_FLIGHT grows.
+
+Queries run through QueryRunner against a real shard (SQLite docstore, FAISS, hybrid retriever)
+and a stand-in chat model that answers after --llm-latency seconds, like a remote GPT-4 call.
+An in-flight limit of 1 is what the agent did before: one query at a time.
+
+Usage: python benchmarks/bench_query_concurrency.py [--queries 64] [--llm-latency 1.0] [--limits 1,4,16,32]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnablePassthrough
+
+from embedding_pipeline import LocalHashEmbeddings
+from hybrid_retriever import HybridRetriever
+from index_store import create_vector_store, load_vector_store, save_vector_store
+from query_runner import QueryRunner
+
+
+class SlowChatModel(BaseChatModel):
+    """Answers with a fixed text after a delay, without blocking the event loop"""
+
+    latency: float = 1.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Based on the course content..."))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Based on the course content..."))])
+
+
+def build_chain(retriever, llm):
+    """Same shape as create_retrieval_chain: retrieve, stuff the documents into the prompt, answer"""
+    prompt = ChatPromptTemplate.from_template("{context}\n\nStudent's Question: {input}")
+    format_docs = lambda docs: "\n\n".join(doc.page_content for doc in docs)
+    return RunnablePassthrough.assign(
+        context=(lambda inputs: inputs["input"]) | retriever | format_docs
+    ) | RunnablePassthrough.assign(answer=prompt | llm | StrOutputParser())
+
+
+async def load_test(chain, queries: list, max_in_flight: int):
+    runner = QueryRunner(max_in_flight)
+    latencies = []
+
+    async def job(query: str, submitted: float):
+        await chain.ainvoke({"input": query})
+        latencies.append(time.perf_counter() - submitted)
+
+    start = time.perf_counter()
+    for query in queries:
+        runner.submit(job(query, time.perf_counter()))
+    await runner.drain()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(queries) / elapsed, statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1], runner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--limits", default="1,4,16,32")
+    args = parser.parse_args()
+
+    embeddings = LocalHashEmbeddings(dimensions=384)
+    texts = [f"Lecture {i} covers topic {i % 97} with examples on graphs, heaps and recursion" for i in range(args.chunks)]
+    queries = [f"explain topic {i % 97} examples" for i in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as path:
+        store = create_vector_store(path, embeddings, 384)
+        store.add_texts(texts, metadatas=[{"source": f"doc_{i}", "type": "document"} for i in range(args.chunks)])
+        save_vector_store(store, path)
+        store.docstore.close()
+        store = load_vector_store(path, embeddings)
+        chain = build_chain(HybridRetriever(vector_store=store), SlowChatModel(latency=args.llm_latency))
+
+        print(f"{args.queries} queries, LLM latency {args.llm_latency}s, {args.chunks} chunks\n")
+        print(f"{'in flight':>9} {'queries/s':>10} {'p50 s':>7} {'p95 s':>7}")
+        for limit in (int(value) for value in args.limits.split(",")):
+            throughput, p50, p95, runner = asyncio.run(load_test(chain, queries, limit))
+            print(f"{limit:>9} {throughput:10.2f} {p50:7.2f} {p95:7.2f}")
+        store.docstore.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Compare the old double-retrieval query path with single-pass retrieval.
+
+Before: the handler retrieved context itself, then ran a retrieval chain that embedded and searched
+the question again (and ignored the handler's context). After: the answer cache embeds the question,
+the retriever reuses that embedding from the query LRU, searches once, and the same documents go to
+the LLM prompt. Query embeddings wait --embed-latency seconds like an API call; the LLM is instant so
+only retrieval is measured.
+
+Usage: python benchmarks/bench_retrieval_pass.py [--queries 200] [--chunks 5000] [--embed-latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnablePassthrough
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from embedding_pipeline import LocalHashEmbeddings
+from hybrid_retriever import HybridRetriever
+from index_store import create_vector_store, load_vector_store, save_vector_store
+from query_runner import QueryRunner, StageTimer
+
+
+class RemoteQueryEmbeddings(LocalHashEmbeddings):
+    """Local embeddings whose query calls take as long as a round trip to the embedding API"""
+
+    def __init__(self, dimensions: int, query_latency: float):
+        super().__init__(dimensions)
+        self.query_latency = query_latency
+        self.query_calls = 0
+
+    def embed_query(self, text: str) -> list:
+        self.query_calls += 1
+        time.sleep(self.query_latency)
+        return self.embed_text(text)
+
+
+def format_docs(docs) -> str:
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+async def double_pass(retriever, llm, queries: list):
+    """The old answer_request: retrieve context, then a retrieval chain retrieving again"""
+    prompt = ChatPromptTemplate.from_template("{context}\n\nStudent's Question: {input}")
+    chain = RunnablePassthrough.assign(
+        context=(lambda inputs: inputs["input"]) | retriever | format_docs
+    ) | RunnablePassthrough.assign(answer=prompt | llm | StrOutputParser())
+    for query in queries:
+        docs = await retriever.ainvoke(query)
+        context = format_docs(docs)
+        await chain.ainvoke({"input": query, "context": context})
+
+
+async def single_pass(retriever, llm, queries: list, runner: QueryRunner):
+    """answer_request now: one embedding (shared with the answer cache), one search, one prompt"""
+    answer_chain = (lambda inputs: {"input": inputs["input"], "context": format_docs(inputs["context"])}) \
+        | ChatPromptTemplate.from_template("{context}\n\nStudent's Question: {input}") | llm | StrOutputParser()
+    embeddings = retriever.vector_store.embeddings
+    for query in queries:
+        timer = StageTimer()
+        with timer.stage("embed"):
+            await asyncio.to_thread(embeddings.embed_query, query)  # the answer cache lookup
+        docs = await retriever.ainvoke(query, timings=timer)
+        with timer.stage("generate"):
+            await answer_chain.ainvoke({"input": query, "context": docs})
+        runner.record(timer)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    texts = [f"Lecture {i} covers topic {i % 97} with examples on graphs, heaps and recursion" for i in range(args.chunks)]
+    # Longer questions than EXACT_MATCH_MAX_TERMS, so every query takes the vector search path
+    queries = [f"please explain the worked examples for topic {i % 97} in lecture {i}" for i in range(args.queries)]
+    llm = FakeListChatModel(responses=["Based on the course content..."])
+
+    with tempfile.TemporaryDirectory() as path:
+        base = RemoteQueryEmbeddings(384, args.embed_latency)
+        store = create_vector_store(path, base, 384)
+        store.add_texts(texts, metadatas=[{"source": f"doc_{i}", "type": "document"} for i in range(args.chunks)])
+        save_vector_store(store, path)
+        store.docstore.close()
+        print(f"{args.queries} queries, {args.chunks} chunks, query embedding latency {args.embed_latency}s\n")
+
+        store = load_vector_store(path, base)
+        base.query_calls = 0
+        start = time.perf_counter()
+        asyncio.run(double_pass(HybridRetriever(vector_store=store), llm, queries))
+        elapsed = time.perf_counter() - start
+        print(f"double pass: {elapsed * 1000 / args.queries:6.1f} ms/query, {base.query_calls / args.queries:.1f} embeddings/query")
+        store.docstore.close()
+
+        cached = CachedEmbeddings(base, EmbeddingCache(os.path.join(path, "embedding_cache.sqlite")))
+        store = load_vector_store(path, cached)
+        base.query_calls = 0
+        runner = QueryRunner()
+        start = time.perf_counter()
+        asyncio.run(single_pass(HybridRetriever(vector_store=store), llm, queries, runner))
+        elapsed = time.perf_counter() - start
+        print(f"single pass: {elapsed * 1000 / args.queries:6.1f} ms/query, {base.query_calls / args.queries:.1f} embeddings/query")
+        print("stages:     " + ", ".join(f"{name} {seconds / runner.timed * 1000:.1f}ms"
+                                         for name, seconds in runner.stage_seconds.items()))
+        print(cached.query_report())
+        store.docstore.close()
+        cached.cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""A local stand-in for the Canvas REST API used by the benchmarks.
+
+Serves a deterministic set of courses, assignments and files with a fixed
+per-request latency so harvesting strategies can be compared offline. With a
+rate_limit it also emulates Canvas' per-token leaky bucket: every API request
+pre-pays a cost while in flight, the bucket drains at leak_rate units per
+second, and a request that would overflow it gets a 403 "Rate Limit Exceeded".
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PREFLIGHT_COST = 50
+
+
+class FakeCanvas:
+    """Generate the courses, assignments and files a fake Canvas instance serves"""
+
+    def __init__(self, courses=6, assignments_per_course=20, files_per_course=15, file_size=64 * 1024,
+                 latency=0.05, page_size=10, rate_limit=None, leak_rate=100.0, request_cost=20.0,
+                 error_rate=0.0):
+        self.latency = latency
+        self.page_size = page_size
+        self.file_size = file_size
+        self.request_count = 0
+        self.not_modified_count = 0
+        self.throttled_count = 0
+        self.error_count = 0
+        self.lock = threading.Lock()
+        self.rate_limit = rate_limit
+        self.leak_rate = leak_rate
+        self.request_cost = request_cost
+        self.error_rate = error_rate
+        self.bucket = 0.0
+        self.bucket_time = time.monotonic()
+        self.courses = [
+            {"id": c, "name": f"Course {c}", "description": f"Description of course {c}"}
+            for c in range(1, courses + 1)
+        ]
+        self.assignments = {
+            c["id"]: [
+                {"id": c["id"] * 1000 + a, "name": f"HW{a}", "description": f"Homework {a} for course {c['id']}",
+                 "due_at": f"2026-10-{(a % 28) + 1:02d}T23:59:00Z", "updated_at": "2026-09-01T00:00:00Z"}
+                for a in range(1, assignments_per_course + 1)
+            ]
+            for c in self.courses
+        }
+        self.files = {
+            c["id"]: [
+                {"id": c["id"] * 1000 + f, "display_name": f"lecture_{f}.txt", "size": file_size,
+                 "updated_at": "2026-09-01T00:00:00Z"}
+                for f in range(1, files_per_course + 1)
+            ]
+            for c in self.courses
+        }
+
+    def charge(self, cost: float) -> bool:
+        """Add cost to the bucket after draining it, returning False (and charging nothing) on overflow"""
+        with self.lock:
+            now = time.monotonic()
+            self.bucket = max(0.0, self.bucket - (now - self.bucket_time) * self.leak_rate)
+            self.bucket_time = now
+            if cost > 0 and self.bucket + cost > self.rate_limit:
+                self.throttled_count += 1
+                return False
+            self.bucket += cost
+            return True
+
+    def remaining(self) -> float:
+        return max(0.0, self.rate_limit - self.bucket)
+
+    def file_body(self, file_id: int) -> bytes:
+        line = f"Lecture notes for file {file_id}.\n".encode()
+        return (line * (self.file_size // len(line) + 1))[:self.file_size]
+
+
+def make_handler(canvas: FakeCanvas):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_rate_headers(self):
+            if canvas.rate_limit:
+                self.send_header("X-Request-Cost", f"{canvas.request_cost:.1f}")
+                self.send_header("X-Rate-Limit-Remaining", f"{canvas.remaining():.1f}")
+
+        def send_empty(self, status, body=b""):
+            self.send_response(status)
+            self.send_rate_headers()
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, payload, next_url=None):
+            body = json.dumps(payload).encode()
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                with canvas.lock:
+                    canvas.not_modified_count += 1
+                self.send_response(304)
+                self.send_rate_headers()
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_rate_headers()
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if next_url:
+                self.send_header("Link", f'<{next_url}>; rel="next"')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_page(self, items, url):
+            query = parse_qs(url.query)
+            page = int(query.get("page", ["1"])[0])
+            per_page = int(query.get("per_page", [str(canvas.page_size)])[0])
+            start = (page - 1) * per_page
+            next_url = None
+            if start + per_page < len(items):
+                host = self.headers.get("Host")
+                next_url = f"http://{host}{url.path}?page={page + 1}&per_page={per_page}"
+            self.send_json(items[start:start + per_page], next_url)
+
+        def do_GET(self):
+            with canvas.lock:
+                canvas.request_count += 1
+
+            url = urlsplit(self.path)
+            parts = url.path.strip("/").split("/")
+            is_api = parts[:2] == ["api", "v1"]
+            if is_api:
+                parts = parts[2:]
+
+            if is_api and canvas.rate_limit:
+                # Pre-flight charge while the request runs, settled to the real cost once it is done
+                if not canvas.charge(PREFLIGHT_COST):
+                    return self.send_empty(403, b"403 Forbidden (Rate Limit Exceeded)")
+                time.sleep(canvas.latency)
+                canvas.charge(canvas.request_cost - PREFLIGHT_COST)
+            else:
+                time.sleep(canvas.latency)
+            if canvas.error_rate and random.random() < canvas.error_rate:
+                with canvas.lock:
+                    canvas.error_count += 1
+                return self.send_empty(503)
+
+            if parts == ["courses"]:
+                return self.send_page(canvas.courses, url)
+            if len(parts) >= 3 and parts[0] == "courses":
+                course_id = int(parts[1])
+                if parts[2] == "assignments" and len(parts) == 3:
+                    return self.send_page(canvas.assignments.get(course_id, []), url)
+                if parts[2] == "assignments" and len(parts) == 4:
+                    assignment_id = int(parts[3])
+                    for assignment in canvas.assignments.get(course_id, []):
+                        if assignment["id"] == assignment_id:
+                            return self.send_json(assignment)
+                if parts[2] == "files" and len(parts) == 3:
+                    host = self.headers.get("Host")
+                    files = [
+                        dict(file, url=f"http://{host}/files/{file['id']}/download")
+                        for file in canvas.files.get(course_id, [])
+                    ]
+                    return self.send_page(files, url)
+            if len(parts) == 3 and parts[0] == "files" and parts[2] == "download":
+                body = canvas.file_body(int(parts[1]))
+                byte_range = self.headers.get("Range", "")
+                if byte_range.startswith("bytes="):
+                    start = int(byte_range[len("bytes="):].split("-")[0])
+                    if start >= len(body):
+                        return self.send_empty(416)
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+                    body = body[start:]
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            self.send_empty(404)
+
+    return Handler
+
+
+def start_fake_canvas(canvas: FakeCanvas, port: int = 0):
+    """Start a fake Canvas server in a background thread, returning (server, base url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(canvas))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    server, base_url = start_fake_canvas(FakeCanvas(), port=8765)
+    print(f"Fake Canvas listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
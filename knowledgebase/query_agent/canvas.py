@@ -1,10 +1,37 @@
 import os
-import requests
+import json
+import asyncio
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 from dotenv import load_dotenv
-from parse_files import extract_text_from_files
+from sync_manifest import SyncManifest, get_fingerprint, get_user_key
+from file_store import BlobStore
+from canvas_scheduler import CanvasScheduler, get_scheduler
 
 load_dotenv()
 
+# Upper bound on simultaneous requests per Canvas token; the scheduler adapts below it
+CANVAS_MAX_CONCURRENCY = int(os.getenv("CANVAS_MAX_CONCURRENCY", "8"))
+CANVAS_REQUEST_TIMEOUT = float(os.getenv("CANVAS_REQUEST_TIMEOUT", "60"))
+# Course files are linked under one folder per student, so each user's index only sees their own files
+COURSE_FILES_DIR = os.getenv("COURSE_FILES_DIR", "course_files")
+
+# Canvas caps per_page at 100; the default of 10 multiplies round-trips for long lists
+LIST_PARAMS = [("per_page", 100)]
+# The assignment list already carries name, description and due dates, so no per-assignment calls are needed
+ASSIGNMENT_LIST_PARAMS = LIST_PARAMS + [("include[]", "all_dates"), ("include[]", "submission")]
+
+def get_canvas_base_url(school_domain: str) -> str:
+    """Get the Canvas API root for a school domain (a full http(s) URL is used as-is)"""
+    if school_domain.startswith(("http://", "https://")):
+        return f"{school_domain.rstrip('/')}/api/v1"
+    return f"https://{school_domain}.instructure.com/api/v1"
+
+def get_user_files_dir(canvas_token: str, school_domain: str) -> str:
+    """Get the folder a student's course files are linked into"""
+    return os.path.join(COURSE_FILES_DIR, get_user_key(canvas_token, school_domain))
+
 def get_headers(canvas_token: str) -> dict:
     """Get headers for Canvas API requests"""
     if not canvas_token:
@@ -14,144 +41,316 @@ def get_headers(canvas_token: str) -> dict:
     }
 
 def get_all_available_canvas_courses(canvas_token: str, school_domain: str) -> list:
-    try:
-        response = requests.get(f"https://{school_domain}.instructure.com/api/v1/courses?enrollment_state=active", headers=get_headers(canvas_token))
-        response.raise_for_status()  
-
-        response_json = response.json()
-        if not response_json:
-            print("⚠️ No courses returned from API.")
-            return []
+    async def fetch():
+        async with CanvasHarvester(canvas_token, school_domain, manifest=SyncManifest()) as harvester:
+            return await harvester.get_courses()
+    return run_sync(fetch())
 
-        cleaned_up_response = []
-        for course in response_json:
-            cleaned_up_response.append(course)
+def paginate(url: str, canvas_token: str, school_domain: str, params=None) -> list:
+    """Collect every page of a Canvas list endpoint, through the token's shared request scheduler"""
+    async def fetch():
+        async with CanvasHarvester(canvas_token, school_domain, manifest=SyncManifest()) as harvester:
+            return await harvester.paginate(url, params)
+    return run_sync(fetch())
 
 
-        return cleaned_up_response
-
-    except requests.exceptions.HTTPError as e:
-        print(f" API error while getting courses: {e}")
-        return []
+def get_assignment_summary(assignment: dict) -> dict:
+    """Reduce a Canvas assignment object to the fields we index"""
+    return {
+        "id": assignment.get("id", "Unknown ID"),
+        "name": assignment.get("name", "Unnamed Assignment"),
+        "description": assignment.get("description") or "No Description",
+        "due_at": assignment.get("due_at"),
+    }
 
-def paginate(url):
-    results = []
-    while url:
-        response = requests.get(url, headers=get_headers())
-        response.raise_for_status()
 
-        if not response.text.strip():
-            print("Empty API response received. Returning empty list.")
+def run_sync(coro):
+    """Run a coroutine to completion from sync code, even if an event loop is already running"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # Called from inside an agent handler: drive the coroutine on a private loop
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def get_safe_course_name(course_name: str) -> str:
+    """Get a filesystem-safe folder name for a course"""
+    return "".join(c for c in course_name if c.isalnum() or c in (' ', '_')).rstrip()
+
+
+class CanvasHarvester:
+    """Fetch courses, assignments and files from Canvas concurrently over one pooled HTTP session"""
+
+    def __init__(self, canvas_token: str, school_domain: str, max_concurrency: int = CANVAS_MAX_CONCURRENCY,
+                 download_dir: str = COURSE_FILES_DIR, manifest: SyncManifest = None, store: BlobStore = None,
+                 scheduler: CanvasScheduler = None, links_root: str = None):
+        self.headers = get_headers(canvas_token)
+        self.base_url = get_canvas_base_url(school_domain)
+        self.max_concurrency = max_concurrency
+        self.download_dir = download_dir
+        # Blobs are shared between students, so garbage collection must see every user's links
+        self.links_root = links_root or download_dir
+        self.manifest = manifest if manifest is not None else SyncManifest()
+        self._store = store
+        self.scheduler = scheduler or get_scheduler(canvas_token, school_domain, max_concurrency)
+        self.session = None
+
+    @property
+    def store(self) -> BlobStore:
+        # Created on first use, so metadata-only lookups never create a blob store directory
+        if self._store is None:
+            self._store = BlobStore()
+        return self._store
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.max_concurrency, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=CANVAS_REQUEST_TIMEOUT),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def get_json(self, url: str, params=None, conditional: bool = True):
+        """GET a Canvas API url, returning the decoded body and the next page url (if any).
+
+        Requests are made conditional on the validators the manifest holds for the same url, and a
+        304 Not Modified is answered from the manifest's cached copy of the body. If there is no
+        cached copy, the url is fetched again without the validators.
+        """
+        request_key = f"{url}?{urlencode(params)}" if params else url
+        headers = {**self.headers, **self.manifest.conditional_headers(request_key)} if conditional else self.headers
+        async with self.scheduler.request(self.session, "GET", url, params=params, headers=headers) as response:
+            if response.status == 304:
+                cached = self.manifest.cached_response(request_key)
+                if cached is not None:
+                    return cached["data"], cached["next_url"]
+                if not conditional:
+                    raise aiohttp.ClientResponseError(response.request_info, response.history, status=304,
+                                                      message="Not Modified to an unconditional request")
+            else:
+                response.raise_for_status()
+                body = await response.text()
+                data = json.loads(body) if body.strip() else []
+                next_url = response.links.get('next', {}).get('url')
+                next_url = str(next_url) if next_url else None
+                self.manifest.record_response(request_key, response.headers, data, next_url)
+                return data, next_url
+        # 304 without a cached body to answer it from
+        return await self.get_json(url, params, conditional=False)
+
+    async def paginate(self, url: str, params=None) -> list:
+        """Follow Link headers and collect every page of a Canvas list endpoint"""
+        results = []
+        while url:
+            data, url = await self.get_json(url, params)
+            params = None  # the next link already carries the query string
+            results.extend(data)
+        return results
+
+    async def get_courses(self) -> list:
+        try:
+            courses = await self.paginate(f"{self.base_url}/courses", LIST_PARAMS + [("enrollment_state", "active")])
+        except aiohttp.ClientResponseError as e:
+            print(f" API error while getting courses: {e}")
+            return []
+        if not courses:
+            print("⚠️ No courses returned from API.")
+        for course in courses:
+            self.manifest.observe(f"course:{course['id']}", {
+                "fingerprint": get_fingerprint(course.get("name"), course.get("description")),
+            })
+        return courses
+
+    async def get_assignments(self, course_id) -> list:
+        """Get every assignment of a course from the bulk, fully paginated list endpoint"""
+        try:
+            course_assignments = await self.paginate(
+                f"{self.base_url}/courses/{course_id}/assignments", ASSIGNMENT_LIST_PARAMS
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error getting assignments: {e}")
+            self.manifest.skip_course(course_id)
             return []
 
-        results.extend(response.json())
-
-        url = response.links.get('next', {}).get('url', None)
-
-    return results
-    
-
-
-def get_all_course_materials(canvas_token: str, school_domain: str) -> dict:
-    """Get all course materials from Canvas using provided credentials"""
-    courses = get_all_available_canvas_courses(canvas_token, school_domain)
-    all_materials = {}
-
-    for course in courses:
-        if "name" not in course:
-            continue  
-
-        course_id = course["id"]
-        course_name = course["name"]
-        safe_course_name = "".join(c for c in course_name if c.isalnum() or c in (' ', '_')).rstrip()
-        course_folder = os.path.join("course_files", safe_course_name)
-        os.makedirs(course_folder, exist_ok=True)
-
-        # === Assignments ===
-        course_assignments = get_canvas_assignments(canvas_token, school_domain, course_id)
         assignments = []
-
         for assignment in course_assignments:
-            assignment_id = assignment["id"]
-            assignment_info = get_canvas_assignment_info(canvas_token, school_domain, course_id, assignment_id)
-            if isinstance(assignment_info, dict):
-                assignments.append(assignment_info)
-            else:
-                print("⚠️ Invalid assignment info:", assignment_info)
-
-        # === Files ===
-        files_url = f"https://{school_domain}.instructure.com/api/v1/courses/{course_id}/files"
+            if not isinstance(assignment, dict) or "id" not in assignment:
+                print("⚠️ Invalid assignment info:", assignment)
+                continue
+            assignment_info = get_assignment_summary(assignment)
+            self.manifest.observe(f"assignment:{course_id}:{assignment['id']}", {
+                "updated_at": assignment.get("updated_at"),
+                "fingerprint": get_fingerprint(assignment_info),
+            })
+            assignments.append(assignment_info)
+        return assignments
+
+    async def fetch_blob(self, file: dict, download_key: str, file_path: str) -> dict:
+        """Download a file into the blob store and link it at file_path, resuming an interrupted
+        download with a Range request.
+
+        Returns the manifest fields (sha256, etag, last_modified) of the stored blob. A failed transfer
+        leaves its partial file in place for the next sync to resume.
+        """
+        partial_path = self.store.partial_path(download_key)
+        expected_size = file.get("size")
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        if expected_size is not None and offset > expected_size:
+            os.remove(partial_path)
+            offset = 0
+
+        validators = {"etag": None, "last_modified": None}
+        if expected_size is None or offset < expected_size:
+            file_url = file['url']
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            async with self.scheduler.request(self.session, "GET", file_url, headers=headers) as file_response:
+                if file_response.status != 416:
+                    file_response.raise_for_status()
+                    # 206 continues the partial file; a plain 200 means the server ignored Range
+                    mode = 'ab' if file_response.status == 206 else 'wb'
+                    with open(partial_path, mode) as f:
+                        async for chunk in file_response.content.iter_chunked(8192):
+                            f.write(chunk)
+                    validators["etag"] = file_response.headers.get("ETag")
+                    validators["last_modified"] = file_response.headers.get("Last-Modified")
+
+        digest = self.store.commit(partial_path, expected_size, link_path=file_path)
+        return {"sha256": digest, **validators}
+
+    async def download_file(self, course_id, file: dict, course_folder: str):
+        file_path = os.path.join(course_folder, file['display_name'])
+        key = f"file:{course_id}:{file['id']}"
+        record = {"updated_at": file.get("updated_at"), "size": file.get("size"), "path": file_path}
+        previous = self.manifest.lookup(key) or {}
+        digest = previous.get("sha256")
+
+        if self.manifest.is_unchanged(key, record) and self.store.link_existing(digest, file_path, record["size"]):
+            print(f"✅ Skipping existing file: {file_path}")
+            self.manifest.observe(key, {**previous, **record})
+            return
+
+        if not digest and os.path.isfile(file_path) and not os.path.islink(file_path) \
+                and (record["size"] is None or os.path.getsize(file_path) == record["size"]):
+            # Downloaded before the blob store existed: move it in instead of fetching it again
+            print(f"✅ Adopting existing file: {file_path}")
+            self.manifest.observe(key, {**record, "sha256": self.store.adopt(file_path, record["size"])})
+            return
+
+        # The partial file is keyed by version so a changed file never resumes onto stale bytes
+        download_key = f"{course_id}-{file['id']}-{get_fingerprint(record['updated_at'], record['size'])}"
         try:
-            while files_url:
-                response = requests.get(files_url, headers=get_headers(canvas_token))
-                response.raise_for_status()
-                data = response.json()
-
-                for file in data:
-                    file_name = file['display_name']
-                    file_url = file['url']
-                    file_path = os.path.join(course_folder, file_name)
-
-                    if os.path.exists(file_path):
-                        print(f"✅ Skipping existing file: {file_path}")
-                        continue
-
-                    with requests.get(file_url, stream=True) as file_response:
-                        file_response.raise_for_status()
-                        with open(file_path, 'wb') as f:
-                            for chunk in file_response.iter_content(chunk_size=8192):
-                                f.write(chunk)
-                        print(f"📥 Downloaded: {file_path}")
-
-                files_url = response.links.get('next', {}).get('url')
-
-        except requests.exceptions.HTTPError as e:
-            if response.status_code == 403:
+            blob_fields = await self.fetch_blob(file, download_key, file_path)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            print(f"❌ Failed to download {file_path}: {e}")
+            if previous:
+                # Keep the old record so the file is retried next sync rather than reported as removed
+                self.manifest.observe(key, previous)
+            return
+
+        print(f"📥 Downloaded: {file_path}")
+        self.manifest.observe(key, {**record, **blob_fields})
+
+    async def download_course_files(self, course_id, course_name: str, course_folder: str) -> bool:
+        """Download every file of a course, returning False if the course's files are restricted"""
+        files_url = f"{self.base_url}/courses/{course_id}/files"
+        try:
+            files = await self.paginate(files_url, LIST_PARAMS)
+        except aiohttp.ClientResponseError as e:
+            if e.status == 403:
                 print(f"🚫 Skipping course '{course_name}' (ID: {course_id}) due to restricted file access.")
             else:
                 print(f"❌ Unexpected error with course '{course_name}': {e}")
-            continue  # Skip to the next course
-
-        # === Store collected materials ===
-        all_materials[course_name] = {
-            "assignments": assignments if assignments else "No assignments available",
-            "description": course.get("description", "No description available")
-        }
-
-    return all_materials
+            self.manifest.skip_course(course_id)
+            return False
 
+        await asyncio.gather(*(self.download_file(course_id, file, course_folder) for file in files))
+        return True
 
-def get_canvas_assignments(canvas_token: str, school_domain: str, course_id: int):
-    try:
-        response = requests.get(f"https://{school_domain}.instructure.com/api/v1/courses/{course_id}/assignments", headers=get_headers(canvas_token))
-        response_json = response.json()
-
-        print("yahoo", response_json)
-    
-        return response_json
-    except Exception as e:
-        print(f"Error getting courses: {e}")
-        return []
-
+    async def harvest_course(self, course: dict):
+        """Fetch one course's assignments and files in parallel"""
+        course_id = course["id"]
+        course_name = course["name"]
+        course_folder = os.path.join(self.download_dir, get_safe_course_name(course_name))
+        os.makedirs(course_folder, exist_ok=True)
 
-def get_canvas_assignment_info(canvas_token: str, school_domain: str, course_id: str, assignment_id: str):
-    try:
-        response = requests.get(f"https://{school_domain}.instructure.com/api/v1/courses/{course_id}/assignments/{assignment_id}", headers=get_headers(canvas_token))
-        response.raise_for_status()  # Ensure we handle failed API calls
-        response_json = response.json()
+        assignments, files_ok = await asyncio.gather(
+            self.get_assignments(course_id),
+            self.download_course_files(course_id, course_name, course_folder),
+        )
+        if not files_ok:
+            return None
 
         return {
-            "id": response_json.get("id", "Unknown ID"),
-            "name": response_json.get("name", "Unnamed Assignment"),
-            "description": response_json.get("description", "No Description")
+            "assignments": assignments if assignments else "No assignments available",
+            "description": course.get("description", "No description available")
         }
 
-    except requests.exceptions.RequestException as e:
-        print(f"⚠️ API Request Failed: {e}")
-        return {}  
-    except KeyError as e:
-        print(f"⚠️ Missing Key in API Response: {e}")
-        return {}
+    async def harvest(self) -> dict:
+        """Harvest every active course, returning materials keyed by course name"""
+        courses = [course for course in await self.get_courses() if "name" in course]
+        harvested = await asyncio.gather(*(self.harvest_course(course) for course in courses))
+
+        all_materials = {}
+        for course, materials in zip(courses, harvested):
+            if materials is not None:
+                all_materials[course["name"]] = materials
+        return all_materials
+
+    def finish_sync(self):
+        """Close out the manifest, unlinking files removed from Canvas and dropping orphaned blobs"""
+        delta = self.manifest.finish()
+        for key, record in delta.removed_records.items():
+            file_path = record.get("path")
+            if key.startswith("file:") and file_path and os.path.lexists(file_path):
+                os.remove(file_path)
+                print(f"🗑️ Removed deleted file: {file_path}")
+        self.manifest.save()
+        removed_blobs = self.store.collect_garbage(self.links_root)
+        if removed_blobs:
+            print(f"🗑️ Removed {removed_blobs} unreferenced blobs")
+        return delta
+
+
+async def sync_course_materials_async(canvas_token: str, school_domain: str):
+    manifest = SyncManifest.for_user(canvas_token, school_domain)
+    download_dir = get_user_files_dir(canvas_token, school_domain)
+    async with CanvasHarvester(canvas_token, school_domain, download_dir=download_dir, manifest=manifest,
+                               links_root=COURSE_FILES_DIR) as harvester:
+        all_materials = await harvester.harvest()
+        print(harvester.scheduler.report())
+        if not all_materials:
+            # Nothing came back (bad token, Canvas down): keep the previous manifest untouched
+            return all_materials, manifest.delta
+        delta = harvester.finish_sync()
+    print(f"🔄 Canvas sync: {delta.summary()}")
+    return all_materials, delta
+
+
+def sync_course_materials(canvas_token: str, school_domain: str):
+    """Incrementally sync Canvas, returning (all_materials, delta of changed objects since the last sync)"""
+    return run_sync(sync_course_materials_async(canvas_token, school_domain))
 
 
+def get_all_course_materials(canvas_token: str, school_domain: str) -> dict:
+    """Get all course materials from Canvas using provided credentials"""
+    all_materials, _ = sync_course_materials(canvas_token, school_domain)
+    return all_materials
 
+
+def get_canvas_assignments(canvas_token: str, school_domain: str, course_id: int) -> list:
+    """Get every assignment of a course in bulk (name, description and due dates included)"""
+    try:
+        return paginate(
+            f"{get_canvas_base_url(school_domain)}/courses/{course_id}/assignments",
+            canvas_token,
+            school_domain,
+            ASSIGNMENT_LIST_PARAMS,
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error getting assignments: {e}")
+        return []
@@ -0,0 +1,241 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from sync_manifest import get_user_key
+
+# Canvas charges every in-flight request a pre-flight cost against the token's bucket before it
+# knows the real cost, so the bucket caps how many requests can safely run at once
+CANVAS_PREFLIGHT_COST = 50
+# Remaining bucket below which the scheduler stops adding load and lets the bucket refill
+CANVAS_RATE_LIMIT_FLOOR = float(os.getenv("CANVAS_RATE_LIMIT_FLOOR", "150"))
+CANVAS_MAX_RETRIES = int(os.getenv("CANVAS_MAX_RETRIES", "5"))
+CANVAS_BACKOFF_BASE = 0.5
+CANVAS_BACKOFF_MAX = 30.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def get_backoff(attempt: int) -> float:
+    """Exponential backoff with jitter, so throttled requests do not all come back at once"""
+    ceiling = min(CANVAS_BACKOFF_MAX, CANVAS_BACKOFF_BASE * 2 ** attempt)
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+def get_retry_after(response) -> float:
+    try:
+        return max(0.0, float(response.headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+
+class CanvasScheduler:
+    """Shared gate for every Canvas request made with one token.
+
+    Reads ``X-Rate-Limit-Remaining`` and ``X-Request-Cost`` from each response and adapts how many
+    requests may be in flight so the token's bucket never runs dry, pausing everyone when it gets
+    low. Throttled (403 "Rate Limit Exceeded" / 429) and 5xx responses are retried with jittered
+    backoff; the counters behind ``report()`` make the token's budget visible per sync.
+
+    Syncs for one token can run at the same time on different threads, each with its own event
+    loop, so the state is guarded by a thread lock. A request that finds every slot taken queues a
+    future on its own loop, and a freed slot is handed to the oldest waiter whichever loop it is on.
+    """
+
+    def __init__(self, max_concurrency: int, name: str = ""):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.resume_at = 0.0
+        self.lock = threading.RLock()
+        self.waiters = deque()  # (loop, future) of requests waiting for a slot, oldest first
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "throttled": 0,
+            "server_errors": 0,
+            "cost": 0.0,
+            "remaining": None,
+            "min_remaining": None,
+            "paused_seconds": 0.0,
+            "min_limit": max_concurrency,
+        }
+
+    def set_limit(self, limit: int):
+        with self.lock:
+            self.limit = max(1, min(self.max_concurrency, limit))
+            self.stats["min_limit"] = min(self.stats["min_limit"], self.limit)
+            self.wake()
+
+    def pause(self, seconds: float):
+        """Hold back every new request for the given time"""
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def count(self, stat: str, amount: float = 1):
+        with self.lock:
+            self.stats[stat] += amount
+
+    def wake(self):
+        """Hand free slots to waiting requests, oldest first (called with the lock held)"""
+        while self.waiters and self.in_flight < self.limit:
+            loop, waiter = self.waiters.popleft()
+            self.in_flight += 1
+            try:
+                loop.call_soon_threadsafe(grant, waiter)
+            except RuntimeError:
+                self.in_flight -= 1  # its loop has closed, so nobody is waiting any more
+
+    async def acquire(self):
+        with self.lock:
+            if self.in_flight < self.limit and not self.waiters:
+                self.in_flight += 1
+                waiter = None
+            else:
+                waiter = asyncio.get_running_loop().create_future()
+                self.waiters.append((asyncio.get_running_loop(), waiter))
+        if waiter is not None:
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self.lock:
+                    entry = (asyncio.get_running_loop(), waiter)
+                    if entry in self.waiters:
+                        self.waiters.remove(entry)
+                    else:
+                        # The slot was handed over as the wait was cancelled: give it back
+                        self.in_flight -= 1
+                        self.wake()
+                raise
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            self.count("paused_seconds", delay)
+            await asyncio.sleep(delay)
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.wake()
+
+    def observe(self, response):
+        """Update the budget from a response's rate limit headers and resize the concurrency limit"""
+        try:
+            cost = float(response.headers.get("X-Request-Cost", 0))
+        except ValueError:
+            cost = 0.0
+        try:
+            remaining = float(response.headers["X-Rate-Limit-Remaining"])
+        except (KeyError, ValueError):
+            remaining = None  # not a Canvas API response (e.g. a file download), nothing to adapt to
+
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["cost"] += cost
+            if remaining is None:
+                return
+            self.stats["remaining"] = remaining
+            if self.stats["min_remaining"] is None or remaining < self.stats["min_remaining"]:
+                self.stats["min_remaining"] = remaining
+
+            # As many requests as the bucket above the floor can pre-pay; shrink at once, grow one at a time
+            target = int((remaining - CANVAS_RATE_LIMIT_FLOOR) // CANVAS_PREFLIGHT_COST)
+            self.set_limit(target if target < self.limit else self.limit + 1)
+            if remaining < CANVAS_RATE_LIMIT_FLOOR:
+                self.pause(get_backoff(0))
+
+    async def get_retry_reason(self, response) -> str:
+        """Get why a response should be retried, or None if it should be returned to the caller"""
+        if response.status == 403:
+            # Canvas reports throttling as a 403; a plain permission error must not be retried
+            remaining = response.headers.get("X-Rate-Limit-Remaining")
+            body = await response.text()
+            if "Rate Limit Exceeded" in body or remaining in ("0", "0.0"):
+                return "throttled"
+            return None
+        if response.status == 429:
+            return "throttled"
+        if response.status in RETRY_STATUSES:
+            return "server error"
+        return None
+
+    @asynccontextmanager
+    async def request(self, session: aiohttp.ClientSession, method: str, url: str, **kwargs):
+        """Make a request through the scheduler, yielding the final response once retries are exhausted"""
+        attempt = 0
+        while True:
+            await self.acquire()
+            try:
+                try:
+                    response = await session.request(method, url, **kwargs)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if attempt >= CANVAS_MAX_RETRIES:
+                        raise
+                    reason, delay = type(e).__name__, None
+                else:
+                    self.observe(response)
+                    reason = await self.get_retry_reason(response)
+                    if reason is None or attempt >= CANVAS_MAX_RETRIES:
+                        try:
+                            yield response
+                        finally:
+                            response.release()
+                        return
+                    delay = get_retry_after(response)
+                    response.release()
+            finally:
+                self.release()
+
+            self.count("retries")
+            delay = delay if delay is not None else get_backoff(attempt)
+            if reason == "throttled":
+                with self.lock:
+                    self.stats["throttled"] += 1
+                    self.set_limit(self.limit // 2)
+                    self.pause(delay)
+            elif reason == "server error":
+                self.count("server_errors")
+            attempt += 1
+            print(f"⏳ Canvas {reason} on {urlsplit(str(url)).path}, retry {attempt}/{CANVAS_MAX_RETRIES} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def report(self) -> str:
+        with self.lock:
+            stats = dict(self.stats)
+        remaining = "n/a" if stats["remaining"] is None else f"{stats['remaining']:.0f}"
+        min_remaining = "n/a" if stats["min_remaining"] is None else f"{stats['min_remaining']:.0f}"
+        return (f"🪣 Canvas budget{f' [{self.name}]' if self.name else ''}: {stats['requests']} requests, "
+                f"cost {stats['cost']:.1f}, remaining {remaining} (low {min_remaining}), "
+                f"{stats['throttled']} throttled, {stats['server_errors']} server errors, "
+                f"{stats['retries']} retries, paused {stats['paused_seconds']:.1f}s, "
+                f"concurrency {self.limit}/{self.max_concurrency} (low {stats['min_limit']})")
+
+
+def grant(waiter: asyncio.Future):
+    # Runs on the waiter's own loop; a cancelled waiter gives its slot back in acquire
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+# One scheduler per Canvas account, so every sync and lookup for a token shares its bucket
+SCHEDULERS = {}
+SCHEDULERS_LOCK = threading.Lock()
+
+
+def get_scheduler(canvas_token: str, school_domain: str, max_concurrency: int) -> CanvasScheduler:
+    key = get_user_key(canvas_token, school_domain)
+    with SCHEDULERS_LOCK:
+        if key not in SCHEDULERS:
+            SCHEDULERS[key] = CanvasScheduler(max_concurrency, name=key)
+        scheduler = SCHEDULERS[key]
+    with scheduler.lock:
+        scheduler.max_concurrency = max_concurrency
+        scheduler.set_limit(scheduler.limit)
+    return scheduler
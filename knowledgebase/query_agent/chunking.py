@@ -0,0 +1,135 @@
+import os
+import re
+
+from embedding_pipeline import count_tokens
+from index_store import get_chunk_id, get_content_hash
+
+# Chunk size in embedding-model tokens, and tokens of trailing context repeated at the start of the next chunk
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# A heading only closes the current chunk once it holds this many tokens, so short sections are merged
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "48"))
+
+# Markdown headings, numbered headings ("2.1 Graph search", "IV. Results") and short ALL CAPS lines
+HEADING_PATTERN = re.compile(
+    r"^[ \t]*(#{1,6}[ \t]+\S.*"
+    r"|(?:\d+(?:\.\d+)*\.?|[IVX]+\.)[ \t]+[A-Z][^\n.?!]{0,60}"
+    r"|[A-Z][A-Z0-9 \t,:&()'/-]{3,80})[ \t]*$"
+)
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+LINE_BREAK = re.compile(r"\n")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?;])\s+")
+WORD_BREAK = re.compile(r"\s+")
+
+
+def split_spans(text: str, start: int, end: int, pattern):
+    """Split text[start:end] at pattern, yielding the (start, end) spans of the non-empty pieces"""
+    position = start
+    for match in pattern.finditer(text, start, end):
+        if text[position:match.start()].strip():
+            yield position, match.start()
+        position = match.end()
+    if text[position:end].strip():
+        yield position, end
+
+
+class Chunker:
+    """Split a record's text into chunks of at most max_tokens, along its structure.
+
+    Records are already single pages, slides, row groups or assignments, so chunks never cross
+    those. Within a record, headings start a new chunk (and name the section of the chunks that
+    follow), and text is broken at paragraphs, then lines, then sentences, then words, only as far
+    as needed to fit. Chunks are spans of the original text, so their offsets are exact.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 min_tokens: int = CHUNK_MIN_TOKENS):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.min_tokens = min(min_tokens, max_tokens)
+
+    def iter_segments(self, text: str):
+        """Yield (start, end, tokens, heading) pieces of text that each fit in one chunk"""
+        for start, end in split_spans(text, 0, len(text), PARAGRAPH_BREAK):
+            lines = list(split_spans(text, start, end, LINE_BREAK))
+            if HEADING_PATTERN.match(text[lines[0][0]:lines[0][1]]):
+                # A heading line opening a paragraph is its own segment, so it can start a chunk
+                yield lines[0][0], lines[0][1], count_tokens(text[lines[0][0]:lines[0][1]]), True
+                if len(lines) == 1:
+                    continue
+                start = lines[1][0]
+            yield from self.fit(text, start, end, (LINE_BREAK, SENTENCE_BREAK, WORD_BREAK))
+
+    def fit(self, text: str, start: int, end: int, patterns: tuple):
+        """Yield text[start:end] whole if it fits, else split with the coarsest pattern that helps"""
+        tokens = count_tokens(text[start:end])
+        if tokens <= self.max_tokens:
+            yield start, end, tokens, False
+            return
+        for i, pattern in enumerate(patterns):
+            spans = list(split_spans(text, start, end, pattern))
+            if len(spans) > 1:
+                for span_start, span_end in spans:
+                    yield from self.fit(text, span_start, span_end, patterns[i:])
+                return
+        # A single unbroken run (a URL, a base64 blob): cut it by its characters-per-token ratio
+        step = max(1, (end - start) * self.max_tokens // tokens)
+        for piece_start in range(start, end, step):
+            piece_end = min(end, piece_start + step)
+            yield piece_start, piece_end, count_tokens(text[piece_start:piece_end]), False
+
+    def split(self, text: str) -> list:
+        """Get the chunks of a record's text as (start, end, tokens, section) tuples"""
+        chunks = []
+        current, current_tokens = [], 0
+        section = chunk_section = None
+
+        def flush():
+            chunks.append((current[0][0], current[-1][1], current_tokens, chunk_section))
+
+        for start, end, tokens, heading in self.iter_segments(text):
+            if current and (current_tokens + tokens > self.max_tokens
+                            or (heading and current_tokens >= self.min_tokens)):
+                flush()
+                # Carry trailing segments into the next chunk as overlap, unless a new section starts
+                overlap, overlap_tokens = [], 0
+                if not heading:
+                    for segment in reversed(current):
+                        if overlap_tokens + segment[2] > self.overlap_tokens \
+                                or overlap_tokens + segment[2] + tokens > self.max_tokens:
+                            break
+                        overlap.insert(0, segment)
+                        overlap_tokens += segment[2]
+                current, current_tokens = overlap, overlap_tokens
+            if heading:
+                section = text[start:end].strip().lstrip("#").strip()
+            if not current:
+                chunk_section = section
+            current.append((start, end, tokens))
+            current_tokens += tokens
+        if current:
+            flush()
+        return chunks
+
+
+def iter_chunks(documents, chunker: Chunker = None):
+    """Lazily split documents into chunks that inherit their document's metadata.
+
+    Each chunk gets a stable id from its source and offset, a content hash to detect edits, the
+    section heading it falls under and its token count (reused when batching for embedding).
+    """
+    chunker = chunker or Chunker()
+    for doc in documents:
+        text = doc['page_content']
+        for start, end, tokens, section in chunker.split(text):
+            metadata = {**doc['metadata'], 'start_index': start}
+            if section:
+                metadata['section'] = section
+            page_content = text[start:end]
+            metadata['content_hash'] = get_content_hash(page_content, metadata)
+            yield {
+                'id': get_chunk_id(metadata, start),
+                'page_content': page_content,
+                'metadata': metadata,
+                'tokens': tokens,
+            }
@@ -8,20 +8,22 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def cleanup_rag_system():
-    """Clean up the RAG system by clearing contents of directories"""
+    """Reset the RAG system by clearing contents of its directories.
+
+    Index versions are pruned and unlinked blobs collected as part of every sync, so this is not
+    routine maintenance: it is a full reset, to run while the agent is stopped. Course files, blobs,
+    indexes and the sync manifests describing them are cleared together, otherwise the next sync
+    would find every manifest current and rebuild nothing.
+    """
     try:
         base_dir = "/app"  # Docker container working directory
-        
-        # Clean up course_files directory contents
-        course_files_dir = os.path.join(base_dir, "course_files")
-        subprocess.run(f"find {course_files_dir} -mindepth 1 -delete", shell=True, check=True)
-        logger.info("Successfully cleared course_files directory contents")
-        
-        # Clean up FAISS index files
-        faiss_path = os.path.join(base_dir, "faiss_index")
-        subprocess.run(f"find {faiss_path} -mindepth 1 -delete", shell=True, check=True)
-        logger.info("Successfully cleared FAISS index directory contents")
-            
+
+        for name in ("course_files", "blob_store", "faiss_db", "sync_state"):
+            directory = os.path.join(base_dir, name)
+            if os.path.isdir(directory):
+                subprocess.run(f"find {directory} -mindepth 1 -delete", shell=True, check=True)
+                logger.info(f"Successfully cleared {name} directory contents")
+
         logger.info("Cleanup completed successfully")
         return True
     except subprocess.CalledProcessError as e:
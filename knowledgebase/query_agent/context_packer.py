@@ -0,0 +1,155 @@
+import os
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+from embedding_pipeline import count_tokens
+
+# Tokens of course content put into the prompt (cl100k, as GPT-4 counts them); question and instructions come on top.
+# The default is the most the four stuffed chunks took before packing (4 x CHUNK_MAX_TOKENS), now spent on distinct content
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1024"))
+# MMR trade-off between relevance (1.0) and novelty against the chunks already picked (0.0)
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Chunks at least this similar to a better-ranked one are dropped as duplicates
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.97"))
+
+
+def get_location(doc: Document) -> tuple:
+    """The record a chunk was cut from; chunks of one record are spans of the same text"""
+    return (doc.metadata.get("source"), doc.metadata.get("page"), doc.metadata.get("first_row"))
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def get_chunk_vectors(vector_store, docs: list):
+    """Get the unit vectors of retrieved chunks back from the index, without embedding them again.
+
+    IVF indexes got the direct map this needs when they were loaded, so the served index is only read.
+    """
+    positions = vector_store.docstore.get_positions([doc.id for doc in docs])
+    vectors = np.zeros((len(docs), vector_store.index.d), dtype=np.float32)
+    found = [i for i, doc in enumerate(docs) if doc.id in positions]
+    if found:
+        vectors[found] = vector_store.index.reconstruct_batch(
+            np.asarray([positions[docs[i].id] for i in found], dtype=np.int64))
+    return normalize(vectors)
+
+
+def merge_overlapping(docs: list, vectors) -> tuple:
+    """Merge chunks of the same record whose spans overlap, so the overlap is only sent once.
+
+    Takes chunks in rank order and returns (docs, vectors, ranks) of the merged chunks, each ranked
+    like its best part and carrying the mean of its parts' vectors.
+    """
+    order = sorted(range(len(docs)), key=lambda i: (repr(get_location(docs[i])),
+                                                    docs[i].metadata.get("start_index", -1)))
+    merged = []  # [location, start, end, text, rank, parts, metadata, id]
+    for i in order:
+        doc = docs[i]
+        start = doc.metadata.get("start_index")
+        end = start + len(doc.page_content) if start is not None else None
+        last = merged[-1] if merged else None
+        if last and start is not None and last[0] == get_location(doc) and last[1] is not None and start < last[2]:
+            if end > last[2]:
+                last[3] += doc.page_content[last[2] - start:]
+                last[2] = end
+            last[4] = min(last[4], i)
+            last[5].append(i)
+            continue
+        merged.append([get_location(doc), start, end, doc.page_content, i, [i], doc.metadata, doc.id])
+
+    merged.sort(key=lambda span: span[4])
+    merged_docs = [Document(id=span[7], page_content=span[3], metadata=span[6]) for span in merged]
+    merged_vectors = normalize(np.stack([vectors[span[5]].sum(axis=0) for span in merged])) \
+        if merged else np.zeros((0, vectors.shape[1]), dtype=np.float32)
+    return merged_docs, merged_vectors, [span[4] for span in merged]
+
+
+class ContextPacker:
+    """Assemble the retrieved chunks into a prompt context that fits a token budget.
+
+    Overlapping chunks of the same record are merged, identical and near-identical chunks are
+    dropped, and the rest are picked by maximal marginal relevance until ``max_tokens`` is used up.
+    Relevance is the hybrid retriever's rank, which already weighs BM25 against vector scores, so
+    an exact "HW3" match is not demoted; redundancy is the cosine similarity of the stored vectors.
+    """
+
+    def __init__(self, max_tokens: int = CONTEXT_MAX_TOKENS, mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+                 duplicate_similarity: float = CONTEXT_DUPLICATE_SIMILARITY):
+        if max_tokens < 1:
+            raise ValueError(f"max_tokens must be at least 1, got {max_tokens}")
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_similarity = duplicate_similarity
+        self.lock = threading.Lock()
+        self.packed = 0
+        self.chunks_in = 0
+        self.chunks_out = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def drop_duplicates(self, docs: list, vectors, ranks: list) -> tuple:
+        keep, seen_texts = [], set()
+        for i, doc in enumerate(docs):
+            text = " ".join(doc.page_content.split())
+            if text in seen_texts:
+                continue
+            if keep and float(np.max(vectors[keep] @ vectors[i])) >= self.duplicate_similarity:
+                continue
+            seen_texts.add(text)
+            keep.append(i)
+        return [docs[i] for i in keep], vectors[keep], [ranks[i] for i in keep]
+
+    def select(self, docs: list, vectors, ranks: list, tokens: list) -> list:
+        """Pick chunks by MMR while they fit the budget, returning their indexes in pick order"""
+        relevance = 1.0 - np.asarray(ranks, dtype=np.float32) / (max(ranks) + 1)
+        redundancy = np.zeros(len(docs), dtype=np.float32)
+        candidates = list(range(len(docs)))
+        selected, used = [], 0
+        while candidates:
+            scores = self.mmr_lambda * relevance[candidates] - (1 - self.mmr_lambda) * redundancy[candidates]
+            best = candidates.pop(int(np.argmax(scores)))
+            if used + tokens[best] > self.max_tokens:
+                continue
+            selected.append(best)
+            used += tokens[best]
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+        return selected
+
+    def pack(self, vector_store, docs: list) -> list:
+        """Get the chunks to put in the prompt, from the retriever's ranked chunks"""
+        if not docs:
+            return docs
+        tokens_in = sum(count_tokens(doc.page_content) for doc in docs)
+        merged, vectors, ranks = merge_overlapping(docs, get_chunk_vectors(vector_store, docs))
+        merged, vectors, ranks = self.drop_duplicates(merged, vectors, ranks)
+        tokens = [count_tokens(doc.page_content) for doc in merged]
+
+        while tokens[0] > self.max_tokens:
+            # The best chunk alone is over budget: keep its beginning rather than lose it
+            cut = len(merged[0].page_content) * self.max_tokens * 9 // (tokens[0] * 10)
+            merged[0] = Document(id=merged[0].id, page_content=merged[0].page_content[:cut], metadata=merged[0].metadata)
+            tokens[0] = count_tokens(merged[0].page_content)
+        if not merged[0].page_content.strip():
+            return []  # not even the beginning of the best chunk fits
+        selected = self.select(merged, vectors, ranks, tokens)
+        packed = [merged[i] for i in selected]
+
+        with self.lock:
+            self.packed += 1
+            self.chunks_in += len(docs)
+            self.chunks_out += len(packed)
+            self.tokens_in += tokens_in
+            self.tokens_out += sum(tokens[i] for i in selected)
+        return packed
+
+    def report(self) -> str:
+        if not self.packed:
+            return "📦 Context packer: no prompts packed yet"
+        saved = 1 - self.tokens_out / self.tokens_in if self.tokens_in else 0.0
+        return (f"📦 Context packer: {self.chunks_in / self.packed:.1f} -> {self.chunks_out / self.packed:.1f} chunks, "
+                f"{self.tokens_in / self.packed:.0f} -> {self.tokens_out / self.packed:.0f} tokens per prompt ({saved:.0%} fewer)")
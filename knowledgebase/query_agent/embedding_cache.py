@@ -0,0 +1,187 @@
+import os
+import math
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("cache", "embedding_cache.sqlite"))
+# Least recently used vectors are evicted past this many entries (~6 KB each at 1536 dimensions)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+# Recent query embeddings kept in memory, so a query is embedded once however many times it is searched
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk cache of embedding vectors keyed by (model name, sha256 of the text).
+
+    Vectors are stored as float32 blobs; every lookup refreshes ``last_used`` so eviction drops the
+    least recently used entries once the cache grows past ``max_entries``.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_entries = max_entries
+        # Ingest may run off the event loop thread, so the connection is shared under a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            );
+            CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+        """)
+
+    def get_many(self, model: str, text_hashes: list) -> dict:
+        """Get the cached vectors for the given text hashes, as {text_hash: vector}"""
+        found = {}
+        with self.lock:
+            # Stay well under SQLite's bound parameter limit
+            for start in range(0, len(text_hashes), 500):
+                part = text_hashes[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                for text_hash, vector in rows:
+                    found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found],
+                )
+                self.conn.commit()
+        return found
+
+    def put_many(self, model: str, items: dict):
+        """Store {text_hash: vector} for a model, evicting the least recently used entries if needed"""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, text_hash, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                 for text_hash, vector in items.items()],
+            )
+            excess = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class EmbeddingCacheStats:
+    """Hit, miss and API call counters of document embeddings, for one ingest or the whole process"""
+
+    def __init__(self):
+        # Batches may be embedded from several threads at once
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+        self.api_calls_saved = 0
+
+    def add(self, hits: int, misses: int, api_calls: int, api_calls_saved: int):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+            self.api_calls += api_calls
+            self.api_calls_saved += api_calls_saved
+
+    def report(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (f"🧠 Embedding cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate), "
+                f"{self.api_calls} API calls made, {self.api_calls_saved} saved")
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an embedding model so document texts embedded before are served from the cache.
+
+    Only texts missing from the cache (deduplicated) are sent to the wrapped model. Query
+    embeddings are kept in a small in-memory LRU instead, since the same question is looked up by
+    the answer cache and the retriever, and asked again by other students.
+
+    The model is shared by concurrent ingests, so ``stats`` holds process totals; an ingest passes
+    its own EmbeddingCacheStats to ``embed_documents`` to count just its own lookups.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache = None, model_name: str = None,
+                 batch_size: int = None, query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.model_name = model_name or getattr(embeddings, "model", None) or type(embeddings).__name__
+        # Texts per API request of the wrapped model, used to count the calls the cache saved
+        self.batch_size = batch_size or getattr(embeddings, "chunk_size", None) or 1000
+        self.stats = EmbeddingCacheStats()
+        # Guards the query LRU, which is used from several threads at once
+        self.stats_lock = threading.Lock()
+        self.query_cache_size = query_cache_size
+        self.query_vectors = OrderedDict()
+        self.query_hits = 0
+        self.query_misses = 0
+
+    def embed_documents(self, texts: list, stats: EmbeddingCacheStats = None) -> list:
+        text_hashes = [hash_text(text) for text in texts]
+        vectors = self.cache.get_many(self.model_name, list(set(text_hashes)))
+
+        missing = {}
+        for text, text_hash in zip(texts, text_hashes):
+            if text_hash not in vectors:
+                missing.setdefault(text_hash, text)
+        misses = sum(1 for text_hash in text_hashes if text_hash not in vectors)
+
+        if missing:
+            embedded = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), embedded))
+            self.cache.put_many(self.model_name, new_vectors)
+            vectors.update(new_vectors)
+
+        calls = math.ceil(len(missing) / self.batch_size)
+        counts = (len(texts) - misses, misses, calls, math.ceil(len(texts) / self.batch_size) - calls)
+        self.stats.add(*counts)
+        if stats is not None:
+            stats.add(*counts)
+        return [vectors[text_hash] for text_hash in text_hashes]
+
+    def embed_query(self, text: str) -> list:
+        with self.stats_lock:
+            vector = self.query_vectors.get(text)
+            if vector is not None:
+                self.query_vectors.move_to_end(text)
+                self.query_hits += 1
+                return vector
+            self.query_misses += 1
+
+        vector = self.embeddings.embed_query(text)
+        with self.stats_lock:
+            self.query_vectors[text] = vector
+            while len(self.query_vectors) > self.query_cache_size:
+                self.query_vectors.popitem(last=False)
+        return vector
+
+    def report(self) -> str:
+        return self.stats.report()
+
+    def query_report(self) -> str:
+        return (f"🔎 Query embeddings: {self.query_hits} reused, {self.query_misses} embedded, "
+                f"{len(self.query_vectors)}/{self.query_cache_size} cached")
@@ -0,0 +1,171 @@
+import os
+import time
+import random
+import zlib
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CachedEmbeddings, EmbeddingCacheStats
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a character-based estimate
+    tiktoken = None
+
+try:
+    import openai
+    TRANSIENT_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                        openai.InternalServerError, ConnectionError, TimeoutError)
+except ImportError:
+    TRANSIENT_ERRORS = (ConnectionError, TimeoutError)
+
+# "openai" or "local" (a deterministic offline stand-in, for benchmarks and development without network)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+# Each embedding request carries at most this many tokens / texts
+EMBED_MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "20000"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+
+_encoding = None
+
+
+def get_encoding():
+    """Get the embedding model's tokenizer, or None if tiktoken is missing or cannot load it"""
+    global _encoding
+    if _encoding is None:
+        _encoding = False
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:  # the BPE file is downloaded on first use, which fails offline
+                print(f"⚠️ tiktoken unavailable ({type(e).__name__}), estimating token counts")
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the embedding model's tokenizer, or estimate ~4 characters per token"""
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def iter_token_batches(chunks, max_tokens: int = EMBED_MAX_BATCH_TOKENS, max_items: int = EMBED_BATCH_SIZE):
+    """Pack chunks into batches bounded by a token budget and an item count (noting each chunk's tokens)"""
+    batch, batch_tokens = [], 0
+    for chunk in chunks:
+        tokens = chunk.get("tokens") or count_tokens(chunk["page_content"])
+        chunk["tokens"] = tokens
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(chunk)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+class LocalHashEmbeddings(Embeddings):
+    """Deterministic, offline embeddings from hashed word and bigram features.
+
+    Similar texts get similar vectors, which is enough to exercise the index and retrieval end to
+    end; an optional per-call latency stands in for the network when benchmarking.
+    """
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.model = f"local-hash-{dimensions}"
+
+    def embed_text(self, text: str) -> list:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = text.lower().split()
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = zlib.crc32(feature.encode())
+            vector[digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.embed_text(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_text(text)
+
+
+def get_base_embeddings(api_key: str = None) -> Embeddings:
+    """Get the embedding model selected by EMBEDDING_BACKEND"""
+    if EMBEDDING_BACKEND == "local":
+        return LocalHashEmbeddings()
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(api_key=api_key)
+
+
+def embed_with_retries(embeddings: Embeddings, texts: list, **kwargs) -> list:
+    """Embed one batch, retrying transient failures (rate limits, timeouts, 5xx) with jittered backoff"""
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            return embeddings.embed_documents(texts, **kwargs)
+        except TRANSIENT_ERRORS as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"⏳ Embedding batch failed ({type(e).__name__}), retry {attempt + 1}/{EMBED_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class EmbeddingPipeline:
+    """Embed batches of chunks concurrently, yielding (batch, vectors) as each batch finishes.
+
+    At most ``concurrency`` requests are in flight and batches are pulled lazily from the input,
+    so memory stays bounded however large the corpus is. With a cached model, the cache hits and
+    misses of this run alone are counted in ``cache_stats``.
+    """
+
+    def __init__(self, embeddings: Embeddings, concurrency: int = EMBED_CONCURRENCY):
+        self.embeddings = embeddings
+        self.concurrency = max(1, concurrency)
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self.cache_stats = EmbeddingCacheStats() if isinstance(embeddings, CachedEmbeddings) else None
+
+    def embed_batch(self, batch: list):
+        texts = [chunk["page_content"] for chunk in batch]
+        if self.cache_stats is not None:
+            vectors = embed_with_retries(self.embeddings, texts, stats=self.cache_stats)
+        else:
+            vectors = embed_with_retries(self.embeddings, texts)
+        with self.lock:
+            self.batches += 1
+            self.texts += len(texts)
+            self.tokens += sum(chunk.get("tokens", 0) for chunk in batch)
+        return batch, vectors
+
+    def run(self, batches):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = set()
+            for batch in batches:
+                pending.add(executor.submit(self.embed_batch, batch))
+                if len(pending) >= self.concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
+        self.seconds += time.perf_counter() - start
+
+    def report(self) -> str:
+        rate = self.texts / self.seconds if self.seconds else 0.0
+        return (f"⚡ Embedded {self.texts} chunks ({self.tokens} tokens) in {self.batches} batches, "
+                f"{self.seconds:.1f}s at {rate:.0f} chunks/s (concurrency {self.concurrency})")
@@ -0,0 +1,102 @@
+import os
+import json
+import sqlite3
+
+from file_store import hash_file
+
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", os.path.join("cache", "extraction_cache.sqlite"))
+# Bump whenever extractor output changes so stale extractions are not served
+EXTRACTOR_VERSION = 4
+
+
+class ExtractionCache:
+    """On-disk cache of extracted text, keyed by file fingerprint.
+
+    A file's (path, size, mtime) is mapped to its sha256 so unchanged files are not even re-hashed;
+    extractions are stored per content hash, so a renamed or re-downloaded file with the same bytes
+    is still a hit.
+    """
+
+    def __init__(self, path: str = EXTRACTION_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS extractions (
+                sha256 TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                format TEXT,
+                records TEXT NOT NULL,
+                PRIMARY KEY (sha256, version)
+            );
+        """)
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, file_path: str) -> str:
+        """Get the content hash of a file, re-hashing only if its size or mtime changed"""
+        path = os.path.realpath(file_path)
+        stat = os.stat(path)
+        row = self.conn.execute(
+            "SELECT sha256 FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        if row:
+            return row[0]
+        digest = hash_file(path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, digest),
+        )
+        self.conn.commit()
+        return digest
+
+    def has(self, digest: str) -> bool:
+        """Check whether a content hash has a cached extraction (counting the hit or miss)"""
+        found = self.conn.execute(
+            "SELECT 1 FROM extractions WHERE sha256 = ? AND version = ?",
+            (digest, EXTRACTOR_VERSION),
+        ).fetchone() is not None
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+    def get(self, digest: str):
+        """Get the cached records for a content hash, or None"""
+        row = self.conn.execute(
+            "SELECT records FROM extractions WHERE sha256 = ? AND version = ?",
+            (digest, EXTRACTOR_VERSION),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, digest: str, file_format: str, records: list):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO extractions (sha256, version, format, records) VALUES (?, ?, ?, ?)",
+            (digest, EXTRACTOR_VERSION, file_format, json.dumps(records)),
+        )
+        self.conn.commit()
+
+    def prune(self):
+        """Forget files that no longer exist and extractions nothing points at any more"""
+        gone = [(path,) for (path,) in self.conn.execute("SELECT path FROM files") if not os.path.exists(path)]
+        self.conn.executemany("DELETE FROM files WHERE path = ?", gone)
+        self.conn.execute(
+            "DELETE FROM extractions WHERE version != ? OR sha256 NOT IN (SELECT sha256 FROM files)",
+            (EXTRACTOR_VERSION,),
+        )
+        self.conn.commit()
+
+    def report(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return f"🗃️ Extraction cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate)"
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,157 @@
+import os
+import time
+import hashlib
+import shutil
+import threading
+
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "blob_store")
+# Partial downloads untouched for this long are assumed abandoned
+PARTIAL_MAX_AGE = 7 * 24 * 3600
+
+# One lock per store directory, shared by every BlobStore on it: syncs run on their own threads
+STORE_LOCKS = {}
+STORE_LOCKS_GUARD = threading.Lock()
+
+
+def hash_file(path: str) -> str:
+    """Get the sha256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_store_lock(root: str):
+    with STORE_LOCKS_GUARD:
+        return STORE_LOCKS.setdefault(os.path.realpath(root), threading.RLock())
+
+
+class BlobStore:
+    """Content-addressed store for downloaded course files.
+
+    Each unique file body is stored once under ``blobs/<aa>/<sha256>``; course folders only hold
+    links to blobs, so the same slide deck attached to two courses costs one copy on disk and one
+    parse. Downloads land in ``partial/`` first and can be resumed from there with a Range request.
+
+    Storing or linking a blob and garbage collection hold the store's lock, so a blob committed by
+    one sync is linked before another sync's collection can see it as unreferenced.
+    """
+
+    def __init__(self, root: str = BLOB_STORE_DIR):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.partial_dir = os.path.join(root, "partial")
+        self.lock = get_store_lock(root)
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def has_blob(self, digest: str, size: int = None) -> bool:
+        if not digest:
+            return False
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            return False
+        return size is None or os.path.getsize(path) == size
+
+    def partial_path(self, download_key: str) -> str:
+        """Get the stable path a download is written to until it is complete"""
+        return os.path.join(self.partial_dir, f"{download_key}.part")
+
+    def commit(self, partial_path: str, expected_size: int = None, expected_digest: str = None,
+               link_path: str = None) -> str:
+        """Validate a finished download and move it into the store, returning its digest.
+
+        The blob is linked at link_path (if given) before garbage collection can run. Raises
+        ValueError (leaving nothing behind) if the size or checksum does not match.
+        """
+        size = os.path.getsize(partial_path)
+        if expected_size is not None and size != expected_size:
+            os.remove(partial_path)
+            raise ValueError(f"size mismatch: expected {expected_size} bytes, got {size}")
+
+        digest = hash_file(partial_path)
+        if expected_digest is not None and digest != expected_digest:
+            os.remove(partial_path)
+            raise ValueError(f"checksum mismatch: expected {expected_digest}, got {digest}")
+
+        with self.lock:
+            if self.has_blob(digest, size):
+                # Same content already stored (e.g. attached to another course)
+                os.remove(partial_path)
+            else:
+                os.makedirs(os.path.dirname(self.blob_path(digest)), exist_ok=True)
+                os.replace(partial_path, self.blob_path(digest))
+            if link_path:
+                self.link(digest, link_path)
+        return digest
+
+    def is_linked(self, link_path: str, digest: str) -> bool:
+        """Check that link_path currently resolves to the blob for digest"""
+        if not digest or not os.path.exists(link_path):
+            return False
+        return os.path.samefile(link_path, self.blob_path(digest))
+
+    def link(self, digest: str, link_path: str):
+        """Point a course file path at a blob (symlink, falling back to a hard link or copy)"""
+        os.makedirs(os.path.dirname(link_path), exist_ok=True)
+        blob_path = self.blob_path(digest)
+        with self.lock:
+            if os.path.lexists(link_path):
+                os.remove(link_path)
+            try:
+                os.symlink(os.path.relpath(blob_path, os.path.dirname(link_path)), link_path)
+            except OSError:
+                try:
+                    os.link(blob_path, link_path)
+                except OSError:
+                    shutil.copyfile(blob_path, link_path)
+
+    def link_existing(self, digest: str, link_path: str, size: int = None) -> bool:
+        """Link a course file path to a stored blob, returning False if the store no longer has it"""
+        with self.lock:
+            if not self.has_blob(digest, size):
+                return False
+            if not self.is_linked(link_path, digest):
+                self.link(digest, link_path)
+            return True
+
+    def adopt(self, path: str, expected_size: int = None) -> str:
+        """Move a plain file downloaded before the store existed into it and link it back"""
+        partial_path = self.partial_path(f"adopt-{hashlib.sha256(path.encode()).hexdigest()[:16]}")
+        os.replace(path, partial_path)
+        return self.commit(partial_path, expected_size, link_path=path)
+
+    def collect_garbage(self, *link_roots: str) -> int:
+        """Delete blobs no course folder links to and stale partial downloads, returning the count"""
+        with self.lock:
+            return self.collect_unlinked(link_roots)
+
+    def collect_unlinked(self, link_roots) -> int:
+        live = set()
+        for link_root in link_roots:
+            for root, _, files in os.walk(link_root):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if os.path.exists(path):
+                        live.add((os.stat(path).st_dev, os.stat(path).st_ino))
+
+        removed = 0
+        for root, _, files in os.walk(self.blob_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                if (stat.st_dev, stat.st_ino) not in live:
+                    os.remove(path)
+                    removed += 1
+
+        cutoff = time.time() - PARTIAL_MAX_AGE
+        for name in os.listdir(self.partial_dir):
+            path = os.path.join(self.partial_dir, name)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        return removed
@@ -0,0 +1,98 @@
+import os
+from contextlib import nullcontext
+from typing import Any
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables.config import run_in_executor
+from pydantic import ConfigDict
+
+from index_factory import search_positions
+from lexical_index import tokenize
+
+# Chunks returned for the context packer to choose from, and candidates taken from each search before fusion
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "12"))
+RETRIEVER_FETCH_K = int(os.getenv("RETRIEVER_FETCH_K", "20"))
+# Reciprocal rank fusion constant: larger values flatten the advantage of the very top ranks
+RRF_K = 60
+# Queries of at most this many terms that one chunk matches completely skip the vector search
+EXACT_MATCH_MAX_TERMS = 4
+
+
+def reciprocal_rank_fusion(*rankings, k: int = RRF_K) -> list:
+    """Merge ranked lists of ids into one, scoring each id by the sum of 1 / (k + rank)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """Retrieve chunks by fusing BM25 and vector search results with reciprocal rank fusion.
+
+    Exact tokens (assignment names, course codes, "HW3") are found by the lexical index; paraphrases
+    by the embeddings. Short queries one chunk matches term for term are answered from the lexical
+    index alone, which saves the query embedding call.
+
+    A metadata ``filter`` (see MetadataIndex.select) restricts both searches to the matching chunks
+    before they run, e.g. ``retriever.invoke(query, filter={"type": "course_list"})``. Passing a
+    StageTimer as ``timings`` records how long each step took.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: Any
+    k: int = RETRIEVER_K
+    fetch_k: int = RETRIEVER_FETCH_K
+
+    def lexical_search(self, query: str, selection=None) -> list:
+        allowed = selection.chunk_ids if selection is not None else None
+        return self.vector_store.docstore.lexical.search(query, self.fetch_k, allowed)
+
+    def dense_search(self, query_vector: list, selection=None) -> list:
+        if selection is None:
+            return self.vector_store.similarity_search_by_vector(query_vector, k=self.fetch_k)
+        _, positions = search_positions(self.vector_store.index, query_vector, self.fetch_k, selection.positions)
+        mapping = self.vector_store.index_to_docstore_id
+        return self.get_documents([mapping[int(position)] for position in positions])
+
+    def get_documents(self, chunk_ids: list) -> list:
+        docs = (self.vector_store.docstore.search(chunk_id) for chunk_id in chunk_ids)
+        return [doc for doc in docs if isinstance(doc, Document)]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                filter: dict = None, timings=None, **kwargs: Any) -> list:
+        stage = timings.stage if timings is not None else lambda name: nullcontext()
+        selection = None
+        if filter:
+            with stage("filter"):
+                selection = self.vector_store.docstore.metadata_index.select(filter)
+            if not len(selection):
+                return []
+        with stage("lexical"):
+            lexical_hits = self.lexical_search(query, selection)
+        query_terms = set(tokenize(query))
+        if lexical_hits and len(query_terms) <= EXACT_MATCH_MAX_TERMS and lexical_hits[0][2] == len(query_terms):
+            with stage("fetch"):
+                return self.get_documents([chunk_id for chunk_id, _, _ in lexical_hits[:self.k]])
+
+        # Embedded once; the embeddings keep recent queries, so a query the answer cache embedded is free here
+        with stage("embed"):
+            query_vector = self.vector_store.embeddings.embed_query(query)
+        with stage("dense"):
+            dense_docs = self.dense_search(query_vector, selection)
+        by_id = {doc.id: doc for doc in dense_docs}
+        fused = reciprocal_rank_fusion([doc.id for doc in dense_docs], [chunk_id for chunk_id, _, _ in lexical_hits])
+        top_ids = fused[:self.k]
+        with stage("fetch"):
+            missing = self.get_documents([chunk_id for chunk_id in top_ids if chunk_id not in by_id])
+        by_id.update((doc.id, doc) for doc in missing)
+        return [by_id[chunk_id] for chunk_id in top_ids if chunk_id in by_id]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun,
+                                       filter: dict = None, timings=None, **kwargs: Any) -> list:
+        # The base class drops keyword arguments when it moves the search to a thread
+        return await run_in_executor(None, self._get_relevant_documents, query, run_manager=run_manager.get_sync(),
+                                     filter=filter, timings=timings)
@@ -0,0 +1,226 @@
+import os
+import math
+import threading
+
+import faiss
+import numpy as np
+
+# "auto" picks the family from the corpus size; "flat", "hnsw", "ivf" or "ivfpq" pins one.
+# IVF-PQ keeps only compressed codes and does not re-rank with exact vectors, so its recall is
+# capped (about 0.6 in bench_index); it saves memory but is never picked automatically.
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+# Corpus sizes (vectors) up to which each family is chosen automatically; anything larger gets IVF
+FLAT_MAX_VECTORS = int(os.getenv("FLAT_MAX_VECTORS", "20000"))
+HNSW_MAX_VECTORS = int(os.getenv("HNSW_MAX_VECTORS", "200000"))
+
+# Search-time accuracy/speed knobs, applied whenever an index is built or loaded
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "16"))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+# Build-time parameters
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = 80
+PQ_M = int(os.getenv("PQ_M", "64"))  # sub-quantizers; must divide the embedding dimension
+PQ_BITS = 8
+# k-means wants roughly 40-256 training points per list; more only slows training down
+TRAIN_POINTS_PER_LIST = 64
+MAX_TRAIN_POINTS = 200000
+# Vectors are copied between indexes this many at a time to bound memory
+COPY_BLOCK = 10000
+MIN_PQ_VECTORS = 10000
+# Filtered searches selecting at most this many vectors compare them exhaustively instead of searching the index
+FILTER_EXACT_MAX_VECTORS = int(os.getenv("FILTER_EXACT_MAX_VECTORS", "4096"))
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+# Guards direct maps built on indexes that did not come through tune_index
+DIRECT_MAP_LOCK = threading.Lock()
+
+
+def choose_index_type(n_vectors: int) -> str:
+    """Get the index family for a corpus size, honouring INDEX_TYPE when it is not "auto\""""
+    if INDEX_TYPE in INDEX_TYPES:
+        return INDEX_TYPE
+    if n_vectors <= FLAT_MAX_VECTORS:
+        return "flat"
+    if n_vectors <= HNSW_MAX_VECTORS:
+        return "hnsw"
+    return "ivf"
+
+
+def effective_index_type(index_type: str, n_vectors: int) -> str:
+    """Get the family an index of n_vectors is actually built as when index_type is requested"""
+    if index_type in ("ivf", "ivfpq") and not n_vectors:
+        return "flat"  # nothing to train on yet
+    if index_type == "ivfpq" and n_vectors < MIN_PQ_VECTORS:
+        return "ivf"  # too few vectors to train 2^PQ_BITS codewords per sub-quantizer
+    return index_type
+
+
+def get_index_type(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def get_nlist(n_vectors: int) -> int:
+    """Number of IVF lists: ~4*sqrt(n), but never more than the data can train"""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def tune_index(index):
+    """Apply the configured search parameters (nprobe / efSearch) to an index.
+
+    IVF indexes also get their direct map here, when built or loaded, so queries that reconstruct
+    stored vectors never modify an index being served.
+    """
+    index_type = get_index_type(index)
+    if index_type in ("ivf", "ivfpq"):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = INDEX_NPROBE
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+    elif index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = INDEX_EF_SEARCH
+    return index
+
+
+def build_index(index_type: str, dimensions: int, n_vectors: int = 0, train_vectors=None):
+    """Create an empty index of the given family, trained on train_vectors if it needs training"""
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimensions)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimensions, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return tune_index(index)
+
+    nlist = get_nlist(n_vectors or len(train_vectors))
+    quantizer = faiss.IndexFlatL2(dimensions)
+    if index_type == "ivf":
+        index = faiss.IndexIVFFlat(quantizer, dimensions, nlist)
+    elif index_type == "ivfpq":
+        m = PQ_M if dimensions % PQ_M == 0 else math.gcd(dimensions, PQ_M)
+        index = faiss.IndexIVFPQ(quantizer, dimensions, nlist, m, PQ_BITS)
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+    index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+    return tune_index(index)
+
+
+def prepare_reconstruct(index):
+    """IVF indexes can only hand back stored vectors once they keep a direct id -> list map.
+
+    A no-op for indexes that went through tune_index, which already built it.
+    """
+    if get_index_type(index) in ("ivf", "ivfpq"):
+        ivf = faiss.extract_index_ivf(index)
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            with DIRECT_MAP_LOCK:
+                if ivf.direct_map.type == faiss.DirectMap.NoMap:
+                    ivf.make_direct_map()
+
+
+def iter_vector_blocks(index, positions=None):
+    """Yield the stored vectors (all of them, or the given sorted positions) in blocks"""
+    prepare_reconstruct(index)
+    if positions is None:
+        for start in range(0, index.ntotal, COPY_BLOCK):
+            yield index.reconstruct_n(start, min(COPY_BLOCK, index.ntotal - start))
+    else:
+        for start in range(0, len(positions), COPY_BLOCK):
+            yield index.reconstruct_batch(np.asarray(positions[start:start + COPY_BLOCK], dtype=np.int64))
+
+
+def get_search_parameters(index, selector):
+    """Get search parameters restricting a search to selector, with the configured nprobe / efSearch"""
+    index_type = get_index_type(index)
+    if index_type in ("ivf", "ivfpq"):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=INDEX_NPROBE)
+    if index_type == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=INDEX_EF_SEARCH)
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_positions(index, query_vector, k: int, positions):
+    """Search only the vectors at the given sorted positions, returning (distances, positions).
+
+    Small selections are compared exhaustively, which costs O(selection) instead of a full search.
+    Larger ones search the index with a bitmap selector, so unselected vectors are skipped during
+    the scan or graph walk rather than filtered out afterwards.
+    """
+    query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+    if not len(positions):
+        return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+    if len(positions) <= FILTER_EXACT_MAX_VECTORS:
+        prepare_reconstruct(index)
+        vectors = index.reconstruct_batch(positions)
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        top = np.argsort(distances)[:k]
+        return distances[top], positions[top]
+
+    bitmap = np.zeros((index.ntotal + 7) // 8, dtype=np.uint8)
+    np.bitwise_or.at(bitmap, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+    selector = faiss.IDSelectorBitmap(index.ntotal, faiss.swig_ptr(bitmap))
+    distances, found = index.search(query, k, params=get_search_parameters(index, selector))
+    keep = found[0] >= 0
+    return distances[0][keep], found[0][keep]
+
+
+def sample_vectors(index, count: int):
+    """Get a random sample of the stored vectors for training"""
+    if count >= index.ntotal:
+        return np.vstack(list(iter_vector_blocks(index)))
+    positions = np.sort(np.random.default_rng(0).choice(index.ntotal, size=count, replace=False))
+    return np.vstack(list(iter_vector_blocks(index, positions)))
+
+
+def rebuild_index(index, index_type: str, keep_positions=None):
+    """Copy the vectors of an index (optionally only keep_positions, in order) into a new index.
+
+    Positions are preserved in order, so a docstore mapping only needs renumbering.
+    """
+    n_vectors = index.ntotal if keep_positions is None else len(keep_positions)
+    index_type = effective_index_type(index_type, n_vectors)
+    train_vectors = None
+    if index_type in ("ivf", "ivfpq"):
+        train_count = min(n_vectors, max(get_nlist(n_vectors) * TRAIN_POINTS_PER_LIST, 10000), MAX_TRAIN_POINTS)
+        train_vectors = sample_vectors(index, train_count)
+
+    new_index = build_index(index_type, index.d, n_vectors, train_vectors)
+    for block in iter_vector_blocks(index, keep_positions):
+        new_index.add(block)
+    return new_index
+
+
+def remove_positions(index, positions):
+    """Drop the vectors at the given positions, keeping the remaining ones in order.
+
+    Flat indexes support this directly; HNSW cannot remove vectors and IVF keeps stale ids on
+    removal, so those are rebuilt from the vectors that stay.
+    """
+    if not positions:
+        return index
+    if get_index_type(index) == "flat":
+        index.remove_ids(np.asarray(sorted(positions), dtype=np.int64))
+        return index
+    dead = set(positions)
+    keep = [i for i in range(index.ntotal) if i not in dead]
+    return rebuild_index(index, get_index_type(index), keep)
+
+
+def fit_index(index):
+    """Migrate an index to the family its current size calls for, returning it unchanged if it fits"""
+    current_type = get_index_type(index)
+    index_type = choose_index_type(index.ntotal)
+    # Hysteresis: only step down to a smaller family once the corpus has shrunk well below its limit
+    if INDEX_TYPE == "auto" and INDEX_TYPES.index(current_type) > INDEX_TYPES.index(index_type) \
+            and INDEX_TYPES.index(choose_index_type(index.ntotal * 2)) >= INDEX_TYPES.index(current_type):
+        index_type = current_type
+    index_type = effective_index_type(index_type, index.ntotal)
+    if current_type == index_type:
+        return tune_index(index)
+    print(f"🔧 Rebuilding index as {index_type} for {index.ntotal} vectors (was {get_index_type(index)})")
+    return rebuild_index(index, index_type)
@@ -0,0 +1,258 @@
+import os
+import shutil
+import sqlite3
+import hashlib
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from sync_manifest import get_fingerprint
+from index_factory import build_index, remove_positions, tune_index
+from sqlite_docstore import SQLiteDocstore
+
+# On-disk layout of a saved vector store
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+# Written by FAISS.save_local before the SQLite docstore existed; never unpickled
+LEGACY_PICKLE_FILE = "index.pkl"
+# A shard directory holds immutable versions v1, v2, ...; CURRENT names the one being served
+CURRENT_FILE = "CURRENT"
+VERSION_PREFIX = "v"
+STORE_FILES = (INDEX_FILE, DOCSTORE_FILE, f"{DOCSTORE_FILE}-wal", f"{DOCSTORE_FILE}-shm", LEGACY_PICKLE_FILE)
+
+
+def get_chunk_id(metadata: dict, offset: int) -> str:
+    """Get a deterministic id for the chunk starting at offset within the record metadata describes.
+
+    The id only depends on where the chunk comes from (source, page and row range), never on its
+    text, so an edited page keeps its ids and its chunks are replaced in place on re-ingest.
+    """
+    location = (metadata.get("source"), metadata.get("page"), metadata.get("first_row"), offset)
+    return hashlib.sha256(repr(location).encode()).hexdigest()[:32]
+
+
+def get_content_hash(text: str, metadata: dict) -> str:
+    """Fingerprint a chunk's text and metadata, so either changing marks the chunk as changed"""
+    return get_fingerprint(text, metadata)
+
+
+class IndexUpsert:
+    """Bring a FAISS vector store in line with the live corpus, one batch of chunks at a time.
+
+    ``plan`` decides per chunk: a new id is added, a changed content hash is replaced, an unchanged
+    chunk is left alone (and never re-embedded). ``add`` stores the embedded chunks once their
+    vectors arrive, and ``finish`` deletes every id that was not seen, so the index only ever holds
+    the chunks of sources that still exist (sources that failed to extract keep theirs).
+
+    Vectors are never removed mid-ingest: replaced chunks only leave the docstore, and all dead
+    positions are dropped in one pass at the end. That keeps the position -> id mapping dense
+    (which FAISS.add relies on) and lets index families that cannot remove in place (HNSW, IVF) be
+    compacted with a single rebuild.
+    """
+
+    def __init__(self, vector_store):
+        self.vector_store = vector_store
+        # Ids stored before this ingest (and their positions); ids added during it are tracked in seen
+        self.stored_positions = {chunk_id: i for i, chunk_id in vector_store.index_to_docstore_id.items()}
+        self.dead_positions = set()
+        self.seen = set()
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+
+    def stored_hash(self, chunk_id: str):
+        doc = self.vector_store.docstore.search(chunk_id)
+        return doc.metadata.get("content_hash") if hasattr(doc, "metadata") else None
+
+    def stored_source(self, chunk_id: str):
+        doc = self.vector_store.docstore.search(chunk_id)
+        return doc.metadata.get("source") if hasattr(doc, "metadata") else None
+
+    def plan(self, batch: list) -> list:
+        """Get the chunks of a batch of {'id', 'page_content', 'metadata'} that need embedding.
+
+        Stale versions of changed chunks leave the docstore right away; their replacements go in via add.
+        """
+        replaced, new_chunks = [], []
+        for chunk in batch:
+            chunk_id = chunk["id"]
+            if chunk_id in self.seen:
+                continue  # the same location twice in one ingest; keep the first
+            self.seen.add(chunk_id)
+            if chunk_id in self.stored_positions:
+                if self.stored_hash(chunk_id) == chunk["metadata"]["content_hash"]:
+                    self.unchanged += 1
+                    continue
+                replaced.append(chunk_id)
+            new_chunks.append(chunk)
+
+        self.detach(replaced)
+        self.updated += len(replaced)
+        self.added += len(new_chunks) - len(replaced)
+        return new_chunks
+
+    def add(self, chunks: list, vectors: list):
+        """Store embedded chunks"""
+        self.vector_store.add_embeddings(
+            [(chunk["page_content"], vector) for chunk, vector in zip(chunks, vectors)],
+            metadatas=[chunk["metadata"] for chunk in chunks],
+            ids=[chunk["id"] for chunk in chunks],
+        )
+
+    def detach(self, chunk_ids: list):
+        """Remove chunks from the docstore and mark their vectors for removal in finish"""
+        if chunk_ids:
+            self.vector_store.docstore.delete(chunk_ids)
+            self.dead_positions.update(self.stored_positions[chunk_id] for chunk_id in chunk_ids)
+
+    def finish(self, failed_sources=()):
+        """Delete every stored chunk that did not appear in this ingest, then compact the index.
+
+        Chunks of failed_sources (files whose extraction failed this time) are kept as they are.
+        """
+        stale = [chunk_id for chunk_id in self.stored_positions if chunk_id not in self.seen]
+        if failed_sources:
+            stale = [chunk_id for chunk_id in stale if self.stored_source(chunk_id) not in failed_sources]
+        self.detach(stale)
+        self.removed = len(stale)
+
+        if self.dead_positions:
+            vector_store = self.vector_store
+            vector_store.index = remove_positions(vector_store.index, self.dead_positions)
+            mapping = vector_store.index_to_docstore_id
+            live_ids = [chunk_id for i, chunk_id in sorted(mapping.items()) if i not in self.dead_positions]
+            mapping.clear()
+            mapping.update(enumerate(live_ids))
+            self.dead_positions = set()
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.removed)
+
+    def summary(self) -> str:
+        return (f"📚 Index upsert: {self.added} added, {self.updated} updated, {self.unchanged} unchanged, "
+                f"{self.removed} removed ({self.vector_store.index.ntotal} vectors)")
+
+
+def create_vector_store(path: str, embeddings, dimensions: int) -> FAISS:
+    """Start an empty vector store at path, discarding whatever was saved there"""
+    os.makedirs(path, exist_ok=True)
+    for name in STORE_FILES:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    docstore = SQLiteDocstore(os.path.join(path, DOCSTORE_FILE))
+    # New indexes start flat; fit_index picks the family once the corpus size is known
+    return FAISS(embeddings, build_index("flat", dimensions), docstore, docstore.index_to_docstore_id)
+
+
+def load_vector_store(path: str, embeddings, mmap: bool = True):
+    """Open a saved vector store, or return None if there is no complete one at path.
+
+    The index is memory-mapped (unless it is about to be modified) and chunks are read from SQLite
+    on demand, so opening costs the same whatever the corpus size and nothing is unpickled.
+    """
+    index_path = os.path.join(path, INDEX_FILE)
+    docstore_path = os.path.join(path, DOCSTORE_FILE)
+    if not (os.path.exists(index_path) and os.path.exists(docstore_path)):
+        if os.path.exists(os.path.join(path, LEGACY_PICKLE_FILE)):
+            print("⚠️ Found a pickled index from an older version; it will be rebuilt")
+        return None
+
+    index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP if mmap else 0)
+    docstore = SQLiteDocstore(docstore_path)
+    if docstore.get_meta("ntotal") != index.ntotal or len(docstore.index_to_docstore_id) != index.ntotal:
+        # Interrupted between writing the docstore and the index: start over rather than serve wrong chunks
+        print(f"⚠️ Vector store at {path} is inconsistent; it will be rebuilt")
+        docstore.close()
+        return None
+    return FAISS(embeddings, tune_index(index), docstore, docstore.index_to_docstore_id)
+
+
+def save_vector_store(vector_store: FAISS, path: str):
+    """Persist a vector store created or loaded by this module.
+
+    The docstore transaction is committed together with the index size it matches, then the new
+    index replaces the old one atomically; open memory maps of the old index stay valid.
+    """
+    index_path = os.path.join(path, INDEX_FILE)
+    faiss.write_index(vector_store.index, f"{index_path}.tmp")
+    vector_store.docstore.set_meta("ntotal", vector_store.index.ntotal)
+    vector_store.docstore.commit()
+    os.replace(f"{index_path}.tmp", index_path)
+
+
+# === Versions ===
+
+def get_current_version(shard_path: str):
+    """Get the directory of the version a shard serves, or None if it has none yet"""
+    try:
+        with open(os.path.join(shard_path, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return os.path.join(shard_path, f.read().strip())
+    except FileNotFoundError:
+        # Saved before versions existed: the store sits directly in the shard directory
+        return shard_path if os.path.exists(os.path.join(shard_path, INDEX_FILE)) else None
+
+
+def list_versions(shard_path: str) -> list:
+    if not os.path.isdir(shard_path):
+        return []
+    names = [name for name in os.listdir(shard_path)
+             if name.startswith(VERSION_PREFIX) and name[len(VERSION_PREFIX):].isdigit()]
+    return sorted(names, key=lambda name: int(name[len(VERSION_PREFIX):]))
+
+
+def begin_version(shard_path: str) -> str:
+    """Create the directory of a shard's next version, starting as a copy of the current one.
+
+    The current version is never written to, so it keeps being served while the copy is updated.
+    """
+    versions = list_versions(shard_path)
+    next_number = int(versions[-1][len(VERSION_PREFIX):]) + 1 if versions else 1
+    version_path = os.path.join(shard_path, f"{VERSION_PREFIX}{next_number}")
+    os.makedirs(version_path)
+
+    current = get_current_version(shard_path)
+    if current and os.path.exists(os.path.join(current, DOCSTORE_FILE)):
+        shutil.copyfile(os.path.join(current, INDEX_FILE), os.path.join(version_path, INDEX_FILE))
+        # The backup API copies a consistent snapshot even while readers have the file open
+        source = sqlite3.connect(os.path.join(current, DOCSTORE_FILE))
+        target = sqlite3.connect(os.path.join(version_path, DOCSTORE_FILE))
+        with target:
+            source.backup(target)
+        source.close()
+        target.close()
+    return version_path
+
+
+def publish_version(shard_path: str, version_path: str):
+    """Atomically make a saved version the one the shard serves"""
+    current_path = os.path.join(shard_path, CURRENT_FILE)
+    with open(f"{current_path}.tmp", "w", encoding="utf-8") as f:
+        f.write(os.path.basename(version_path))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{current_path}.tmp", current_path)
+
+
+def prune_versions(shard_path: str) -> int:
+    """Delete every version but the current one (and files from before versions), returning the count.
+
+    Open memory maps and SQLite connections of a deleted version stay valid until they are closed.
+    """
+    current = get_current_version(shard_path)
+    removed = 0
+    for name in list_versions(shard_path):
+        if os.path.join(shard_path, name) != current:
+            shutil.rmtree(os.path.join(shard_path, name), ignore_errors=True)
+            removed += 1
+    if current != shard_path:
+        for name in STORE_FILES:
+            if os.path.exists(os.path.join(shard_path, name)):
+                os.remove(os.path.join(shard_path, name))
+    return removed
+
+
+def discard_version(version_path: str):
+    """Delete a version that was never published (unchanged, or its ingest failed)"""
+    shutil.rmtree(version_path, ignore_errors=True)
@@ -0,0 +1,111 @@
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+
+# BM25 parameters: term frequency saturation and document length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Bump when tokenization changes so saved indexes are rebuilt from their chunks
+LEXICAL_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from has have how i in is it its of on or that the their this
+    to was were what when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> list:
+    """Split text into lowercase alphanumeric terms, so "HW3" and "CS 61A" match as typed"""
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+class LexicalIndex:
+    """Inverted BM25 index over chunk text, stored next to the docstore in the same SQLite file.
+
+    Chunks are added and removed by id as the docstore changes, so it is updated incrementally in
+    the same transaction as the chunks themselves. Corpus statistics are kept in memory once loaded.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self.conn = conn
+        self.lock = lock
+        with self.lock:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (term, chunk_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id);
+                CREATE TABLE IF NOT EXISTS lengths (
+                    chunk_id TEXT PRIMARY KEY,
+                    length INTEGER NOT NULL
+                );
+            """)
+            self.n_docs, total_length = self.conn.execute("SELECT COUNT(*), TOTAL(length) FROM lengths").fetchone()
+        self.total_length = int(total_length)
+
+    def add(self, chunks: dict):
+        """Index {chunk_id: text}; the caller holds the lock"""
+        postings, lengths = [], []
+        for chunk_id, text in chunks.items():
+            terms = tokenize(text)
+            postings.extend((term, chunk_id, tf) for term, tf in Counter(terms).items())
+            lengths.append((chunk_id, len(terms)))
+        self.conn.executemany("INSERT OR REPLACE INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)", postings)
+        self.conn.executemany("INSERT INTO lengths (chunk_id, length) VALUES (?, ?)", lengths)
+        self.n_docs += len(lengths)
+        self.total_length += sum(length for _, length in lengths)
+
+    def remove(self, chunk_ids: list):
+        """Drop chunks from the index; the caller holds the lock"""
+        for chunk_id in chunk_ids:
+            row = self.conn.execute("SELECT length FROM lengths WHERE chunk_id = ?", (chunk_id,)).fetchone()
+            if row is None:
+                continue
+            self.conn.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+            self.conn.execute("DELETE FROM lengths WHERE chunk_id = ?", (chunk_id,))
+            self.n_docs -= 1
+            self.total_length -= row[0]
+
+    def rebuild(self, chunks):
+        """Re-index every chunk from an iterable of (chunk_id, text); the caller holds the lock"""
+        self.conn.execute("DELETE FROM postings")
+        self.conn.execute("DELETE FROM lengths")
+        self.n_docs = self.total_length = 0
+        batch = {}
+        for chunk_id, text in chunks:
+            batch[chunk_id] = text
+            if len(batch) >= 1000:
+                self.add(batch)
+                batch = {}
+        self.add(batch)
+
+    def search(self, query: str, k: int = 20, allowed=None) -> list:
+        """Get the k best (chunk_id, score, matched_terms) for a query by BM25, optionally among allowed ids"""
+        terms = set(tokenize(query))
+        if not terms or not self.n_docs:
+            return []
+        average_length = self.total_length / self.n_docs or 1.0
+        scores = Counter()
+        matched = Counter()
+        with self.lock:
+            for term in terms:
+                rows = self.conn.execute(
+                    "SELECT p.chunk_id, p.tf, l.length FROM postings p JOIN lengths l ON l.chunk_id = p.chunk_id "
+                    "WHERE p.term = ?", (term,)
+                ).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (self.n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+                for chunk_id, tf, length in rows:
+                    if allowed is not None and chunk_id not in allowed:
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    scores[chunk_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                    matched[chunk_id] += 1
+        return [(chunk_id, score, matched[chunk_id]) for chunk_id, score in scores.most_common(k)]
@@ -0,0 +1,119 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Chunk metadata fields searches can be filtered on
+METADATA_FIELDS = ("type", "course", "assignment", "due_at", "format")
+# Bump when the indexed fields change so saved indexes are rebuilt from their chunks
+METADATA_INDEX_VERSION = 1
+# Distinct filters whose selections are kept per open shard
+MAX_CACHED_SELECTIONS = 64
+
+RANGE_OPERATORS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+class Selection:
+    """The chunks a filter matches: their index positions (sorted) and their ids"""
+
+    def __init__(self, positions, chunk_ids):
+        self.positions = np.asarray(sorted(positions), dtype=np.int64)
+        self.chunk_ids = frozenset(chunk_ids)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+def get_filter_key(filter: dict) -> str:
+    return json.dumps(filter, sort_keys=True, default=str)
+
+
+class MetadataIndex:
+    """(field, value) -> chunk index over METADATA_FIELDS, stored next to the docstore in SQLite.
+
+    ``select`` turns a filter like ``{"type": "assignment", "due_at": {"$gte": "2024-03-01"}}`` into
+    the positions it matches in the vector index, so the filter is applied during the search rather
+    than by over-fetching. Selections are cached until the docstore changes.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self.conn = conn
+        self.lock = lock
+        self.selections = OrderedDict()
+        with self.lock:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS chunk_meta (
+                    field TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    PRIMARY KEY (field, value, chunk_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS chunk_meta_chunk ON chunk_meta (chunk_id);
+            """)
+
+    def add(self, chunks: dict):
+        """Index {chunk_id: metadata}; the caller holds the lock"""
+        rows = [(field, str(metadata[field]), chunk_id)
+                for chunk_id, metadata in chunks.items()
+                for field in METADATA_FIELDS if metadata.get(field) is not None]
+        self.conn.executemany("INSERT OR REPLACE INTO chunk_meta (field, value, chunk_id) VALUES (?, ?, ?)", rows)
+        self.selections.clear()
+
+    def remove(self, chunk_ids: list):
+        """Drop chunks from the index; the caller holds the lock"""
+        self.conn.executemany("DELETE FROM chunk_meta WHERE chunk_id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+        self.selections.clear()
+
+    def rebuild(self, chunks):
+        """Re-index every chunk from an iterable of (chunk_id, metadata); the caller holds the lock"""
+        self.conn.execute("DELETE FROM chunk_meta")
+        self.add(dict(chunks))
+
+    def get_condition(self, field: str, condition):
+        """Get the SQL (and its parameters) matching one field's condition"""
+        if field not in METADATA_FIELDS:
+            raise ValueError(f"Cannot filter on '{field}'; indexed fields are {', '.join(METADATA_FIELDS)}")
+        if isinstance(condition, (list, tuple, set)):
+            values = [str(value) for value in condition]
+            return f"m.field = ? AND m.value IN ({','.join('?' * len(values))})", [field, *values]
+        if isinstance(condition, dict):
+            clauses, params = ["m.field = ?"], [field]
+            for operator, value in condition.items():
+                if operator in RANGE_OPERATORS:
+                    clauses.append(f"m.value {RANGE_OPERATORS[operator]} ?")
+                elif operator == "$eq":
+                    clauses.append("m.value = ?")
+                else:
+                    raise ValueError(f"Unsupported filter operator: {operator}")
+                params.append(str(value))
+            return " AND ".join(clauses), params
+        return "m.field = ? AND m.value = ?", [field, str(condition)]
+
+    def select(self, filter: dict) -> Selection:
+        """Get the chunks matching every condition of a filter"""
+        key = get_filter_key(filter)
+        with self.lock:
+            selection = self.selections.get(key)
+            if selection is not None:
+                self.selections.move_to_end(key)
+                return selection
+
+            matches = None
+            for field, condition in filter.items():
+                sql, params = self.get_condition(field, condition)
+                rows = self.conn.execute(
+                    f"SELECT p.position, m.chunk_id FROM chunk_meta m JOIN positions p ON p.id = m.chunk_id WHERE {sql}",
+                    params,
+                ).fetchall()
+                matches = set(rows) if matches is None else matches & set(rows)
+            matches = matches or set()
+            selection = Selection((position for position, _ in matches), (chunk_id for _, chunk_id in matches))
+            self.selections[key] = selection
+            while len(self.selections) > MAX_CACHED_SELECTIONS:
+                self.selections.popitem(last=False)
+        return selection
+
+    def clear_cache(self):
+        self.selections.clear()
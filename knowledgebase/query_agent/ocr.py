@@ -0,0 +1,76 @@
+import os
+import time
+import fitz  # PyMuPDF for rendering scanned pages
+import pytesseract
+from PIL import Image, ImageFilter, ImageStat
+
+# Resolution scanned PDF pages are rasterized at; ~200 DPI is where Tesseract accuracy levels off
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+# Larger images are downscaled before OCR; beyond this Tesseract gets slower without getting better
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2500"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or max(1, (os.cpu_count() or 1) // 2)
+# A PDF page with less text than this in its text layer is treated as scanned
+MIN_TEXT_LAYER_CHARS = 20
+
+
+def preprocess_image(image: Image.Image) -> Image.Image:
+    """Convert to grayscale and downscale oversized images before OCR"""
+    image = image.convert("L")
+    if max(image.size) > OCR_MAX_SIDE:
+        image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE))
+    return image
+
+
+def likely_has_text(image: Image.Image) -> bool:
+    """Cheaply rule out images that are too small, blank or too smooth to contain text"""
+    if min(image.size) < 32:
+        return False
+    sample = image.convert("L")
+    sample.thumbnail((256, 256))
+    if ImageStat.Stat(sample).stddev[0] < 8:
+        return False  # blank or a flat colour
+    # Glyphs produce many sharp edges; photos of scenery and gradients produce few
+    edges = sample.filter(ImageFilter.FIND_EDGES)
+    edge_pixels = sum(edges.histogram()[40:])
+    return edge_pixels / (sample.size[0] * sample.size[1]) >= 0.02
+
+
+def ocr_image(image: Image.Image, timeout: float = 0) -> str:
+    """OCR an image after preprocessing, returning "" for images unlikely to contain text"""
+    if not likely_has_text(image):
+        return ""
+    return pytesseract.image_to_string(preprocess_image(image), timeout=timeout)
+
+
+def render_pdf_page(pdf_path: str, page_number: int, dpi: int = OCR_DPI) -> Image.Image:
+    """Rasterize one (1-based) PDF page to a grayscale image"""
+    with fitz.open(pdf_path) as doc:
+        pix = doc[page_number - 1].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def needs_ocr(page) -> bool:
+    """Check whether a PyMuPDF page lacks a usable text layer but has images worth reading"""
+    return len(page.get_text("text").strip()) < MIN_TEXT_LAYER_CHARS and bool(page.get_images())
+
+
+def ocr_worker(task):
+    """OCR an image file (page_number None) or one scanned PDF page inside the OCR pool"""
+    file_path, page_number, timeout = task
+    result = {"kind": "ocr", "path": file_path, "page": page_number, "record": None, "error": None}
+    start = time.perf_counter()
+    try:
+        if page_number is None:
+            image = Image.open(file_path)
+        else:
+            image = render_pdf_page(file_path, page_number)
+        text = ocr_image(image, timeout)
+        if text.strip():
+            result["record"] = {"page_content": text, "metadata": {"page": page_number or 1, "ocr": True}}
+    except RuntimeError as e:
+        # pytesseract signals its own timeout with a RuntimeError
+        result["error"] = f"timed out after {timeout:.0f}s" if "timeout" in str(e).lower() else str(e)
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+    result["seconds"] = time.perf_counter() - start
+    return result
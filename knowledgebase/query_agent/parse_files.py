@@ -1,21 +1,108 @@
 import fitz  # PyMuPDF for PDFs
 import docx
-import pytesseract  # OCR for images
-import pandas as pd  # For Excel files
+import openpyxl  # For Excel files, streamed in read-only mode
+import pandas as pd  # For legacy .xls files
 import os
+import time
+import queue
+import signal
+import multiprocessing
 from PIL import Image
 from pptx import Presentation  # For PowerPoint files
+from extraction_cache import EXTRACTION_CACHE_PATH, ExtractionCache
+from ocr import OCR_WORKERS, needs_ocr, ocr_image, ocr_worker, render_pdf_page
+
+# Spreadsheet rows per record; bounds memory per sheet and keeps each record a sensible chunk
+EXCEL_ROW_BATCH = int(os.getenv("EXCEL_ROW_BATCH", "200"))
+
+def iter_pdf_pages(pdf_path):
+    """Yield (page number, text) for each page of a PDF."""
+    with fitz.open(pdf_path) as doc:
+        for page_number, page in enumerate(doc, start=1):
+            yield page_number, page.get_text("text")
+
+def iter_pptx_slides(pptx_path):
+    """Yield (slide number, text) for each slide of a PowerPoint (.pptx) file."""
+    presentation = Presentation(pptx_path)
+    for slide_number, slide in enumerate(presentation.slides, start=1):
+        yield slide_number, "\n".join(shape.text for shape in slide.shapes if hasattr(shape, "text"))
+
+def iter_sheet_rows(excel_path):
+    """Yield (sheet number, sheet name, row number, values) for each row of every sheet.
+
+    .xlsx files are read in openpyxl's read-only mode, which streams rows instead of loading the
+    workbook; legacy .xls files go through pandas one sheet at a time.
+    """
+    if excel_path.lower().endswith(".xls"):
+        with pd.ExcelFile(excel_path) as workbook:
+            for sheet_number, sheet_name in enumerate(workbook.sheet_names, start=1):
+                df = workbook.parse(sheet_name, header=None)
+                for row_number, values in enumerate(df.itertuples(index=False, name=None), start=1):
+                    yield sheet_number, sheet_name, row_number, [None if pd.isna(v) else v for v in values]
+        return
+
+    workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        for sheet_number, sheet in enumerate(workbook.worksheets, start=1):
+            for row_number, values in enumerate(sheet.iter_rows(values_only=True), start=1):
+                yield sheet_number, sheet.title, row_number, values
+    finally:
+        workbook.close()
+
+def format_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+def iter_excel_row_groups(excel_path, batch_size=None):
+    """Yield (sheet number, sheet name, first row, last row, text) for groups of rows.
+
+    The first non-empty row of a sheet is taken as its header and repeated in every group, so each
+    chunk stays readable on its own; only one group is held in memory at a time.
+    """
+    batch_size = batch_size or EXCEL_ROW_BATCH
+    current_sheet, header, lines, first_row, last_row = None, None, [], None, None
+
+    def flush():
+        text = f"Sheet: {current_sheet[1]} (rows {first_row}-{last_row})\n" + "\n".join(lines)
+        return current_sheet + (first_row, last_row, text)
+
+    for sheet_number, sheet_name, row_number, values in iter_sheet_rows(excel_path):
+        if current_sheet != (sheet_number, sheet_name):
+            if lines:
+                yield flush()
+            current_sheet, header, lines = (sheet_number, sheet_name), None, []
+
+        cells = [format_cell(value) for value in values]
+        if not any(cells):
+            continue
+        if header is None:
+            header = [cell or f"Column {i}" for i, cell in enumerate(cells, start=1)]
+            continue
+
+        if not lines:
+            first_row = row_number
+        last_row = row_number
+        lines.append(" | ".join(
+            f"{header[i] if i < len(header) else f'Column {i + 1}'}: {cell}"
+            for i, cell in enumerate(cells) if cell
+        ))
+        if len(lines) >= batch_size:
+            yield flush()
+            lines = []
+
+    if lines:
+        yield flush()
 
 def extract_text_from_pdf(pdf_path):
     """Extract text from a PDF file."""
-    text = ""
     try:
-        doc = fitz.open(pdf_path)
-        for page in doc:
-            text += page.get_text("text") + "\n"
+        return "\n".join(text for _, text in iter_pdf_pages(pdf_path))
     except Exception as e:
         print(f"⚠️ Error processing PDF {pdf_path}: {e}")
-    return text
+        return ""
 
 
 def extract_text_from_docx(docx_path):
@@ -31,13 +118,7 @@ def extract_text_from_txt(txt_path):
 def extract_text_from_pptx(pptx_path):
     """Extract text from a PowerPoint (.pptx) file."""
     try:
-        presentation = Presentation(pptx_path)
-        text = []
-        for slide in presentation.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text.append(shape.text)
-        return "\n".join(text)
+        return "\n".join(text for _, text in iter_pptx_slides(pptx_path))
     except Exception as e:
         print(f"Warning: Could not extract text from {pptx_path}: {str(e)}")
         return ""
@@ -46,55 +127,388 @@ def extract_text_from_images(image_path):
     """Extract text from an image using Tesseract OCR."""
     try:
         image = Image.open(image_path)
-        return pytesseract.image_to_string(image)
+        return ocr_image(image)
     except Exception as e:
         return f"Error processing image {image_path}: {str(e)}"
 
 def extract_text_from_excel(excel_path):
     """Extract text from an Excel file (.xlsx, .xls)."""
     try:
-        df = pd.read_excel(excel_path, engine='openpyxl')
-        return df.to_string(index=False)  # Convert dataframe to string
+        return "\n\n".join(text for *_, text in iter_excel_row_groups(excel_path))
     except Exception as e:
         return f"Error processing Excel file {excel_path}: {str(e)}"
 
-def extract_text_from_files(directory):
-    """Extract text from all supported file types in a directory."""
-    if not os.path.exists(directory):
-        print(f"Warning: Directory {directory} does not exist")
-        return []
-        
-    all_texts = []
+# === Page-level records ===
+# Each yields {'page_content': text, 'metadata': {'page': n, ...}}; errors propagate to the caller.
+
+def iter_pdf_records(pdf_path):
+    # Pages with no usable text layer are flagged rather than read, so only they pay for OCR
+    with fitz.open(pdf_path) as doc:
+        for page_number, page in enumerate(doc, start=1):
+            if needs_ocr(page):
+                yield {"page_content": "", "metadata": {"page": page_number, "needs_ocr": True}}
+            else:
+                yield {"page_content": page.get_text("text"), "metadata": {"page": page_number}}
+
+def iter_pptx_records(pptx_path):
+    for slide_number, text in iter_pptx_slides(pptx_path):
+        yield {"page_content": text, "metadata": {"page": slide_number}}
+
+def iter_excel_records(excel_path):
+    # One record per group of rows, so a large gradebook becomes many searchable chunks
+    for sheet_number, sheet_name, first_row, last_row, text in iter_excel_row_groups(excel_path):
+        yield {"page_content": text, "metadata": {
+            "page": sheet_number, "sheet": sheet_name, "first_row": first_row, "last_row": last_row,
+        }}
+
+def iter_docx_records(docx_path):
+    yield {"page_content": extract_text_from_docx(docx_path), "metadata": {"page": 1}}
+
+def iter_txt_records(txt_path):
+    yield {"page_content": extract_text_from_txt(txt_path), "metadata": {"page": 1}}
+
+def iter_image_records(image_path):
+    yield {"page_content": ocr_image(Image.open(image_path)), "metadata": {"page": 1, "ocr": True}}
+
+EXTRACTORS = {
+    ".pdf": iter_pdf_records,
+    ".docx": iter_docx_records,
+    ".txt": iter_txt_records,
+    ".pptx": iter_pptx_records,
+    ".png": iter_image_records,
+    ".jpg": iter_image_records,
+    ".jpeg": iter_image_records,
+    ".xlsx": iter_excel_records,
+    ".xls": iter_excel_records,
+}
+# Formats sent straight to the OCR pool instead of the parsing pool
+OCR_FORMATS = (".png", ".jpg", ".jpeg")
+
+# Pool size defaults to one worker per CPU; each file gets a wall-clock budget
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "0")) or os.cpu_count() or 1
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "120"))
+# Extra time the parent waits before assuming a worker is stuck somewhere the timeout cannot reach
+EXTRACTION_GRACE = 30
+
+
+class ExtractionTimeout(BaseException):
+    """Raised inside a worker when a file exceeds its time budget.
+
+    Derives from BaseException so the extractors' own ``except Exception`` blocks cannot swallow it.
+    """
+
+
+def _raise_timeout(signum, frame):
+    raise ExtractionTimeout()
+
+
+def get_file_format(file_path: str):
+    """Get the lowercase extension of a supported file, or None"""
+    file_extension = os.path.splitext(file_path)[1].lower()
+    return file_extension if file_extension in EXTRACTORS else None
+
+
+def extract_records_from_file(file_path: str, ocr_inline: bool = True):
+    """Extract the non-empty page, slide or spreadsheet row-group records of a single supported file.
+
+    Returns (records, ocr_pages). PDF pages without a text layer are OCRed here when ocr_inline is
+    set; otherwise their page numbers are returned for the OCR pool.
+    """
+    file_format = get_file_format(file_path)
+    records = []
+    ocr_pages = []
+    for record in EXTRACTORS[file_format](file_path):
+        if record["metadata"].pop("needs_ocr", False):
+            if not ocr_inline:
+                ocr_pages.append(record["metadata"]["page"])
+                continue
+            record["page_content"] = ocr_image(render_pdf_page(file_path, record["metadata"]["page"]))
+            record["metadata"]["ocr"] = True
+        if record["page_content"] and record["page_content"].strip():
+            record["metadata"]["format"] = file_format.lstrip(".")
+            records.append(record)
+    return records, ocr_pages
+
+
+def new_extraction_result(file_path: str) -> dict:
+    return {
+        "path": file_path,
+        "format": get_file_format(file_path),
+        "bytes": os.path.getsize(file_path),
+        "records": [],
+        "error": None,
+        "seconds": 0.0,
+    }
+
+
+def extract_file_worker(task):
+    """Extract one file inside a pool worker, enforcing its timeout with SIGALRM"""
+    file_path, timeout = task
+    result = new_extraction_result(file_path)
+    use_alarm = timeout and hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    start = time.perf_counter()
+    try:
+        result["records"], result["ocr_pages"] = extract_records_from_file(file_path, ocr_inline=False)
+    except ExtractionTimeout:
+        result["error"] = f"timed out after {timeout:.0f}s"
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def get_pool_context():
+    # Forking the agent itself is unsafe (its threads may hold locks); workers fork from a
+    # single-threaded server instead, which imports the agent's __main__ and this module only once
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["__main__", "parse_files"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def iter_extractions(file_paths, workers: int = EXTRACTION_WORKERS, timeout: float = EXTRACTION_TIMEOUT,
+                     ocr_workers: int = OCR_WORKERS):
+    """Start extracting files on process pools, returning an iterator of result dicts in completion order.
+
+    Documents go to the parsing pool. Image files, and PDF pages the parsing pool finds without a
+    text layer, go to a dedicated OCR pool so scans never hold up ordinary documents. The parsing
+    pool starts immediately, so the caller can do other work before consuming results.
+    """
+    if not file_paths:
+        return iter(())
+    results = queue.Queue()
+    image_paths = [file_path for file_path in file_paths if get_file_format(file_path) in OCR_FORMATS]
+    document_paths = [file_path for file_path in file_paths if get_file_format(file_path) not in OCR_FORMATS]
+
+    parse_pool = None
+    if document_paths:
+        parse_pool = get_pool_context().Pool(processes=max(1, min(workers, len(document_paths))))
+        for file_path in document_paths:
+            parse_pool.apply_async(
+                extract_file_worker,
+                ((file_path, timeout),),
+                callback=results.put,
+                error_callback=lambda e, file_path=file_path: results.put(
+                    {**new_extraction_result(file_path), "error": str(e)}
+                ),
+            )
+        parse_pool.close()
+    return collect_extractions(parse_pool, results, len(document_paths), image_paths, timeout, ocr_workers)
+
+
+def collect_extractions(parse_pool, results: queue.Queue, document_count: int, image_paths: list,
+                        timeout: float, ocr_workers: int):
+    ocr_pool = None
+    waiting = {}  # file results still waiting on OCR, keyed by path
+    outstanding = document_count
+
+    def submit_ocr(file_path, page_number):
+        nonlocal ocr_pool, outstanding
+        if ocr_pool is None:
+            ocr_pool = get_pool_context().Pool(processes=ocr_workers)
+        ocr_pool.apply_async(
+            ocr_worker,
+            ((file_path, page_number, timeout),),
+            callback=results.put,
+            error_callback=lambda e: results.put({
+                "kind": "ocr", "path": file_path, "page": page_number, "record": None,
+                "error": str(e), "seconds": 0.0,
+            }),
+        )
+        outstanding += 1
+
+    try:
+        for image_path in image_paths:
+            waiting[image_path] = {**new_extraction_result(image_path), "ocr_pending": 1}
+            submit_ocr(image_path, None)
+
+        while outstanding:
+            try:
+                item = results.get(timeout=timeout + EXTRACTION_GRACE)
+            except queue.Empty:
+                print("⚠️ Extraction workers stopped responding; abandoning the remaining files")
+                return
+            outstanding -= 1
+
+            if item.get("kind") == "ocr":
+                file_result = waiting[item["path"]]
+                file_result["seconds"] += item["seconds"]
+                if item["error"] and item["page"] is None:
+                    file_result["error"] = item["error"]
+                elif item["error"]:
+                    # Keep the rest of the document, but do not cache it without this page
+                    print(f"⚠️ OCR failed on {item['path']} page {item['page']}: {item['error']}")
+                    file_result["partial"] = True
+                elif item["record"]:
+                    item["record"]["metadata"]["format"] = file_result["format"].lstrip(".")
+                    file_result["records"].append(item["record"])
+                file_result["ocr_pending"] -= 1
+                if file_result["ocr_pending"]:
+                    continue
+                item = waiting.pop(item["path"])
+                del item["ocr_pending"]
+                item["records"].sort(key=lambda record: record["metadata"]["page"])
+            else:
+                ocr_pages = item.pop("ocr_pages", None)
+                if ocr_pages and not item["error"]:
+                    item["ocr_pending"] = len(ocr_pages)
+                    waiting[item["path"]] = item
+                    for page_number in ocr_pages:
+                        submit_ocr(item["path"], page_number)
+                    continue
+            yield item
+    finally:
+        # Kills any worker still stuck on a pathological file
+        if parse_pool is not None:
+            parse_pool.terminate()
+        if ocr_pool is not None:
+            ocr_pool.terminate()
+
+
+class ExtractionMetrics:
+    """Per-format throughput of one extraction run"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.formats = {}
+
+    def record(self, result: dict):
+        stats = self.formats.setdefault(result["format"], {
+            "files": 0, "bytes": 0, "seconds": 0.0, "failed": 0, "timeouts": 0,
+        })
+        stats["files"] += 1
+        stats["bytes"] += result["bytes"]
+        stats["seconds"] += result["seconds"]
+        if result["error"]:
+            stats["failed"] += 1
+            if result["error"].startswith("timed out"):
+                stats["timeouts"] += 1
+
+    def report(self) -> str:
+        wall = max(time.perf_counter() - self.started, 1e-9)
+        total_files = sum(stats["files"] for stats in self.formats.values())
+        total_bytes = sum(stats["bytes"] for stats in self.formats.values())
+        lines = [f"📊 Extracted {total_files} files ({total_bytes / 1e6:.1f} MB) in {wall:.2f}s: "
+                 f"{total_files / wall:.1f} files/s, {total_bytes / 1e6 / wall:.2f} MB/s"]
+        for file_format, stats in sorted(self.formats.items()):
+            busy = max(stats["seconds"], 1e-9)
+            lines.append(
+                f"   {file_format}: {stats['files']} files, {stats['bytes'] / 1e6:.1f} MB, "
+                f"{stats['files'] / busy:.1f} files/s, {stats['bytes'] / 1e6 / busy:.2f} MB/s per worker, "
+                f"{stats['failed']} failed ({stats['timeouts']} timed out)"
+            )
+        return "\n".join(lines)
+
+
+def list_course_files(directory) -> dict:
+    """List supported files under directory, once per unique file body.
+
+    Maps the first path found for each body to every path linking it (itself included), so a file
+    attached to several courses is extracted once but still indexed under each course.
+    """
+    file_paths = {}
+    seen = {}
     for root, _, files in os.walk(directory):
         for file in files:
             file_path = os.path.join(root, file)
-            file_extension = os.path.splitext(file)[1].lower()
-            text = ""
+            if not get_file_format(file_path):
+                continue
 
+            # Course files are links into the blob store; parse each unique blob once
             try:
-                if file_extension == ".pdf":
-                    text = extract_text_from_pdf(file_path)
-                elif file_extension == ".docx":
-                    text = extract_text_from_docx(file_path)
-                elif file_extension == ".txt":
-                    text = extract_text_from_txt(file_path)
-                elif file_extension == ".pptx":
-                    text = extract_text_from_pptx(file_path)
-                elif file_extension in [".png", ".jpg", ".jpeg"]:
-                    text = extract_text_from_images(file_path)
-                elif file_extension in [".xlsx", ".xls"]:
-                    text = extract_text_from_excel(file_path)
-
-                if text and text.strip():  # Only add non-empty texts
-                    all_texts.append(text)
-
-            except Exception as e:
-                print(f"Error processing {file}: {str(e)}")
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            key = (stat.st_dev, stat.st_ino)
+            if key in seen:
+                file_paths[seen[key]].append(file_path)
+                continue
+            seen[key] = file_path
+            file_paths[file_path] = [file_path]
+    return file_paths
+
+
+def stamp_records(records: list, file_paths: list, directory: str):
+    """Yield records tagged with the file they came from and its course, once per path linking the file"""
+    for file_path in file_paths:
+        relative_path = os.path.relpath(file_path, directory)
+        course = relative_path.split(os.sep)[0] if os.sep in relative_path else None
+        for record in records:
+            yield {
+                "page_content": record["page_content"],
+                "metadata": {**record["metadata"], "source": file_path, "course": course},
+            }
+
+
+def iter_file_records(directory, workers: int = EXTRACTION_WORKERS, timeout: float = EXTRACTION_TIMEOUT,
+                      cache_path: str = EXTRACTION_CACHE_PATH, failed_sources: set = None):
+    """Yield a record per page, slide or spreadsheet row group of every supported file under directory.
+
+    Records look like {'page_content': text, 'metadata': {'source', 'course', 'format', 'page'}}.
+    Cached files are served while the process pool works through the rest, and results are yielded
+    as they arrive, so only one file's records are held in memory at a time. The sources of files
+    that failed, timed out or were only partly extracted are added to ``failed_sources``.
+    """
+    if failed_sources is None:
+        failed_sources = set()
+    if not os.path.exists(directory):
+        print(f"Warning: Directory {directory} does not exist")
+        return
+
+    cache = ExtractionCache(cache_path)
+    try:
+        cached = []
+        pending = {}
+        linked_paths = list_course_files(directory)
+        for file_path in linked_paths:
+            digest = cache.fingerprint(file_path)
+            if cache.has(digest):
+                cached.append((file_path, digest))
+            else:
+                pending[file_path] = digest
+
+        metrics = ExtractionMetrics()
+        extractions = iter_extractions(list(pending), workers, timeout)
+        for file_path, digest in cached:
+            yield from stamp_records(cache.get(digest), linked_paths[file_path], directory)
+
+        unfinished = set(pending)
+        for result in extractions:
+            metrics.record(result)
+            unfinished.discard(result["path"])
+            if result["error"]:
+                # Failures are not cached so the file is retried next time
+                print(f"Error processing {result['path']}: {result['error']}")
+                failed_sources.update(linked_paths[result["path"]])
                 continue
+            if result.get("partial"):
+                failed_sources.update(linked_paths[result["path"]])
+            else:
+                cache.put(pending[result["path"]], result["format"], result["records"])
+            yield from stamp_records(result["records"], linked_paths[result["path"]], directory)
+        # Left behind when the workers stopped responding
+        for file_path in unfinished:
+            failed_sources.update(linked_paths[file_path])
+
+        print(metrics.report())
+        print(cache.report())
+        cache.prune()
+    finally:
+        cache.close()
+
 
+def extract_text_from_files(directory, workers: int = EXTRACTION_WORKERS, timeout: float = EXTRACTION_TIMEOUT):
+    """Extract text from all supported file types in a directory, one string per page, slide or spreadsheet row group."""
+    all_texts = [record["page_content"] for record in iter_file_records(directory, workers, timeout)]
     if not all_texts:
         print(f"Warning: No text could be extracted from any files in {directory}")
-        
     return all_texts
 
 if __name__ == "__main__":
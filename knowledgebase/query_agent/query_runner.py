@@ -0,0 +1,87 @@
+import os
+import time
+import asyncio
+from contextlib import contextmanager
+
+# Most queries answered at once; further queries wait their turn without blocking the agent
+QUERY_MAX_IN_FLIGHT = int(os.getenv("QUERY_MAX_IN_FLIGHT", "16"))
+
+
+class StageTimer:
+    """Seconds spent in each stage (embed, lexical, dense, generate, ...) of answering one query"""
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self) -> str:
+        return "⏱️ " + ", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in self.seconds.items())
+
+
+class QueryRunner:
+    """Run query jobs as background tasks, at most ``max_in_flight`` at a time.
+
+    Agent handlers are awaited one message at a time, so a handler that waited on the LLM would hold
+    up every other student. Handlers ``submit`` the job instead and return straight away; retrieval
+    and the LLM call are awaited asynchronously (``ainvoke``) inside the job.
+    """
+
+    def __init__(self, max_in_flight: int = QUERY_MAX_IN_FLIGHT):
+        self.max_in_flight = max(1, max_in_flight)
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.tasks = set()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.seconds = 0.0
+        # Total seconds per stage over the queries that recorded a StageTimer
+        self.stage_seconds = {}
+        self.timed = 0
+
+    def submit(self, job) -> asyncio.Task:
+        """Schedule a coroutine to run once a slot is free"""
+        task = asyncio.create_task(self.run(job))
+        # The event loop only keeps weak references to tasks
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def run(self, job):
+        async with self.semaphore:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            start = time.perf_counter()
+            try:
+                result = await job
+                self.completed += 1
+                return result
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Query failed: {e}")
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.in_flight -= 1
+
+    def record(self, timer: StageTimer):
+        self.timed += 1
+        for name, seconds in timer.seconds.items():
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+
+    async def drain(self):
+        """Wait for every submitted query to finish"""
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks))
+
+    def report(self) -> str:
+        average = self.seconds / self.completed if self.completed else 0.0
+        return (f"🧵 Queries: {self.completed} answered, {self.failed} failed, {len(self.tasks)} pending, "
+                f"peak {self.peak_in_flight}/{self.max_in_flight} in flight, {average:.2f}s average"
+                + "".join(f", {name} {seconds / self.timed * 1000:.0f}ms" for name, seconds in self.stage_seconds.items()))
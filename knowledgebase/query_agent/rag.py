@@ -1,6 +1,8 @@
 import os
 import sys
-import faiss
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # Add parent directories to Python path for imports
@@ -22,7 +24,7 @@ from uagents_core.contrib.protocols.chat import (
 
 # Create chat protocol
 def create_text_chat(text: str, end_session: bool = True) -> ChatMessage:
-    content = [TextContent(type="text", text=text)]
+    content = [TextContent(type="text", text=text)] if text else []
     if end_session:
         content.append(EndSessionContent(type="end-session"))
     return ChatMessage(
@@ -32,18 +34,44 @@ def create_text_chat(text: str, end_session: bool = True) -> ChatMessage:
     )
 
 chat_proto = Protocol(spec=chat_protocol_spec)
+from query_protocol import INIT_PROGRESS_PREFIX
+from chat_protocol import chat_stream_sender
+from stream_protocol import STREAM_ANSWERS, AnswerStreamer, StreamedAnswer, chunk_sender, new_stream_id
 # Import LangChain modules
-from langchain.chains.retrieval import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_openai import ChatOpenAI
 
 # Import local modules
-from canvas import get_all_course_materials
-from parse_files import extract_text_from_files
+from canvas import get_user_files_dir, sync_course_materials
+from parse_files import iter_file_records
+from chunking import iter_chunks
+from embedding_cache import CachedEmbeddings
+from embedding_pipeline import (
+    EMBED_BATCH_SIZE,
+    EMBEDDING_DIMENSIONS,
+    EmbeddingPipeline,
+    get_base_embeddings,
+    iter_token_batches,
+)
+from index_store import (
+    IndexUpsert,
+    begin_version,
+    create_vector_store,
+    discard_version,
+    get_current_version,
+    load_vector_store,
+    prune_versions,
+    publish_version,
+    save_vector_store,
+)
+from index_factory import fit_index
+from hybrid_retriever import HybridRetriever
+from shard_manager import Shard, ShardManager, get_shard_path
+from sync_manifest import get_user_key
+from query_runner import QueryRunner, StageTimer
+from answer_cache import AnswerCache
+from context_packer import ContextPacker
 
 
 load_dotenv()
@@ -56,19 +84,34 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is not set")
 
-# Initialize embedding model
-embedding_model = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
+# Initialize embedding model; chunks embedded on a previous ingest are served from the on-disk cache
+embedding_model = CachedEmbeddings(get_base_embeddings(OPENAI_API_KEY))
+
+# Initializations run off the event loop, at most INIT_WORKERS students at a time
+INIT_WORKERS = int(os.getenv("INIT_WORKERS", "2"))
+# Seconds between progress updates sent while an initialization is embedding
+INIT_PROGRESS_INTERVAL = float(os.getenv("INIT_PROGRESS_INTERVAL", "15"))
+init_executor = ThreadPoolExecutor(max_workers=INIT_WORKERS, thread_name_prefix="rag-init")
+# Running initialization tasks by user key
+init_jobs = {}
 
 # Agent addresses
 ANALYZER_AGENT = "agent1qfpkhksvee55f2seqvejtsrr6wr9s4gcfz8as53htmqyr6uuvhewjxnvu07"
 CANVAS_AGENT = "agent1q053mc5vkw5pxx0xhx54v4y2l34chwyn4jsw9eahvlrfrt8pfc73c6arh6y"
+PROBLEM_SOLVER_AGENT = "agent1qfxhmvjjwah4jqzh9vhjda3aa6y33nz2knw8xuesa0d6m0j7kg4mguhax0n"
+# Agents relaying many students' messages: their own address never identifies a student
+RELAY_AGENTS = {CANVAS_AGENT, PROBLEM_SOLVER_AGENT}
 
 class QueryRequest(Model):
     query: str
+    # Address the student's query originally came from, when an agent relays it; their shard is routed by it
+    user: str = ""
 
 class RequestResponse(Model):
     request: str
     response: str
+    # Address of the student a relayed request or query is for; their shard is routed by it
+    user: str = ""
 
 query_agent = Agent(
     name="query_agent",
@@ -82,112 +125,143 @@ QUERY_AGENT_ADDRESS = query_agent.address
 problem_protocol = Protocol("Problem Solving")
 # query_protocol = Protocol("Query Handling")
 
-faiss_path = "faiss_db"
-index_file = os.path.join(faiss_path, "index.faiss")
-
 
-def chunk_and_embed_canvas_data(canvas_token: str, school_domain: str):
-    """Initialize and update the vector store with Canvas course materials"""
+def iter_canvas_documents(all_materials: dict, files_dir: str, failed_sources: set = None):
+    """Yield the course list, assignments and course file pages to index, each with its metadata.
+
+    Files that could not be extracted are added to ``failed_sources`` instead.
+    """
+    # First, the list of courses
+    course_list = "Currently enrolled courses:\n"
+    for course_name in all_materials:
+        course_list += f"- {course_name}\n"
+    yield {'page_content': course_list, 'metadata': {'type': 'course_list', 'source': 'canvas:course_list'}}
+
+    # Then assignment details
+    for course_name, data in all_materials.items():
+        assignments = data.get("assignments", [])
+        if isinstance(assignments, list):
+            for assignment in assignments:
+                if isinstance(assignment, dict):
+                    yield {
+                        'page_content': f"Course: {course_name}, Assignment: {assignment.get('name', 'Unnamed Assignment')}, "
+                                        f"Due: {assignment.get('due_at') or 'No due date'}, "
+                                        f"Description: {assignment.get('description', 'No Description')}",
+                        'metadata': {
+                            'type': 'assignment',
+                            'source': f"canvas:assignment:{assignment.get('id')}",
+                            'course': course_name,
+                            'assignment': assignment.get('name', 'Unnamed Assignment'),
+                            'due_at': assignment.get('due_at'),
+                        },
+                    }
+
+    # Then every page, slide and sheet of the course files, streamed from the extraction pool
+    for record in iter_file_records(files_dir, failed_sources=failed_sources):
+        record['metadata']['type'] = 'document'
+        yield record
+
+
+def iter_batches(items, batch_size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def chunk_and_embed_canvas_data(canvas_token: str, school_domain: str, progress=print):
+    """Build a new version of a student's vector store shard from their Canvas course materials.
+
+    The version being served is never modified: the update happens on a copy that is swapped in
+    atomically once saved. ``progress`` is called with status messages along the way.
+    """
+    version_path = None
     try:
+        shard_path = get_shard_path(get_user_key(canvas_token, school_domain))
+        current_path = get_current_version(shard_path)
         # Get course materials using provided credentials
-        all_materials = get_all_course_materials(canvas_token, school_domain)
+        progress("Syncing course materials from Canvas...")
+        all_materials, delta = sync_course_materials(canvas_token, school_domain)
         if not all_materials:
             print("No course materials found")
             return None
-
-        docs = []
-        # First, store the list of courses
-        course_list = "Currently enrolled courses:\n"
-        for course_name, data in all_materials.items():
-            course_list += f"- {course_name}\n"
-        docs.append(course_list)
-
-        # Then store assignment details
-        for course_name, data in all_materials.items():
-            assignments = data.get("assignments", [])
-            if isinstance(assignments, list):
-                for assignment in assignments:
-                    if isinstance(assignment, dict):
-                        docs.append(f"Course: {course_name}, Assignment: {assignment.get('name', 'Unnamed Assignment')}, "
-                                f"Description: {assignment.get('description', 'No Description')}")
-
-        # Add course files
-        course_files_text = extract_text_from_files("course_files")
-        docs.extend(course_files_text)
-
-        if not docs:
+        progress(f"Synced {len(all_materials)} courses ({delta.summary()})")
+
+        # Nothing changed on Canvas since the last sync: the saved index is already current
+        if not delta and current_path:
+            vector_store = load_vector_store(current_path, embedding_model)
+            if vector_store is not None:
+                print("Canvas unchanged since last sync, reusing existing index")
+                return vector_store
+
+        # Update a copy of the current version fully in memory, or start a new store
+        version_path = begin_version(shard_path)
+        vector_store = load_vector_store(version_path, embedding_model, mmap=False) \
+            or create_vector_store(version_path, embedding_model, EMBEDDING_DIMENSIONS)
+
+        # Extraction, chunking and embedding are chained lazily, so only one batch is in memory at a time
+        failed_sources = set()
+        documents = iter_canvas_documents(all_materials, get_user_files_dir(canvas_token, school_domain), failed_sources)
+        # Chunks follow page, slide, heading and assignment boundaries and are sized in model tokens
+        chunks = iter_chunks(documents)
+        # Chunks are upserted by id, so re-ingesting replaces changed chunks instead of duplicating them
+        upsert = IndexUpsert(vector_store)
+        to_embed = (chunk for batch in iter_batches(chunks, EMBED_BATCH_SIZE) for chunk in upsert.plan(batch))
+        # Token-budgeted batches are embedded concurrently and land in the index as they finish
+        pipeline = EmbeddingPipeline(embedding_model)
+        last_report = time.monotonic()
+        for batch, vectors in pipeline.run(iter_token_batches(to_embed)):
+            upsert.add(batch, vectors)
+            if time.monotonic() - last_report >= INIT_PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                progress(f"Indexed {len(upsert.seen)} chunks so far ({pipeline.texts} embedded)")
+        # A file that failed to extract this time (OCR error, timeout) keeps its chunks from the last ingest
+        upsert.finish(failed_sources)
+        # Switch index family (Flat / HNSW / IVF, or a pinned IVF-PQ) if the corpus has outgrown the current one
+        index = fit_index(vector_store.index)
+        refitted = index is not vector_store.index
+        vector_store.index = index
+        print(upsert.summary())
+        print(pipeline.report())
+        print(pipeline.cache_stats.report())
+
+        if not upsert.seen:
             print("No documents to embed")
+            vector_store.docstore.close()
+            discard_version(version_path)
             return None
 
-        # Process and chunk documents
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-        processed_docs = []
-        
-        for doc in docs:
-            if isinstance(doc, dict):
-                # Document with metadata
-                chunks = text_splitter.split_text(doc['page_content'])
-                for chunk in chunks:
-                    processed_docs.append({
-                        'page_content': chunk,
-                        'metadata': doc.get('metadata', {})
-                    })
-            else:
-                # Plain text document
-                chunks = text_splitter.split_text(doc)
-                for chunk in chunks:
-                    processed_docs.append({
-                        'page_content': chunk,
-                        'metadata': {'type': 'general'}
-                    })
-
-        # Create or load vector store
-        if os.path.exists(faiss_path) and os.path.exists(index_file):
-            vector_store = FAISS.load_local(faiss_path, embedding_model, allow_dangerous_deserialization=True)
-        else:
-            if not os.path.exists(faiss_path):
-                os.makedirs(faiss_path)
-            
-            index = faiss.IndexFlatL2(1536)
-            vector_store = FAISS(
-                index=index,
-                embedding_function=embedding_model,
-                docstore=InMemoryDocstore({}),
-                index_to_docstore_id={},
-            )
-
-        # Batch add all documents with their metadata
-        texts = [doc['page_content'] for doc in processed_docs]
-        metadatas = [doc['metadata'] for doc in processed_docs]
-        vector_store.add_texts(texts, metadatas=metadatas, embedding=embedding_model.embed_documents)
-        vector_store.save_local(faiss_path)
-        return vector_store
+        if not (upsert.changed or refitted) and current_path:
+            # Nothing to publish: keep serving the current version
+            vector_store.docstore.close()
+            discard_version(version_path)
+            return load_vector_store(current_path, embedding_model)
+
+        progress(f"Saving index of {index.ntotal} chunks...")
+        save_vector_store(vector_store, version_path)
+        vector_store.docstore.close()
+        publish_version(shard_path, version_path)
+        # Serve from the memory-mapped copy so only the pages queries touch stay resident
+        return load_vector_store(version_path, embedding_model)
 
     except Exception as e:
         print(f"Error in chunk_and_embed_canvas_data: {str(e)}")
+        if version_path and get_current_version(os.path.dirname(version_path)) != version_path:
+            discard_version(version_path)
         return None
 
-# Initialize these as None - they'll be set up when we get credentials
-vector_store = None
-retriever = None
+# The LLM and answer chain are shared; each student's shard gets its own retriever on top of them
 llm = None
-retrieval_chain = None
+combine_docs_chain = None
 
-def initialize_rag_system(canvas_token: str, school_domain: str) -> bool:
-    global vector_store, retriever, retrieval_chain, llm
-    """Initialize the RAG system with Canvas credentials"""
-    print(f"I am in here {canvas_token}, {school_domain}")
-    
-    try:
-        # Initialize vector store with Canvas data
-        vector_store = chunk_and_embed_canvas_data(canvas_token, school_domain)
-        if not vector_store:
-            raise ValueError("Failed to initialize vector store")
-
-        # Create retriever
-        retriever = vector_store.as_retriever()
-
-        # Initialize LLM
+def get_combine_docs_chain():
+    """Build the LLM answer chain on first use"""
+    global llm, combine_docs_chain
+    if combine_docs_chain is None:
         if not OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY environment variable is not set")
         llm = ChatOpenAI(model_name="gpt-4", api_key=OPENAI_API_KEY)
@@ -211,23 +285,168 @@ def initialize_rag_system(canvas_token: str, school_domain: str) -> bool:
             Your Answer (as a helpful tutor):"""
         )
 
-        # Create chain
         combine_docs_chain = create_stuff_documents_chain(
             llm=llm,
             prompt=prompt_template
         )
+    return combine_docs_chain
+
+def build_shard(user_key: str, vector_store) -> Shard:
+    """Wrap a student's vector store with its retriever and the shared answer chain"""
+    # BM25 over the same chunks is fused with vector search, so exact tokens like "HW3" are found too
+    retriever = HybridRetriever(vector_store=vector_store)
+    version = os.path.basename(os.path.dirname(vector_store.docstore.path))
+    return Shard(user_key, vector_store, retriever, get_combine_docs_chain(), version)
+
+def load_shard(user_key: str):
+    """Open the current version of a student's shard from disk, or None if they have not been initialized"""
+    current_path = get_current_version(get_shard_path(user_key))
+    vector_store = load_vector_store(current_path, embedding_model) if current_path else None
+    return build_shard(user_key, vector_store) if vector_store is not None else None
+
+# Loaded shards are kept in a bounded LRU; evicted ones are reopened from disk on their next query
+shard_manager = ShardManager(load_shard)
+# Answers to questions already asked of the same index version, matched by question embedding
+answer_cache = AnswerCache()
+# Retrieved chunks are deduplicated and diversified into a token-bounded prompt context
+context_packer = ContextPacker()
+
+async def get_cached_answer(shard: Shard, kind: str, question: str, compute, timer: StageTimer):
+    """Get the cached answer of this kind to a question (or one close enough), else compute and cache it"""
+    def embed_query(text: str) -> list:
+        with timer.stage("embed"):
+            return shard.vector_store.embeddings.embed_query(text)
+
+    scope = (shard.user_key, shard.version, kind)
+    return await answer_cache.get_or_compute(scope, question, embed_query, compute)
+
+async def retrieve_and_answer(shard: Shard, question: str, timer: StageTimer, filter: dict = None,
+                              streamer: AnswerStreamer = None):
+    """Retrieve a question's chunks once and answer from exactly those, returning (answer, documents).
+
+    With a streamer, the answer's tokens are forwarded as the LLM generates them.
+    """
+    docs = await shard.retriever.ainvoke(question, filter=filter, timings=timer)
+    with timer.stage("pack"):
+        docs = await asyncio.to_thread(context_packer.pack, shard.vector_store, docs)
+    inputs = {"input": question, "context": docs}
+    with timer.stage("generate"):
+        if streamer is None:
+            return await shard.answer_chain.ainvoke(inputs), docs
+        start = time.perf_counter()
+        async for token in shard.answer_chain.astream(inputs):
+            if not streamer.parts:
+                timer.seconds["first_token"] = time.perf_counter() - start
+            await streamer.add(token)
+    return streamer.text, docs
+
+async def stream_answer(streamer: AnswerStreamer, answer: str, tail: str = "") -> str:
+    """Finish a stream, first sending the whole answer if it came from the cache and nothing was streamed"""
+    if not streamer.parts:
+        await streamer.add(answer)
+    if tail:
+        await streamer.add(tail)
+    return await streamer.close()
+
+def log_timings(ctx: Context, timer: StageTimer):
+    query_runner.record(timer)
+    ctx.logger.info(timer.report())
+
+def initialize_rag_system(canvas_token: str, school_domain: str, progress=print) -> str:
+    """Initialize a student's RAG shard with their Canvas credentials, returning their user key.
+
+    Blocking; runs on the init executor. Queries keep using the previous version until the new
+    one replaces it in the shard manager.
+    """
+    user_key = get_user_key(canvas_token, school_domain)
+    print(f"Initializing RAG shard {user_key} for {school_domain}")
 
-        # Create retrieval chain
-        retrieval_chain = create_retrieval_chain(
-            retriever=retriever,
-            combine_docs_chain=combine_docs_chain
-        )
+    try:
+        # Initialize vector store with Canvas data
+        vector_store = chunk_and_embed_canvas_data(canvas_token, school_domain, progress)
+        if not vector_store:
+            raise ValueError("Failed to initialize vector store")
 
-        return True
+        # Swap the new version in; the shard it replaces is closed and its files deleted
+        shard = shard_manager.put(build_shard(user_key, vector_store))
+        prune_versions(get_shard_path(user_key))
+        # Answers generated from the previous version may be out of date
+        answer_cache.invalidate(user_key, shard.version)
+        print(shard_manager.report())
+        return user_key
     except Exception as e:
         print(f"Error initializing RAG system: {str(e)}")
         raise
 
+async def start_rag_initialization(ctx: Context, origin: str, canvas_token: str, school_domain: str, reply,
+                                   ready_text: str = "RAG system initialized successfully") -> bool:
+    """Start initializing a student's shard in the background, returning False if one is already running.
+
+    ``origin`` (see get_origin) is routed to the shard. ``reply(text, done)`` sends a message back
+    to whoever asked: progress updates (prefixed with INIT_PROGRESS_PREFIX) while the job runs,
+    then the final result with done=True.
+    """
+    if not origin:
+        raise ValueError("the request does not say which student it is for")
+    user_key = get_user_key(canvas_token, school_domain)
+    set_shard_route(ctx, origin, user_key)
+    if user_key in init_jobs:
+        return False
+
+    loop = asyncio.get_running_loop()
+
+    def progress(message: str):
+        print(message)
+        asyncio.run_coroutine_threadsafe(reply(f"{INIT_PROGRESS_PREFIX} {message}", False), loop)
+
+    async def run():
+        try:
+            await loop.run_in_executor(init_executor, initialize_rag_system, canvas_token, school_domain, progress)
+            await reply(ready_text, True)
+        except Exception as e:
+            ctx.logger.error(f"Error initializing RAG system: {str(e)}")
+            await reply(f"Error initializing RAG system: {str(e)}", True)
+        finally:
+            init_jobs.pop(user_key, None)
+
+    init_jobs[user_key] = asyncio.create_task(run())
+    return True
+
+def get_origin(sender: str, user: str = ""):
+    """Get the address of the student a message is for, or None if a relay did not say.
+
+    Students are routed by their own address. Relay agents (canvas agent, problem solver) carry it
+    in the message's ``user`` field; only they are trusted to set it, and their own address is
+    never routed, since all the students they relay for share it.
+    """
+    if sender not in RELAY_AGENTS:
+        return sender
+    return user if user and user not in RELAY_AGENTS else None
+
+def is_initializing(ctx: Context, origin: str) -> bool:
+    routes = ctx.storage.get("shard_routes") or {}
+    return bool(origin) and routes.get(origin) in init_jobs
+
+def set_shard_route(ctx: Context, origin: str, user_key: str):
+    """Route a student's future queries to their shard"""
+    routes = ctx.storage.get("shard_routes") or {}
+    routes[origin] = user_key
+    ctx.storage.set("shard_routes", routes)
+
+def get_shard_key(ctx: Context, origin: str):
+    """Get the user key of the shard a student's queries go to, or None if they were not initialized.
+
+    There is no fallback: a student without a route (or a relayed message that does not name one)
+    is told to initialize, never given another student's shard.
+    """
+    if not origin:
+        return None
+    routes = ctx.storage.get("shard_routes") or {}
+    return routes.get(origin)
+
+# Queries run as background tasks so one slow LLM call never holds up other students
+query_runner = QueryRunner()
+
 @chat_proto.on_message(ChatMessage)
 async def handle_message(ctx: Context, sender: str, msg: ChatMessage):
     try:
@@ -271,26 +490,55 @@ async def process_chat_message(ctx: Context, sender: str, text_content: str):
         if ',' in text_content:
             try:
                 canvas_token, school_domain = map(str.strip, text_content.split(','))
-                success = initialize_rag_system(canvas_token, school_domain)
-                if success:
-                    await ctx.send(sender, create_text_chat("RAG system initialized successfully. You can now query the knowledge base."))
+
+                async def reply(text: str, done: bool):
+                    await ctx.send(sender, create_text_chat(text, end_session=done))
+
+                started = await start_rag_initialization(
+                    ctx, get_origin(sender), canvas_token, school_domain, reply,
+                    ready_text="RAG system initialized successfully. You can now query the knowledge base.",
+                )
+                if started:
+                    await reply(f"{INIT_PROGRESS_PREFIX} Initialization started; I'll report progress here.", False)
                 else:
-                    await ctx.send(sender, create_text_chat("Failed to initialize RAG system. Please check your credentials."))
+                    await reply(f"{INIT_PROGRESS_PREFIX} Initialization is already in progress.", False)
             except ValueError:
                 await ctx.send(sender, create_text_chat("Invalid format. Please provide credentials in the format: <canvas_token>, <school_domain>"))
             return
 
-        # If not initialization, check if system is ready
-        if vector_store is None or retrieval_chain is None:
-            await ctx.send(sender, create_text_chat("RAG system not initialized. Please provide credentials in the format: <canvas_token>, <school_domain>"))
-            return
+        # Not an initialization: answer in the background
+        query_runner.submit(answer_chat_message(ctx, sender, text_content, get_shard_key(ctx, get_origin(sender))))
+    except Exception as e:
+        error_msg = f"Error querying knowledge base: {str(e)}"
+        ctx.logger.error(error_msg)
+        await ctx.send(sender, create_text_chat(error_msg))
+
+async def answer_chat_message(ctx: Context, sender: str, text_content: str, user_key: str):
+    """Answer a chat query from the sender's shard"""
+    try:
+        async with shard_manager.lease(user_key) as shard:
+            if shard is None and is_initializing(ctx, get_origin(sender)):
+                await ctx.send(sender, create_text_chat("Your course materials are still being indexed. Please try again shortly."))
+                return
+            if shard is None:
+                await ctx.send(sender, create_text_chat("RAG system not initialized. Please provide credentials in the format: <canvas_token>, <school_domain>"))
+                return
+
+            async def compute():
+                answer, _ = await retrieve_and_answer(shard, text_content, timer, streamer=streamer)
+                return answer or "Sorry, I couldn't find relevant information in the knowledge base."
+
+            timer = StageTimer()
+            # The answer goes straight to the student as it is generated, the last message ending the session
+            streamer = AnswerStreamer(chat_stream_sender(ctx, sender)) if STREAM_ANSWERS else None
+            response_text = await get_cached_answer(shard, "chat", text_content, compute, timer)
+            log_timings(ctx, timer)
 
-        # Process the query using sync invoke since we're in an async context
-        response = retrieval_chain.invoke({"input": text_content})
-        response_text = response.get("answer", "Sorry, I couldn't find relevant information in the knowledge base.")
-        
         # Send the response back
-        await ctx.send(sender, create_text_chat(response_text))
+        if streamer is not None:
+            await stream_answer(streamer, response_text)
+        else:
+            await ctx.send(sender, create_text_chat(response_text))
     except Exception as e:
         error_msg = f"Error querying knowledge base: {str(e)}"
         ctx.logger.error(error_msg)
@@ -302,87 +550,126 @@ query_agent.include(chat_proto)
 
 @query_agent.on_message(model=RequestResponse)
 async def handle_request(ctx: Context, sender: str, query: RequestResponse):
-    global vector_store, retriever, retrieval_chain
     try:
         if query.request.startswith("init_rag,"):
             # Initialize RAG system with the provided token
             ctx.logger.info("Initializing RAG system with Canvas token")
             _, canvas_token, school_domain = query.request.split(",")
+
+            async def reply(text: str, done: bool):
+                await ctx.send(sender, RequestResponse(request=query.request, response=text))
+
             try:
-                success = initialize_rag_system(canvas_token, school_domain)
-                if success:
-                    await ctx.send(sender, RequestResponse(request=query.request, response="RAG system initialized successfully"))
+                # Crawl, extraction and embedding run in the background; progress and the result follow
+                if await start_rag_initialization(ctx, get_origin(sender, query.user), canvas_token, school_domain, reply):
+                    await reply(f"{INIT_PROGRESS_PREFIX} Initialization started", False)
                 else:
-                    await ctx.send(sender, RequestResponse(request=query.request, response="Failed to initialize RAG system"))
+                    await reply(f"{INIT_PROGRESS_PREFIX} Initialization already in progress", False)
             except Exception as e:
                 ctx.logger.error(f"Error initializing RAG system: {str(e)}")
                 await ctx.send(sender, RequestResponse(request=query.request, response=f"Error initializing RAG system: {str(e)}"))
             return
 
-        if not vector_store or not retriever or not retrieval_chain:
-            ctx.logger.error("RAG system not initialized")
-            await ctx.send(sender, RequestResponse(request=query.request, response="Please provide your Canvas token first"))
-            return
-
         ctx.logger.info(f"Query Agent received query: {query.request}")
-
-        try:
-            # Use the retrieval chain directly instead of manual document handling
-            ctx.logger.info("Using retrieval chain to generate response")
-            
-            # For course enrollment queries, prioritize course list documents
-            if any(word in query.request.lower() for word in ['enrolled', 'courses', 'taking']):
-                search_kwargs = {"filter": {"type": "course_list"}}
-                retrieved_docs = retriever.invoke(query.request, search_kwargs=search_kwargs)
-            else:
-                retrieved_docs = retriever.invoke(query.request)
-                
-            context = "\n".join([doc.page_content for doc in retrieved_docs])
-            response = retrieval_chain.invoke({"input": query.request, "context": context})
-            answer = response['answer'] if isinstance(response, dict) else str(response)
-            
-            ctx.logger.info(f"Generated response: {answer}")
-            ctx.logger.info(f"Sender: {sender}")
-            ctx.logger.info(f"CANVAS_AGENT: {CANVAS_AGENT}")
-            ctx.logger.info(f"xau trai: {context}")
-
-
-            if sender == CANVAS_AGENT:
-                await ctx.send(ANALYZER_AGENT, RequestResponse(request=query.request, response=f"{answer}\n\nContext: {context}"))
-            else:
-                await ctx.send(sender, RequestResponse(request=query.request, response=f"{answer}\n\nContext: {context}"))
-        except Exception as e:
-            ctx.logger.error(f"Error processing query: {str(e)}")
-            await ctx.send(sender, RequestResponse(request=query.request, response="Sorry, I encountered an error processing your query. Please try again."))
+        query_runner.submit(answer_request(ctx, sender, query, get_shard_key(ctx, get_origin(sender, query.user))))
     except Exception as e:
         ctx.logger.error(f"Error in handle_request: {str(e)}")
         await ctx.send(sender, RequestResponse(request=query.request, response=f"Error: {str(e)}"))
 
+async def answer_request(ctx: Context, sender: str, query: RequestResponse, user_key: str):
+    """Answer a query relayed by another agent from the student's shard"""
+    try:
+        async with shard_manager.lease(user_key) as shard:
+            if shard is None and is_initializing(ctx, get_origin(sender, query.user)):
+                await ctx.send(sender, RequestResponse(request=query.request, response="Your course materials are still being indexed. Please try again shortly."))
+                return
+            if shard is None:
+                ctx.logger.error("RAG system not initialized")
+                await ctx.send(sender, RequestResponse(request=query.request, response="Please provide your Canvas token first"))
+                return
+
+            async def compute():
+                ctx.logger.info("Using retrieval chain to generate response")
+
+                # For course enrollment queries, prioritize course list documents
+                filter = None
+                if any(word in query.request.lower() for word in ['enrolled', 'courses', 'taking']):
+                    filter = {"type": "course_list"}
+
+                # The documents the answer was generated from are the ones sent on as context
+                answer, retrieved_docs = await retrieve_and_answer(shard, query.request, timer, filter, streamer)
+                context = "\n".join([doc.page_content for doc in retrieved_docs])
+                return answer, context
+
+            timer = StageTimer()
+            # Questions relayed from the canvas agent are streamed back to it while being generated;
+            # the analyzer still verifies the full answer and can annotate or retract it afterwards
+            streamer = None
+            if STREAM_ANSWERS and sender == CANVAS_AGENT:
+                stream_id = new_stream_id()
+                streamer = AnswerStreamer(chunk_sender(ctx, CANVAS_AGENT, query.request, stream_id))
+            answer, context = await get_cached_answer(shard, "request", query.request, compute, timer)
+            log_timings(ctx, timer)
+
+        ctx.logger.info(f"Generated response: {answer}")
+        ctx.logger.info(f"Sender: {sender}")
+        ctx.logger.info(f"CANVAS_AGENT: {CANVAS_AGENT}")
+        ctx.logger.info(f"xau trai: {context}")
+
+        if streamer is not None:
+            response = await stream_answer(streamer, answer, f"\n\nContext: {context}")
+            await ctx.send(ANALYZER_AGENT, StreamedAnswer(request=query.request, response=response, stream_id=stream_id))
+        elif sender == CANVAS_AGENT:
+            await ctx.send(ANALYZER_AGENT, RequestResponse(request=query.request, response=f"{answer}\n\nContext: {context}"))
+        else:
+            await ctx.send(sender, RequestResponse(request=query.request, response=f"{answer}\n\nContext: {context}"))
+    except Exception as e:
+        ctx.logger.error(f"Error processing query: {str(e)}")
+        await ctx.send(sender, RequestResponse(request=query.request, response="Sorry, I encountered an error processing your query. Please try again."))
+
 @query_agent.on_message(model=QueryRequest)
 async def handle_problem_solving(ctx: Context, sender: str, query: QueryRequest):  
-    global vector_store, retriever, retrieval_chain
     try:
         ctx.logger.info(f"Query Agent received problem-solving request: {query.query}")
-        
-        if not vector_store or not retriever or not retrieval_chain:
-            ctx.logger.error("RAG system not initialized")
-            await ctx.send(sender, RequestResponse(request=query.query, response="Please provide your Canvas token first"))
-            return
-
-        try:
-            # Use the retrieval chain directly instead of manual document handling
-            response = retrieval_chain.invoke({"input": query.query})
-            answer = response['answer'] if isinstance(response, dict) else str(response)
-            
-            ctx.logger.info(f"Generated response: {answer}")
-
-            await ctx.send(sender, RequestResponse(request=query.query, response=answer))
-        except Exception as e:
-            ctx.logger.error(f"Error processing query: {str(e)}")
-            await ctx.send(sender, RequestResponse(request=query.query, response="Sorry, I encountered an error processing your query. Please try again."))
+        query_runner.submit(answer_problem(ctx, sender, query, get_shard_key(ctx, get_origin(sender, query.user))))
     except Exception as e:
         ctx.logger.error(f"Error in handle_problem_solving: {str(e)}")
         await ctx.send(sender, RequestResponse(request=query.query, response=f"Error: {str(e)}"))
 
+async def answer_problem(ctx: Context, sender: str, query: QueryRequest, user_key: str):
+    """Get course context for the problem solver from the student's shard"""
+    try:
+        async with shard_manager.lease(user_key) as shard:
+            if shard is None:
+                ctx.logger.error("RAG system not initialized")
+                await ctx.send(sender, RequestResponse(request=query.query, response="Please provide your Canvas token first"))
+                return
+
+            async def compute():
+                answer, _ = await retrieve_and_answer(shard, query.query, timer)
+                return answer
+
+            timer = StageTimer()
+            answer = await get_cached_answer(shard, "problem", query.query, compute, timer)
+            log_timings(ctx, timer)
+
+        ctx.logger.info(f"Generated response: {answer}")
+
+        await ctx.send(sender, RequestResponse(request=query.query, response=answer))
+    except Exception as e:
+        ctx.logger.error(f"Error processing query: {str(e)}")
+        await ctx.send(sender, RequestResponse(request=query.query, response="Sorry, I encountered an error processing your query. Please try again."))
+
+@query_agent.on_interval(period=60.0)
+async def evict_idle_shards(ctx: Context):
+    """Close index shards no student has queried for a while"""
+    if shard_manager.evict_idle():
+        ctx.logger.info(shard_manager.report())
+    if query_runner.completed or query_runner.tasks:
+        ctx.logger.info(query_runner.report())
+        ctx.logger.info(answer_cache.report())
+        ctx.logger.info(context_packer.report())
+        ctx.logger.info(embedding_model.query_report())
+
 if __name__ == "__main__":
     query_agent.run()
\ No newline at end of file
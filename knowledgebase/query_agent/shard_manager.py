@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+# Each student's index lives in its own directory under INDEX_ROOT, named by their user key
+INDEX_ROOT = os.getenv("INDEX_ROOT", "faiss_db")
+# Most shards kept open at once; the least recently used one is closed to make room
+MAX_LOADED_SHARDS = int(os.getenv("MAX_LOADED_SHARDS", "8"))
+# Shards nobody has queried for this long are closed by the background sweep
+SHARD_IDLE_SECONDS = float(os.getenv("SHARD_IDLE_SECONDS", "1800"))
+
+
+def get_shard_path(user_key: str, index_root: str = INDEX_ROOT) -> str:
+    return os.path.join(index_root, user_key)
+
+
+class Shard:
+    """One student's loaded vector store together with its retriever and the chain answering from it"""
+
+    def __init__(self, user_key: str, vector_store, retriever, answer_chain, version: str = None):
+        self.user_key = user_key
+        # Name of the index version being served; answers cached for other versions are stale
+        self.version = version
+        self.vector_store = vector_store
+        self.retriever = retriever
+        self.answer_chain = answer_chain
+        self.last_used = time.monotonic()
+        # Queries currently using the shard; a retired shard is closed when the last one finishes
+        self.leases = 0
+        self.retired = False
+
+    def close(self):
+        self.vector_store.docstore.close()
+
+
+class ShardManager:
+    """Bounded LRU of loaded per-user shards.
+
+    ``get`` returns a loaded shard or opens it from disk through ``loader(user_key)`` (which returns
+    a Shard, or None if the user has no saved index). At most ``max_loaded`` shards stay open and
+    ``evict_idle`` closes the ones unused for ``idle_seconds``, so memory stays bounded however
+    many students the agent serves. Queries hold a ``lease`` on their shard, so a shard evicted or
+    replaced mid-query is only closed once the queries using it finish. Leases load shards off the
+    event loop, so opening one student's index never stalls other students' queries.
+    """
+
+    def __init__(self, loader, max_loaded: int = MAX_LOADED_SHARDS, idle_seconds: float = SHARD_IDLE_SECONDS):
+        self.loader = loader
+        self.max_loaded = max(1, max_loaded)
+        self.idle_seconds = idle_seconds
+        self.shards = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get_loaded(self, user_key: str):
+        """Get a user's shard if it is open, without touching the disk"""
+        with self.lock:
+            shard = self.shards.get(user_key)
+            if shard is not None:
+                self.shards.move_to_end(user_key)
+                shard.last_used = time.monotonic()
+                self.hits += 1
+            return shard
+
+    def get(self, user_key: str):
+        """Get a user's shard, loading it from disk if it is not open (blocking)"""
+        shard = self.get_loaded(user_key)
+        if shard is not None:
+            return shard
+
+        shard = self.loader(user_key)
+        if shard is None:
+            return None
+        self.loads += 1
+        return self.put(shard)
+
+    async def aget(self, user_key: str):
+        """Get a user's shard, loading it on a worker thread if it is not open"""
+        return self.get_loaded(user_key) or await asyncio.to_thread(self.get, user_key)
+
+    @asynccontextmanager
+    async def lease(self, user_key: str):
+        """Use a user's shard (None if they have no index) for the duration of a query"""
+        while True:
+            shard = await self.aget(user_key) if user_key else None
+            if shard is None:
+                yield None
+                return
+            with self.lock:
+                if not shard.retired:
+                    shard.leases += 1
+                    break
+            # Replaced or evicted between loading and leasing: fetch the current one
+
+        try:
+            yield shard
+        finally:
+            with self.lock:
+                shard.leases -= 1
+                close = shard.retired and shard.leases == 0
+            if close:
+                shard.close()
+
+    def put(self, shard: Shard) -> Shard:
+        """Make a shard current for its user, closing the one it replaces and any overflow"""
+        with self.lock:
+            previous = self.shards.pop(shard.user_key, None)
+            self.shards[shard.user_key] = shard
+            evicted = []
+            while len(self.shards) > self.max_loaded:
+                evicted.append(self.shards.popitem(last=False)[1])
+        if previous is not None and previous is not shard:
+            self.retire(previous)
+        self.close_evicted(evicted)
+        return shard
+
+    def evict_idle(self) -> int:
+        """Close every shard unused for idle_seconds, returning how many were closed"""
+        cutoff = time.monotonic() - self.idle_seconds
+        with self.lock:
+            evicted = [shard for shard in self.shards.values() if shard.last_used < cutoff and not shard.leases]
+            for shard in evicted:
+                del self.shards[shard.user_key]
+        self.close_evicted(evicted)
+        return len(evicted)
+
+    def retire(self, shard: Shard):
+        """Close a shard that left the LRU now, or when its last query finishes"""
+        with self.lock:
+            shard.retired = True
+            close = shard.leases == 0
+        if close:
+            shard.close()
+
+    def close_evicted(self, shards: list):
+        for shard in shards:
+            self.retire(shard)
+            self.evictions += 1
+            print(f"💤 Closed index shard {shard.user_key}")
+
+    def report(self) -> str:
+        return (f"🗂️ Index shards: {len(self.shards)}/{self.max_loaded} loaded, "
+                f"{self.hits} hits, {self.loads} loads, {self.evictions} evictions")
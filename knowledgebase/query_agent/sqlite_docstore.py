@@ -0,0 +1,171 @@
+import json
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+from lexical_index import LEXICAL_VERSION, LexicalIndex
+from metadata_index import METADATA_INDEX_VERSION, MetadataIndex
+
+
+class SQLiteIdMap(MutableMapping):
+    """The FAISS position -> docstore id mapping, kept in SQLite and read one position at a time.
+
+    Stands in for the dict LangChain's FAISS wrapper expects; only positions a search returns are
+    ever loaded.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock, on_change=None):
+        self.conn = conn
+        self.lock = lock
+        # Called after every write, so caches of position lookups can be dropped
+        self.on_change = on_change or (lambda: None)
+        with self.lock:
+            self.length = self.conn.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+    def __getitem__(self, position):
+        with self.lock:
+            row = self.conn.execute("SELECT id FROM positions WHERE position = ?", (int(position),)).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __setitem__(self, position, doc_id):
+        self.update({position: doc_id})
+
+    def __delitem__(self, position):
+        with self.lock:
+            deleted = self.conn.execute("DELETE FROM positions WHERE position = ?", (int(position),)).rowcount
+        if not deleted:
+            raise KeyError(position)
+        self.length -= 1
+        self.on_change()
+
+    def __iter__(self):
+        return (position for position, _ in self.items())
+
+    def __len__(self):
+        return self.length
+
+    def update(self, other=(), **kwargs):
+        rows = [(int(position), doc_id) for position, doc_id in (other.items() if hasattr(other, "items") else other)]
+        with self.lock:
+            for start in range(0, len(rows), 500):
+                part = [position for position, _ in rows[start:start + 500]]
+                self.length -= self.conn.execute(
+                    f"SELECT COUNT(*) FROM positions WHERE position IN ({','.join('?' * len(part))})", part
+                ).fetchone()[0]
+            self.conn.executemany("INSERT OR REPLACE INTO positions (position, id) VALUES (?, ?)", rows)
+            self.length += len(rows)
+        self.on_change()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM positions")
+        self.length = 0
+        self.on_change()
+
+    def items(self):
+        with self.lock:
+            return self.conn.execute("SELECT position, id FROM positions ORDER BY position").fetchall()
+
+    def values(self):
+        return [doc_id for _, doc_id in self.items()]
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Chunk text and metadata in one SQLite file, fetched by id only when a search returns them.
+
+    The file also holds the position -> id mapping (``index_to_docstore_id``), a BM25 index of the
+    chunk text (``lexical``) and an index of filterable metadata (``metadata_index``), both kept in
+    step with every add and delete, and a little bookkeeping. Writes stay in one open transaction until ``commit``, so other readers of the
+    file keep seeing the last saved corpus while an ingest is in progress.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Ingest may run off the event loop thread, so the connection is shared under a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets an ingest write while queries keep reading the last committed state
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY,
+                page_content TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS positions (
+                position INTEGER PRIMARY KEY,
+                id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS positions_id ON positions (id);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self.lexical = LexicalIndex(self.conn, self.lock)
+        self.metadata_index = MetadataIndex(self.conn, self.lock)
+        self.index_to_docstore_id = SQLiteIdMap(self.conn, self.lock, on_change=self.metadata_index.clear_cache)
+
+        # Saved before an index existed (or with other settings): build it from the stored chunks
+        if self.get_meta("lexical_version") != LEXICAL_VERSION:
+            with self.lock:
+                self.lexical.rebuild(self.conn.execute("SELECT id, page_content FROM docs").fetchall())
+            self.set_meta("lexical_version", LEXICAL_VERSION)
+        if self.get_meta("metadata_index_version") != METADATA_INDEX_VERSION:
+            with self.lock:
+                rows = self.conn.execute("SELECT id, metadata FROM docs").fetchall()
+                self.metadata_index.rebuild((doc_id, json.loads(metadata)) for doc_id, metadata in rows)
+            self.set_meta("metadata_index_version", METADATA_INDEX_VERSION)
+        self.commit()
+
+    def search(self, search: str):
+        with self.lock:
+            row = self.conn.execute("SELECT page_content, metadata FROM docs WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts: dict):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO docs (id, page_content, metadata) VALUES (?, ?, ?)",
+                [(doc_id, doc.page_content, json.dumps(doc.metadata)) for doc_id, doc in texts.items()],
+            )
+            self.lexical.add({doc_id: doc.page_content for doc_id, doc in texts.items()})
+            self.metadata_index.add({doc_id: doc.metadata for doc_id, doc in texts.items()})
+
+    def delete(self, ids: list):
+        with self.lock:
+            self.conn.executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in ids])
+            self.lexical.remove(ids)
+            self.metadata_index.remove(ids)
+
+    def get_positions(self, ids: list) -> dict:
+        """Get the index position of each stored chunk id (the newest, should one have been replaced)"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, position FROM positions WHERE id IN ({', '.join('?' * len(ids))}) ORDER BY position",
+                list(ids),
+            ).fetchall()
+        return dict(rows)
+
+    def get_meta(self, key: str, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key: str, value):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -1,7 +1,4 @@
 #!/bin/bash
 
-# Start the cron daemon
-cron
-
 # Start the query agent
 python rag.py
@@ -0,0 +1,146 @@
+import os
+import json
+import hashlib
+
+SYNC_STATE_DIR = os.getenv("SYNC_STATE_DIR", "sync_state")
+MANIFEST_VERSION = 1
+
+# Fields of an object record that mean "this Canvas object changed" when they differ
+CHANGE_FIELDS = ("updated_at", "size", "fingerprint")
+
+
+def get_user_key(canvas_token: str, school_domain: str) -> str:
+    """Get a stable, non-reversible key identifying one student's Canvas account"""
+    return hashlib.sha256(f"{school_domain.strip()}:{canvas_token.strip()}".encode()).hexdigest()[:16]
+
+
+def get_fingerprint(*values) -> str:
+    """Hash arbitrary JSON-able values into a short change-detection fingerprint"""
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class SyncDelta:
+    """Canvas objects added, changed or removed since the previous sync"""
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.removed_records = {}
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def summary(self) -> str:
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed"
+
+
+class SyncManifest:
+    """Persisted per-user record of every Canvas object and list response seen by the last sync.
+
+    Objects are keyed like ``course:<id>``, ``assignment:<course>:<id>`` and ``file:<course>:<id>``
+    and record ``updated_at``, ETag/Last-Modified and size. List responses are cached together with
+    their validators so a re-sync can send conditional requests and reuse the body on a 304.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.previous_objects = {}
+        self.responses = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                if state.get("version") == MANIFEST_VERSION:
+                    self.previous_objects = state.get("objects", {})
+                    self.responses = state.get("responses", {})
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Ignoring unreadable sync manifest {path}: {e}")
+        self.objects = {}
+        self.seen_responses = set()
+        self.skipped_courses = set()
+        self.delta = SyncDelta()
+
+    @classmethod
+    def for_user(cls, canvas_token: str, school_domain: str, state_dir: str = SYNC_STATE_DIR):
+        return cls(os.path.join(state_dir, f"{get_user_key(canvas_token, school_domain)}.json"))
+
+    # === Conditional list requests ===
+
+    def conditional_headers(self, request_key: str) -> dict:
+        cached = self.responses.get(request_key)
+        if not cached:
+            return {}
+        headers = {}
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        return headers
+
+    def cached_response(self, request_key: str):
+        self.seen_responses.add(request_key)
+        return self.responses.get(request_key)
+
+    def record_response(self, request_key: str, headers, data, next_url):
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        self.seen_responses.add(request_key)
+        if etag or last_modified:
+            self.responses[request_key] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "data": data,
+                "next_url": next_url,
+            }
+        else:
+            self.responses.pop(request_key, None)
+
+    # === Object tracking ===
+
+    def lookup(self, key: str):
+        """Get the record stored for an object by the previous sync"""
+        return self.previous_objects.get(key)
+
+    def is_unchanged(self, key: str, record: dict) -> bool:
+        previous = self.previous_objects.get(key)
+        if previous is None:
+            return False
+        return all(previous.get(field) == record.get(field) for field in CHANGE_FIELDS)
+
+    def observe(self, key: str, record: dict):
+        """Record an object seen during this sync and classify it into the delta"""
+        if key not in self.previous_objects:
+            self.delta.added.append(key)
+        elif not self.is_unchanged(key, record):
+            self.delta.changed.append(key)
+        self.objects[key] = record
+
+    def skip_course(self, course_id):
+        """Keep the previous records of a course that could not be harvested this time"""
+        self.skipped_courses.add(str(course_id))
+
+    def finish(self) -> SyncDelta:
+        """Work out which objects disappeared since the previous sync"""
+        for key, record in self.previous_objects.items():
+            if key in self.objects:
+                continue
+            parts = key.split(":")
+            course_id = parts[1] if len(parts) > 2 else None
+            if course_id in self.skipped_courses:
+                self.objects[key] = record
+                continue
+            self.delta.removed.append(key)
+            self.delta.removed_records[key] = record
+        return self.delta
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        # Drop cached list pages nobody asked for this time (e.g. pages that no longer exist)
+        responses = {key: value for key, value in self.responses.items() if key in self.seen_responses}
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "objects": self.objects, "responses": responses}, f)
+        os.replace(tmp_path, self.path)